@@ -0,0 +1,475 @@
+# Copyright 2013-2021 Canonical Limited.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Encode and decode Go gob streams.
+
+Gob is the encoding used by the Go net/rpc package, and therefore by the
+Juju unit agent when serving hook tools on its socket. A gob stream is a
+sequence of messages, each prefixed by its length. A message either defines
+a type, identified by a negative id, or carries a value of a previously
+defined type. Types are defined once per stream, so an Encoder or a Decoder
+must be used for a single connection.
+
+Only the subset of gob needed to talk to the agent is supported: booleans,
+integers, floats, strings, byte slices, slices, arrays, maps and structs.
+Go types are described with the Slice, Array, Map and Struct classes, or
+with the ids of the predefined types (BOOL, INT, UINT, FLOAT, BYTES and
+STRING). Struct values are Python dicts keyed by field name: as in Go, fields
+holding zero values are not transmitted, so decoded dicts only include the
+fields received.
+"""
+
+import struct
+
+
+# Define the ids of the predefined types.
+BOOL = 1
+INT = 2
+UINT = 3
+FLOAT = 4
+BYTES = 5
+STRING = 6
+COMPLEX = 7
+INTERFACE = 8
+
+# Define the lowest id of user defined types: lower ids are reserved.
+FIRST_USER_ID = 64
+
+_BUILTIN_NAMES = {
+    BOOL: 'bool',
+    INT: 'int',
+    UINT: 'uint',
+    FLOAT: 'float64',
+    BYTES: '[]uint8',
+    STRING: 'string',
+    COMPLEX: 'complex128',
+    INTERFACE: 'interface',
+}
+
+
+class GobError(Exception):
+    """The gob stream is not valid or uses unsupported features."""
+
+
+class Slice(object):
+    """A Go slice of elements of the given type."""
+
+    def __init__(self, elem, name=None):
+        self.elem = elem
+        self.name = name or '[]{}'.format(_type_name(elem))
+
+
+class Array(object):
+    """A Go array of the given length."""
+
+    def __init__(self, elem, length, name=None):
+        self.elem = elem
+        self.length = length
+        self.name = name or '[{}]{}'.format(length, _type_name(elem))
+
+
+class Map(object):
+    """A Go map from keys to elements of the given types."""
+
+    def __init__(self, key, elem, name=None):
+        self.key = key
+        self.elem = elem
+        self.name = name or 'map[{}]{}'.format(
+            _type_name(key), _type_name(elem))
+
+
+class Struct(object):
+    """A Go struct: fields is a sequence of (name, type) pairs."""
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = tuple(fields)
+
+
+class Opaque(object):
+    """A Go type encoding itself, e.g. with a GobEncode method.
+
+    Values are decoded as the bytes produced by the Go encoder.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+
+def _type_name(gob_type):
+    if isinstance(gob_type, int):
+        return _BUILTIN_NAMES.get(gob_type, str(gob_type))
+    return gob_type.name
+
+
+# Define the types describing types, which are predefined as well.
+_COMMON_TYPE = Struct('CommonType', [('Name', STRING), ('Id', INT)])
+_ARRAY_TYPE = Struct('arrayType', [
+    ('CommonType', _COMMON_TYPE), ('Elem', INT), ('Len', INT)])
+_SLICE_TYPE = Struct('sliceType', [
+    ('CommonType', _COMMON_TYPE), ('Elem', INT)])
+_FIELD_TYPE = Struct('fieldType', [('Name', STRING), ('Id', INT)])
+_FIELD_TYPES = Slice(_FIELD_TYPE)
+_STRUCT_TYPE = Struct('structType', [
+    ('CommonType', _COMMON_TYPE), ('Field', _FIELD_TYPES)])
+_MAP_TYPE = Struct('mapType', [
+    ('CommonType', _COMMON_TYPE), ('Key', INT), ('Elem', INT)])
+_GOB_ENCODER_TYPE = Struct('gobEncoderType', [('CommonType', _COMMON_TYPE)])
+_WIRE_TYPE = Struct('wireType', [
+    ('ArrayT', _ARRAY_TYPE),
+    ('SliceT', _SLICE_TYPE),
+    ('StructT', _STRUCT_TYPE),
+    ('MapT', _MAP_TYPE),
+    ('GobEncoderT', _GOB_ENCODER_TYPE),
+    ('BinaryMarshalerT', _GOB_ENCODER_TYPE),
+    ('TextMarshalerT', _GOB_ENCODER_TYPE),
+])
+
+_PREDEFINED_TYPES = {
+    16: _WIRE_TYPE,
+    17: _ARRAY_TYPE,
+    18: _COMMON_TYPE,
+    19: _SLICE_TYPE,
+    20: _STRUCT_TYPE,
+    21: _FIELD_TYPE,
+    22: _FIELD_TYPES,
+    23: _MAP_TYPE,
+}
+
+
+class Encoder(object):
+    """Encode values as gob messages.
+
+    Type definitions are only included in the messages the first time a type
+    is used.
+    """
+
+    def __init__(self):
+        self._ids = {}
+        self._sent = set()
+        self._next_id = FIRST_USER_ID
+
+    def encode(self, gob_type, value):
+        """Return the messages encoding the value of the given type."""
+        data = bytearray()
+        type_id = self._type_id(gob_type)
+        self._define(gob_type, data)
+        message = bytearray()
+        _encode_int(message, type_id)
+        if not isinstance(gob_type, Struct):
+            # Values which are not structs are framed as a single field.
+            _encode_uint(message, 0)
+        self._encode_value(message, gob_type, value)
+        _encode_uint(data, len(message))
+        data.extend(message)
+        return bytes(data)
+
+    def _type_id(self, gob_type):
+        """Return the id of the type, assigning ids to new types."""
+        if isinstance(gob_type, int):
+            return gob_type
+        type_id = self._ids.get(gob_type)
+        if type_id is None:
+            type_id = self._ids[gob_type] = self._next_id
+            self._next_id += 1
+            for inner in _inner_types(gob_type):
+                self._type_id(inner)
+        return type_id
+
+    def _define(self, gob_type, data):
+        """Append the definitions of the type and its inner types, if new."""
+        if isinstance(gob_type, int) or gob_type in self._sent:
+            return
+        self._sent.add(gob_type)
+        type_id = self._ids[gob_type]
+        common = {'Name': gob_type.name, 'Id': type_id}
+        if isinstance(gob_type, Slice):
+            wire = {'SliceT': {
+                'CommonType': common, 'Elem': self._type_id(gob_type.elem)}}
+        elif isinstance(gob_type, Array):
+            wire = {'ArrayT': {
+                'CommonType': common, 'Elem': self._type_id(gob_type.elem),
+                'Len': gob_type.length}}
+        elif isinstance(gob_type, Map):
+            wire = {'MapT': {
+                'CommonType': common, 'Key': self._type_id(gob_type.key),
+                'Elem': self._type_id(gob_type.elem)}}
+        elif isinstance(gob_type, Struct):
+            wire = {'StructT': {'CommonType': common, 'Field': [
+                {'Name': name, 'Id': self._type_id(field_type)}
+                for name, field_type in gob_type.fields]}}
+        else:
+            raise GobError('cannot encode type {}'.format(gob_type.name))
+        message = bytearray()
+        _encode_int(message, -type_id)
+        self._encode_value(message, _WIRE_TYPE, wire)
+        _encode_uint(data, len(message))
+        data.extend(message)
+        for inner in _inner_types(gob_type):
+            self._define(inner, data)
+
+    def _encode_value(self, data, gob_type, value):
+        if gob_type == BOOL:
+            _encode_uint(data, 1 if value else 0)
+        elif gob_type == INT:
+            _encode_int(data, value)
+        elif gob_type == UINT:
+            _encode_uint(data, value)
+        elif gob_type == FLOAT:
+            _encode_uint(data, _float_bits(value))
+        elif gob_type in (BYTES, STRING):
+            if not isinstance(value, bytes):
+                value = value.encode('utf-8')
+            _encode_uint(data, len(value))
+            data.extend(value)
+        elif isinstance(gob_type, (Slice, Array)):
+            _encode_uint(data, len(value))
+            for elem in value:
+                self._encode_value(data, gob_type.elem, elem)
+        elif isinstance(gob_type, Map):
+            _encode_uint(data, len(value))
+            for key in sorted(value):
+                self._encode_value(data, gob_type.key, key)
+                self._encode_value(data, gob_type.elem, value[key])
+        elif isinstance(gob_type, Struct):
+            previous = -1
+            for index, (name, field_type) in enumerate(gob_type.fields):
+                field = value.get(name)
+                if _is_zero(field):
+                    continue
+                _encode_uint(data, index - previous)
+                self._encode_value(data, field_type, field)
+                previous = index
+            _encode_uint(data, 0)
+        else:
+            raise GobError('cannot encode type {}'.format(
+                _type_name(gob_type)))
+
+
+class Decoder(object):
+    """Decode the values from a gob stream.
+
+    The read argument is called with a number of bytes, and it returns at
+    most that many bytes from the stream, or fewer at the end of the stream.
+    """
+
+    def __init__(self, read):
+        self._read = read
+        self._types = dict(_PREDEFINED_TYPES)
+
+    def decode(self):
+        """Return the next value, after reading any type definitions.
+
+        Raise an EOFError if the stream ends before the value, or a GobError
+        if it is not valid.
+        """
+        while True:
+            message = _Buffer(self._read_exactly(self._read_length()))
+            type_id = message.int()
+            if type_id < 0:
+                self._receive_type(-type_id, message)
+                continue
+            gob_type = self._lookup(type_id)
+            if not isinstance(self._resolve(gob_type), Struct):
+                if message.uint() != 0:
+                    raise GobError('invalid value framing')
+            value = self._decode_value(message, gob_type)
+            if not message.exhausted():
+                raise GobError('extra data in message')
+            return value
+
+    def _read_length(self):
+        first = self._read_exactly(1)[0]
+        if first < 0x80:
+            return first
+        return int.from_bytes(self._read_exactly(256 - first), 'big')
+
+    def _read_exactly(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self._read(size - len(data))
+            if not chunk:
+                raise EOFError('unexpected end of the gob stream')
+            data += chunk
+        return data
+
+    def _receive_type(self, type_id, message):
+        if type_id < FIRST_USER_ID or type_id in self._types:
+            raise GobError('invalid type id {}'.format(type_id))
+        wire = self._decode_value(message, _WIRE_TYPE)
+        if not message.exhausted():
+            raise GobError('extra data in type definition')
+        if 'SliceT' in wire:
+            definition = wire['SliceT']
+            gob_type = Slice(definition.get('Elem', 0),
+                             name=_name(definition))
+        elif 'ArrayT' in wire:
+            definition = wire['ArrayT']
+            gob_type = Array(definition.get('Elem', 0),
+                             definition.get('Len', 0), name=_name(definition))
+        elif 'MapT' in wire:
+            definition = wire['MapT']
+            gob_type = Map(definition.get('Key', 0), definition.get('Elem', 0),
+                           name=_name(definition))
+        elif 'StructT' in wire:
+            definition = wire['StructT']
+            gob_type = Struct(_name(definition), [
+                (field.get('Name', ''), field.get('Id', 0))
+                for field in definition.get('Field', [])])
+        else:
+            definition = list(wire.values())[0] if wire else {}
+            gob_type = Opaque(_name(definition))
+        self._types[type_id] = gob_type
+
+    def _lookup(self, type_id):
+        if type_id in _BUILTIN_NAMES or type_id in self._types:
+            return type_id
+        raise GobError('unknown type id {}'.format(type_id))
+
+    def _resolve(self, gob_type):
+        """Return the type described by gob_type, which can be an id."""
+        if isinstance(gob_type, int):
+            gob_type = self._types.get(self._lookup(gob_type), gob_type)
+        return gob_type
+
+    def _decode_value(self, message, gob_type):
+        gob_type = self._resolve(gob_type)
+        if gob_type == BOOL:
+            return message.uint() != 0
+        if gob_type == INT:
+            return message.int()
+        if gob_type == UINT:
+            return message.uint()
+        if gob_type == FLOAT:
+            return _float_from_bits(message.uint())
+        if gob_type == COMPLEX:
+            real = _float_from_bits(message.uint())
+            return complex(real, _float_from_bits(message.uint()))
+        if gob_type == BYTES:
+            return message.read(message.uint())
+        if gob_type == STRING:
+            return message.read(message.uint()).decode('utf-8', 'replace')
+        if isinstance(gob_type, Opaque):
+            return message.read(message.uint())
+        if isinstance(gob_type, Slice):
+            return [self._decode_value(message, gob_type.elem)
+                    for _ in range(message.uint())]
+        if isinstance(gob_type, Array):
+            length = message.uint()
+            if length != gob_type.length:
+                raise GobError('invalid array length {}'.format(length))
+            return [self._decode_value(message, gob_type.elem)
+                    for _ in range(length)]
+        if isinstance(gob_type, Map):
+            value = {}
+            for _ in range(message.uint()):
+                key = self._decode_value(message, gob_type.key)
+                value[key] = self._decode_value(message, gob_type.elem)
+            return value
+        if isinstance(gob_type, Struct):
+            value = {}
+            index = -1
+            while True:
+                delta = message.uint()
+                if not delta:
+                    return value
+                index += delta
+                if index >= len(gob_type.fields):
+                    raise GobError('invalid field of {}'.format(
+                        gob_type.name))
+                name, field_type = gob_type.fields[index]
+                value[name] = self._decode_value(message, field_type)
+        raise GobError('cannot decode type {}'.format(_type_name(gob_type)))
+
+
+class _Buffer(object):
+    """Read the primitive values of a message."""
+
+    def __init__(self, data):
+        self._data = data
+        self._offset = 0
+
+    def exhausted(self):
+        return self._offset == len(self._data)
+
+    def read(self, size):
+        end = self._offset + size
+        if end > len(self._data):
+            raise GobError('truncated message')
+        data = self._data[self._offset:end]
+        self._offset = end
+        return data
+
+    def uint(self):
+        first = self.read(1)[0]
+        if first < 0x80:
+            return first
+        size = 256 - first
+        if size > 8:
+            raise GobError('invalid unsigned integer')
+        return int.from_bytes(self.read(size), 'big')
+
+    def int(self):
+        value = self.uint()
+        if value & 1:
+            return ~(value >> 1)
+        return value >> 1
+
+
+def _encode_uint(data, value):
+    """Append the unsigned integer: one byte if small, or its byte count
+    negated followed by its big endian bytes."""
+    if value < 0x80:
+        data.append(value)
+        return
+    size = (value.bit_length() + 7) // 8
+    data.append(256 - size)
+    data.extend(value.to_bytes(size, 'big'))
+
+
+def _encode_int(data, value):
+    """Append the signed integer, with its sign in the lowest bit."""
+    if value < 0:
+        _encode_uint(data, (~value << 1) | 1)
+    else:
+        _encode_uint(data, value << 1)
+
+
+def _float_bits(value):
+    """Return the float as an unsigned integer with its bytes reversed."""
+    return int.from_bytes(struct.pack('<d', value), 'big')
+
+
+def _float_from_bits(bits):
+    return struct.unpack('<d', bits.to_bytes(8, 'big'))[0]
+
+
+def _is_zero(value):
+    return value is None or value is False or (
+        not isinstance(value, bool) and value in (0, '', b'')) or (
+        isinstance(value, (list, tuple, dict)) and not value)
+
+
+def _inner_types(gob_type):
+    if isinstance(gob_type, (Slice, Array)):
+        return [gob_type.elem]
+    if isinstance(gob_type, Map):
+        return [gob_type.key, gob_type.elem]
+    if isinstance(gob_type, Struct):
+        return [field_type for _, field_type in gob_type.fields]
+    return []
+
+
+def _name(definition):
+    return definition.get('CommonType', {}).get('Name', '')
@@ -18,11 +18,13 @@
 #  Charm Helpers Developers <juju@lists.ubuntu.com>
 
 import copy
+from concurrent.futures import ThreadPoolExecutor
 from distutils.version import LooseVersion
 from enum import Enum
 from functools import wraps
 from collections import namedtuple, UserDict
 import glob
+import hashlib
 import os
 import json
 import yaml
@@ -31,9 +33,14 @@ import subprocess
 import sys
 import errno
 import tempfile
+import threading
 from subprocess import CalledProcessError
 
 from charmhelpers import deprecate
+from charmhelpers.core import (
+    hooktool,
+    unitdata,
+)
 
 
 CRITICAL = "CRITICAL"
@@ -44,6 +51,8 @@ DEBUG = "DEBUG"
 TRACE = "TRACE"
 MARKER = object()
 SH_MAX_ARG = 131071
+# Maximum number of hook tools run concurrently by relation_get_units.
+RELATION_GET_WORKERS = 8
 
 
 RANGE_WARNING = ('Passing NO_PROXY string that includes a cidr. '
@@ -60,6 +69,37 @@ class WORKLOAD_STATES(Enum):
 
 cache = {}
 
+# Statistics about the function cache, see cache_info.
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'size'])
+_cache_stats = {'hits': 0, 'misses': 0}
+
+# Lock held while the cache is read or updated, so that cached functions can
+# be called from several threads. Cached functions run without holding it.
+_cache_lock = threading.RLock()
+
+
+def _cache_key(func, args, kwargs):
+    """Return the key used to cache the result of func called with args.
+
+    Keys are tuples, so that they are cheap to build and to compare. Keyword
+    arguments are sorted, so that their order does not matter. Arguments
+    which cannot be hashed, like lists, are serialized as JSON instead.
+    """
+    key = (func, args, tuple(sorted(kwargs.items())) if kwargs else ())
+    try:
+        hash(key)
+    except TypeError:
+        return (func, json.dumps((args, kwargs), sort_keys=True, default=str))
+    return key
+
+
+def _key_values(key):
+    """Return the function name and argument values found in a cache key."""
+    func, args = key[0], key[1]
+    if isinstance(args, str):
+        return [func.__name__, args]
+    return [func.__name__] + list(args) + [value for _, value in key[2]]
+
 
 def cached(func):
     """Cache return values for multiple executions of func + args
@@ -76,28 +116,93 @@ def cached(func):
     """
     @wraps(func)
     def wrapper(*args, **kwargs):
-        global cache
-        key = json.dumps((func, args, kwargs), sort_keys=True, default=str)
-        try:
-            return cache[key]
-        except KeyError:
-            pass  # Drop out of the exception handler scope.
+        key = _cache_key(func, args, kwargs)
+        with _cache_lock:
+            try:
+                res = cache[key]
+            except KeyError:
+                pass  # Drop out of the exception handler scope.
+            else:
+                _cache_stats['hits'] += 1
+                return res
+            _cache_stats['misses'] += 1
         res = func(*args, **kwargs)
-        cache[key] = res
+        with _cache_lock:
+            cache[key] = res
         return res
     wrapper._wrapped = func
     return wrapper
 
 
+def cache_info():
+    """Return statistics about the function cache.
+
+    Every hit is a hook tool which did not need to run.
+
+    :returns: The number of hits and misses since the hook started, and the
+              current number of cached results.
+    :rtype: CacheInfo
+    """
+    with _cache_lock:
+        return CacheInfo(
+            _cache_stats['hits'], _cache_stats['misses'], len(cache))
+
+
 def flush(key):
     """Flushes any entries from function cache where the
     key is found in the function+args """
-    flush_list = []
-    for item in cache:
-        if key in item:
-            flush_list.append(item)
-    for item in flush_list:
-        del cache[item]
+    with _cache_lock:
+        flush_list = []
+        for item in cache:
+            for value in _key_values(item):
+                if isinstance(value, str) and key in value:
+                    flush_list.append(item)
+                    break
+        for item in flush_list:
+            del cache[item]
+
+
+def flush_relation(relation_id, unit=None):
+    """Flush cached relation data for the given relation id.
+
+    If unit is provided, only the data involving that unit (or application)
+    is flushed. Results aggregating all the relations are always flushed.
+    """
+    with _cache_lock:
+        flush_list = []
+        for item in cache:
+            if item[0] is relations._wrapped:
+                flush_list.append(item)
+                continue
+            values = _key_values(item)
+            if relation_id in values and (unit is None or unit in values):
+                flush_list.append(item)
+        for item in flush_list:
+            del cache[item]
+
+
+def _relation_write_through(relation_id, owner, settings, app):
+    """Update the cache after settings are set for owner on a relation.
+
+    The owner is the local unit, or the local application if app is True.
+    Cached data involving the owner on the relation is flushed, and the full
+    data of the owner is updated if it was cached. Values are stored as
+    strings, as relation_set serializes them.
+    """
+    kwargs = {'rid': relation_id, 'app' if app else 'unit': owner}
+    key = _cache_key(relation_get._wrapped, (), kwargs)
+    with _cache_lock:
+        previous = cache.get(key)
+        flush_relation(relation_id, owner)
+        if previous is None:
+            return
+        data = dict(previous)
+        for name, value in settings.items():
+            if value in (None, ''):
+                data.pop(name, None)
+            else:
+                data[name] = '{}'.format(value)
+        cache[key] = data
 
 
 def log(message, level=None):
@@ -111,7 +216,7 @@ def log(message, level=None):
     # Missing juju-log should not cause failures in unit tests
     # Send log output to stderr
     try:
-        subprocess.call(command)
+        hooktool.call(command)
     except OSError as e:
         if e.errno == errno.ENOENT:
             if level:
@@ -441,7 +546,7 @@ def config(scope=None):
     try:
         if _cache_config is None:
             config_data = json.loads(
-                subprocess.check_output(config_cmd_line).decode('UTF-8'))
+                hooktool.check_output(config_cmd_line).decode('UTF-8'))
             _cache_config = Config(config_data)
         if scope is not None:
             return _cache_config.get(scope)
@@ -469,7 +574,7 @@ def relation_get(attribute=None, unit=None, rid=None, app=None):
     if unit or app:
         _args.append(unit or app)
     try:
-        return json.loads(subprocess.check_output(_args).decode('UTF-8'))
+        return json.loads(hooktool.check_output(_args).decode('UTF-8'))
     except ValueError:
         return None
     except CalledProcessError as e:
@@ -490,7 +595,7 @@ def _relation_set_accepts_file():
     :rtype: bool
     :raises: subprocess.CalledProcessError if the check fails.
     """
-    return "--file" in subprocess.check_output(
+    return "--file" in hooktool.check_output(
         ["relation-set", "--help"], universal_newlines=True)
 
 
@@ -516,7 +621,7 @@ def relation_set(relation_id=None, relation_settings=None, app=False, **kwargs):
         # stdin, but that feature is broken in 1.23.2: Bug #1454678.
         with tempfile.NamedTemporaryFile(delete=False) as settings_file:
             settings_file.write(yaml.safe_dump(settings).encode("utf-8"))
-        subprocess.check_call(
+        hooktool.check_call(
             relation_cmd_line + ["--file", settings_file.name])
         os.remove(settings_file.name)
     else:
@@ -525,9 +630,66 @@ def relation_set(relation_id=None, relation_settings=None, app=False, **kwargs):
                 relation_cmd_line.append('{}='.format(key))
             else:
                 relation_cmd_line.append('{}={}'.format(key, value))
-        subprocess.check_call(relation_cmd_line)
-    # Flush cache of any relation-gets for local unit
-    flush(local_unit())
+        hooktool.check_call(relation_cmd_line)
+    # Update cached relation-gets for the local unit or application.
+    if relation_id is None:
+        relation_id = os.environ.get('JUJU_RELATION_ID')
+    _relation_write_through(
+        relation_id, application_name() if app else local_unit(), settings,
+        app)
+
+
+# Prefix of the unit key/value store keys holding published data hashes.
+_RELATION_HASH_PREFIX = 'hookenv.relation_set_changed.'
+# Hashes of the data published during this hook, stored when it succeeds.
+_relation_hashes = {}
+
+
+def relation_set_changed(relation_id=None, relation_settings=None, app=False,
+                         **kwargs):
+    """Set relation information for the current unit if it changed.
+
+    Every relation-set triggers a relation-changed hook on all the remote
+    units, so the hash of the data last published on each relation is kept
+    in the unit key/value store, and relation-set is skipped when the data
+    is the same. Hashes are only stored when the hook completes successfully,
+    since Juju discards the relation settings of failed hooks. Data published
+    with relation_set or relation_clear is not tracked.
+
+    :returns: True if the data has been published, False otherwise.
+    :rtype: bool
+    """
+    if relation_id is None:
+        # The relation_id function is shadowed by the argument.
+        relation_id = os.environ.get('JUJU_RELATION_ID')
+    settings = dict(relation_settings or {}, **kwargs)
+    for key, value in settings.items():
+        if value is not None:
+            settings[key] = "{}".format(value)
+    digest = hashlib.sha256(
+        json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()
+    key = '{}{}{}'.format(
+        _RELATION_HASH_PREFIX, relation_id, ':app' if app else '')
+    if key in _relation_hashes:
+        previous = _relation_hashes[key]
+    else:
+        previous = unitdata.kv().get(key)
+    if digest == previous:
+        return False
+    relation_set(relation_id, settings, app=app)
+    if not _relation_hashes:
+        atexit(_store_relation_hashes)
+    _relation_hashes[key] = digest
+    return True
+
+
+def _store_relation_hashes():
+    """Store the hashes of the data published during this hook."""
+    kv = unitdata.kv()
+    for key, digest in _relation_hashes.items():
+        kv.set(key, digest)
+    kv.flush()
+    _relation_hashes.clear()
 
 
 def relation_clear(r_id=None):
@@ -549,7 +711,7 @@ def relation_ids(reltype=None):
     if reltype is not None:
         relid_cmd_line.append(reltype)
         return json.loads(
-            subprocess.check_output(relid_cmd_line).decode('UTF-8')) or []
+            hooktool.check_output(relid_cmd_line).decode('UTF-8')) or []
     return []
 
 
@@ -561,7 +723,7 @@ def related_units(relid=None):
     if relid is not None:
         units_cmd_line.extend(('-r', relid))
     return json.loads(
-        subprocess.check_output(units_cmd_line).decode('UTF-8')) or []
+        hooktool.check_output(units_cmd_line).decode('UTF-8')) or []
 
 
 def expected_peer_units():
@@ -661,6 +823,38 @@ def relations_of_type(reltype=None):
     return relation_data
 
 
+def relation_get_units(reltype=None, max_workers=RELATION_GET_WORKERS):
+    """Get the relation data of all units related through reltype.
+
+    The related units of each relation, then the data of each unit, are
+    fetched concurrently using up to max_workers hook tools at a time, which
+    overlaps the cost of starting the hook tools, or of the round trips to
+    the agent, with the time the agent spends serving them. The results are
+    stored in the relation_ids, related_units and relation_get caches, so
+    that later calls for the same units do not run hook tools.
+
+    :param reltype: The relation name, defaulting to the current relation.
+    :param max_workers: The maximum number of concurrent hook tools.
+    :returns: A list of (relation id, unit, data) tuples, sorted by relation
+              id then by unit name. The data is None if the unit did not set
+              any.
+    :rtype: List[Tuple[str, str, Optional[Dict[str, str]]]]
+    """
+    relids = sorted(relation_ids(reltype))
+    if not relids:
+        return []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        units = executor.map(related_units, relids)
+        pairs = [
+            (relid, unit)
+            for relid, relid_units in zip(relids, units)
+            for unit in sorted(relid_units)]
+        data = executor.map(
+            lambda pair: relation_get(rid=pair[0], unit=pair[1]), pairs)
+        return [(relid, unit, reldata)
+                for (relid, unit), reldata in zip(pairs, data)]
+
+
 @cached
 def metadata():
     """Get the current charm metadata.yaml contents as a python object"""
@@ -819,7 +1013,7 @@ def _port_op(op_name, port, protocol="TCP"):
     else:
         _args.append('{}/{}'.format(port, protocol))
     try:
-        subprocess.check_call(_args)
+        hooktool.check_call(_args)
     except subprocess.CalledProcessError:
         # Older Juju pre 2.3 doesn't support ICMP
         # so treat it as a no-op if it fails.
@@ -841,14 +1035,14 @@ def open_ports(start, end, protocol="TCP"):
     """Opens a range of service network ports"""
     _args = ['open-port']
     _args.append('{}-{}/{}'.format(start, end, protocol))
-    subprocess.check_call(_args)
+    hooktool.check_call(_args)
 
 
 def close_ports(start, end, protocol="TCP"):
     """Close a range of service network ports"""
     _args = ['close-port']
     _args.append('{}-{}/{}'.format(start, end, protocol))
-    subprocess.check_call(_args)
+    hooktool.check_call(_args)
 
 
 def opened_ports():
@@ -867,7 +1061,7 @@ def unit_get(attribute):
     """Get the unit ID for the remote unit"""
     _args = ['unit-get', '--format=json', attribute]
     try:
-        return json.loads(subprocess.check_output(_args).decode('UTF-8'))
+        return json.loads(hooktool.check_output(_args).decode('UTF-8'))
     except ValueError:
         return None
 
@@ -1141,7 +1335,7 @@ def status_set(workload_state, message, application=False):
         cmd.append('--application')
     cmd.extend([workload_state.value, message])
     try:
-        ret = subprocess.call(cmd)
+        ret = hooktool.call(cmd)
         if ret == 0:
             return
     except OSError as e:
@@ -1215,14 +1409,15 @@ def is_leader():
     Uses juju to determine whether the current unit is the leader of its peers
     """
     cmd = ['is-leader', '--format=json']
-    return json.loads(subprocess.check_output(cmd).decode('UTF-8'))
+    return json.loads(hooktool.check_output(cmd).decode('UTF-8'))
 
 
+@cached
 @translate_exc(from_exc=OSError, to_exc=NotImplementedError)
 def leader_get(attribute=None):
     """Juju leader get value(s)"""
     cmd = ['leader-get', '--format=json'] + [attribute or '-']
-    return json.loads(subprocess.check_output(cmd).decode('UTF-8'))
+    return json.loads(hooktool.check_output(cmd).decode('UTF-8'))
 
 
 @translate_exc(from_exc=OSError, to_exc=NotImplementedError)
@@ -1238,7 +1433,23 @@ def leader_set(settings=None, **kwargs):
             cmd.append('{}='.format(k))
         else:
             cmd.append('{}={}'.format(k, v))
-    subprocess.check_call(cmd)
+    hooktool.check_call(cmd)
+    # Update cached leader-gets.
+    key = _cache_key(leader_get._wrapped, (), {})
+    with _cache_lock:
+        if key in cache:
+            data = dict(cache[key])
+            for k, v in settings.items():
+                if v in (None, ''):
+                    data.pop(k, None)
+                else:
+                    data[k] = '{}'.format(v)
+            cache[key] = data
+        for k, v in settings.items():
+            value = None if v in (None, '') else '{}'.format(v)
+            cache[_cache_key(leader_get._wrapped, (k,), {})] = value
+            cache.pop(
+                _cache_key(leader_get._wrapped, (), {'attribute': k}), None)
 
 
 @translate_exc(from_exc=OSError, to_exc=NotImplementedError)
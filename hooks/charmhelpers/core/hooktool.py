@@ -0,0 +1,393 @@
+# Copyright 2013-2021 Canonical Limited.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Run Juju hook tools through the unit agent socket.
+
+Hook tools like relation-get are small executables which connect to the unit
+agent and forward their arguments to it. Forking one process per call is
+expensive in hooks dealing with many related units, so requests are instead
+sent directly on the agent socket, as the hook tools do: the agent serves the
+Jujuc.Main method with the Go net/rpc protocol, using the gob codec. A
+connection is opened for each thread and reused for the whole hook.
+
+Hook tools are run as subprocesses when the socket is not available, i.e.
+when the JUJU_AGENT_SOCKET_ADDRESS (or JUJU_AGENT_SOCKET) environment
+variable is not set or the socket is not a unix socket, or when the agent
+does not answer as expected, in which case the socket is not used again.
+
+The StandInAgent class serves the same protocol locally, so that the
+transport can be exercised in tests and benchmarks without a Juju agent.
+"""
+
+import itertools
+import os
+import socket
+import socketserver
+import subprocess
+import tempfile
+import threading
+from subprocess import CalledProcessError
+
+from charmhelpers.core import gob
+
+
+# Define the RPC method run by the hook tools on the agent.
+METHOD = 'Jujuc.Main'
+
+# Define the number of seconds after which requests to the agent are
+# abandoned. Hook tools can be slow, e.g. when the controller is busy.
+TIMEOUT = 300
+
+# Define the Go types exchanged with the agent: the net/rpc request and
+# response headers, and the hook tool request and response bodies.
+RPC_REQUEST = gob.Struct('Request', [
+    ('ServiceMethod', gob.STRING),
+    ('Seq', gob.UINT),
+])
+RPC_RESPONSE = gob.Struct('Response', [
+    ('ServiceMethod', gob.STRING),
+    ('Seq', gob.UINT),
+    ('Error', gob.STRING),
+])
+REQUEST = gob.Struct('Request', [
+    ('ContextId', gob.STRING),
+    ('Dir', gob.STRING),
+    ('CommandName', gob.STRING),
+    ('Args', gob.Slice(gob.STRING)),
+    ('StdinSet', gob.BOOL),
+    ('Stdin', gob.BYTES),
+])
+EXEC_RESPONSE = gob.Struct('ExecResponse', [
+    ('Code', gob.INT),
+    ('Stdout', gob.BYTES),
+    ('Stderr', gob.BYTES),
+])
+
+# Define the body sent by net/rpc servers along with errors.
+_INVALID_REQUEST = gob.Struct('', [])
+
+
+class TransportError(Exception):
+    """The agent cannot be reached or it does not speak the protocol."""
+
+
+class AgentTransport(object):
+    """Send hook tool requests to the unit agent.
+
+    Each thread uses its own connection, so that requests can be sent
+    concurrently.
+    """
+
+    def __init__(self, address, network='unix', context_id='',
+                 timeout=TIMEOUT):
+        self.address = address
+        self.network = network
+        self.context_id = context_id
+        self.timeout = timeout
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def run(self, args):
+        """Run the hook tool described by args on the agent.
+
+        Return a (code, stdout, stderr) tuple, where the outputs are bytes.
+        Raise a TransportError if the agent cannot be reached or its response
+        is not valid.
+        """
+        request = {
+            'ContextId': self.context_id,
+            'Dir': os.getcwd(),
+            'CommandName': args[0],
+            'Args': list(args[1:]),
+        }
+        connection = getattr(self._local, 'connection', None)
+        try:
+            if connection is None:
+                connection = self._connect()
+            response = connection.call(METHOD, REQUEST, request)
+        except (EOFError, gob.GobError, socket.error) as err:
+            self._discard(connection)
+            raise TransportError('cannot talk to the agent: {}'.format(err))
+        except TransportError:
+            self._discard(connection)
+            raise
+        return (
+            response.get('Code', 0),
+            response.get('Stdout', b''),
+            response.get('Stderr', b''))
+
+    def close(self):
+        """Close all the connections to the agent."""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            connection.close()
+        self._local = threading.local()
+
+    def _connect(self):
+        if self.network != 'unix':
+            raise TransportError(
+                'unsupported network {}'.format(self.network))
+        address = self.address
+        if address.startswith('@'):
+            # Go uses a leading @ for the abstract socket namespace.
+            address = '\0' + address[1:]
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(address)
+        except socket.error:
+            sock.close()
+            raise
+        connection = _Connection(sock)
+        with self._lock:
+            self._connections.append(connection)
+        self._local.connection = connection
+        return connection
+
+    def _discard(self, connection):
+        self._local.connection = None
+        if connection is None:
+            return
+        with self._lock:
+            if connection in self._connections:
+                self._connections.remove(connection)
+        connection.close()
+
+
+class _Connection(object):
+    """A net/rpc client connection, using the gob codec."""
+
+    def __init__(self, sock):
+        self._socket = sock
+        self._file = sock.makefile('rb')
+        self._encoder = gob.Encoder()
+        self._decoder = gob.Decoder(self._file.read)
+        self._seq = itertools.count()
+
+    def call(self, method, body_type, body):
+        """Call the method and return the decoded response body."""
+        seq = next(self._seq)
+        header = {'ServiceMethod': method, 'Seq': seq}
+        self._socket.sendall(
+            self._encoder.encode(RPC_REQUEST, header) +
+            self._encoder.encode(body_type, body))
+        header = self._decoder.decode()
+        response = self._decoder.decode()
+        if header.get('Seq', 0) != seq:
+            raise TransportError('unexpected sequence number {}'.format(
+                header.get('Seq', 0)))
+        if header.get('Error'):
+            raise TransportError(header['Error'])
+        return response
+
+    def close(self):
+        self._file.close()
+        self._socket.close()
+
+
+# The transport in use: None if not set up yet, False if disabled.
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_transport():
+    """Return the agent transport, or None if the socket is not available.
+
+    The socket is described by the JUJU_AGENT_SOCKET_ADDRESS (or
+    JUJU_AGENT_SOCKET) and JUJU_AGENT_SOCKET_NETWORK environment variables.
+    """
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            address = os.environ.get(
+                'JUJU_AGENT_SOCKET_ADDRESS',
+                os.environ.get('JUJU_AGENT_SOCKET'))
+            network = os.environ.get('JUJU_AGENT_SOCKET_NETWORK', 'unix')
+            _transport = False
+            # Agents listening on TCP sockets require TLS.
+            if address and network == 'unix':
+                _transport = AgentTransport(
+                    address, network=network,
+                    context_id=os.environ.get('JUJU_CONTEXT_ID', ''))
+        return _transport or None
+
+
+def reset():
+    """Close the agent connections and set up the transport again if needed.
+
+    This is mostly useful in tests, after changing the environment.
+    """
+    global _transport
+    with _transport_lock:
+        if _transport:
+            _transport.close()
+        _transport = None
+
+
+def _run(args):
+    """Run the hook tool on the agent.
+
+    Return a (code, stdout, stderr) tuple, or None if the tool must be run as
+    a subprocess, in which case the agent transport is disabled for the rest
+    of the process.
+    """
+    global _transport
+    transport = get_transport()
+    if transport is None:
+        return None
+    try:
+        return transport.run(args)
+    except TransportError:
+        with _transport_lock:
+            if _transport is transport:
+                _transport = False
+        transport.close()
+        return None
+
+
+def check_output(args, universal_newlines=False):
+    """Run the hook tool and return its output, like subprocess.check_output.
+
+    Raise a CalledProcessError if the tool fails.
+    """
+    response = _run(args)
+    if response is None:
+        return subprocess.check_output(
+            args, universal_newlines=universal_newlines)
+    code, stdout, stderr = response
+    if code:
+        raise CalledProcessError(code, args, output=stdout, stderr=stderr)
+    if universal_newlines:
+        return stdout.decode('utf-8')
+    return stdout
+
+
+def check_call(args):
+    """Run the hook tool, like subprocess.check_call.
+
+    Raise a CalledProcessError if the tool fails.
+    """
+    response = _run(args)
+    if response is None:
+        return subprocess.check_call(args)
+    code, stdout, stderr = response
+    if code:
+        raise CalledProcessError(code, args, output=stdout, stderr=stderr)
+    return 0
+
+
+def call(args):
+    """Run the hook tool and return its exit code, like subprocess.call."""
+    response = _run(args)
+    if response is None:
+        return subprocess.call(args)
+    return response[0]
+
+
+class StandInAgent(object):
+    """A local server answering hook tool requests like the unit agent.
+
+    The handler is called with the command name and its arguments, and it
+    returns a (code, stdout, stderr) tuple, where the outputs are strings or
+    bytes. Requests are recorded in the requests attribute as (command name,
+    arguments) tuples. Use the agent as a context manager: the socket address
+    is available in the address attribute, and the environment() method
+    returns the variables pointing hook tools to it.
+    """
+
+    def __init__(self, handler, context_id='stand-in'):
+        self.handler = handler
+        self.context_id = context_id
+        self.requests = []
+        self._dir = tempfile.mkdtemp()
+        self.address = os.path.join(self._dir, 'agent.socket')
+        self._server = None
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def environment(self):
+        """Return the environment variables pointing to this agent."""
+        return {
+            'JUJU_AGENT_SOCKET_ADDRESS': self.address,
+            'JUJU_AGENT_SOCKET_NETWORK': 'unix',
+            'JUJU_CONTEXT_ID': self.context_id,
+        }
+
+    def start(self):
+        """Start serving requests in a background thread."""
+        agent = self
+
+        class Handler(socketserver.BaseRequestHandler):
+
+            def handle(self):
+                stream = self.request.makefile('rb')
+                decoder = gob.Decoder(stream.read)
+                encoder = gob.Encoder()
+                try:
+                    while True:
+                        header = decoder.decode()
+                        body = decoder.decode()
+                        self.request.sendall(
+                            agent._dispatch(encoder, header, body))
+                except (EOFError, socket.error):
+                    pass
+                finally:
+                    stream.close()
+
+        self._server = socketserver.ThreadingUnixStreamServer(
+            self.address, Handler)
+        self._server.daemon_threads = True
+        # Poll often, so that stopping the server is fast.
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, kwargs={'poll_interval': 0.01})
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop the server and remove its socket."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = self._thread = None
+        if os.path.exists(self.address):
+            os.remove(self.address)
+        os.rmdir(self._dir)
+
+    def _dispatch(self, encoder, header, body):
+        """Return the encoded response header and body for the request."""
+        method = header.get('ServiceMethod', '')
+        response = {'ServiceMethod': method, 'Seq': header.get('Seq', 0)}
+        if method != METHOD:
+            response['Error'] = 'rpc: can\'t find service {}'.format(method)
+        elif body.get('ContextId', '') != self.context_id:
+            response['Error'] = 'bad request: unknown context {!r}'.format(
+                body.get('ContextId', ''))
+        if response.get('Error'):
+            return (encoder.encode(RPC_RESPONSE, response) +
+                    encoder.encode(_INVALID_REQUEST, {}))
+        name, args = body.get('CommandName', ''), body.get('Args', [])
+        self.requests.append((name, args))
+        code, stdout, stderr = self.handler(name, args)
+        return (encoder.encode(RPC_RESPONSE, response) +
+                encoder.encode(EXEC_RESPONSE, {
+                    'Code': code, 'Stdout': stdout, 'Stderr': stderr}))
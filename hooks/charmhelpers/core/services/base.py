@@ -123,14 +123,23 @@ class ServiceManager(object):
             service_name = service['service']
             self.services[service_name] = service
 
-    def manage(self):
+    def manage(self, provide_only=False):
         """
         Handle the current hook by doing The Right Thing with the registered services.
+
+        If `provide_only` is True, the services are not reconfigured, and the
+        relation data is only set on the relation of the current hook, when
+        remote units join or change it. This is useful in hooks of relations
+        which do not affect the services, so that their cost does not grow with
+        the number of related units.
         """
         hookenv._run_atstart()
         try:
             hook_name = hookenv.hook_name()
-            if hook_name == 'stop':
+            if provide_only:
+                if hook_name.endswith(('-relation-joined', '-relation-changed')):
+                    self.provide_data(relation_id=hookenv.relation_id())
+            elif hook_name == 'stop':
                 self.stop_services()
             else:
                 self.reconfigure_services()
@@ -140,10 +149,12 @@ class ServiceManager(object):
                 hookenv._run_atexit()
         hookenv._run_atexit()
 
-    def provide_data(self):
+    def provide_data(self, relation_id=None):
         """
         Set the relation data for each provider in the ``provided_data`` list.
 
+        If `relation_id` is given, the data is only set on that relation.
+
         A provider must have a `name` attribute, which indicates which relation
         to set data on, and a `provide_data()` method, which returns a dict of
         data to set.
@@ -161,11 +172,16 @@ class ServiceManager(object):
         ``data_ready`` callbacks are run.  This gives the ``data_ready`` callbacks
         a chance to generate any data necessary for the providing to the remote
         services.
+
+        Data is only set when it differs from the data last provided on the
+        relation, see `hookenv.relation_set_changed`.
         """
         for service_name, service in self.services.items():
             service_ready = self.is_ready(service_name)
             for provider in service.get('provided_data', []):
                 for relid in hookenv.relation_ids(provider.name):
+                    if relation_id is not None and relid != relation_id:
+                        continue
                     units = hookenv.related_units(relid)
                     if not units:
                         continue
@@ -176,7 +192,7 @@ class ServiceManager(object):
                     else:
                         data = provider.provide_data()
                     if data:
-                        hookenv.relation_set(relid, data)
+                        hookenv.relation_set_changed(relid, data)
 
     def reconfigure_services(self, *service_names):
         """
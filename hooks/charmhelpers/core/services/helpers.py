@@ -42,11 +42,13 @@ class RelationContext(dict):
 
     :param str name: Override the relation :attr:`name`, since it can vary from charm to charm
     :param list additional_required_keys: Extend the list of :attr:`required_keys`
+    :param bool get_data: Whether to retrieve the relation data, which can be
+        skipped when the context is only used to provide data
     """
     name = None
     interface = None
 
-    def __init__(self, name=None, additional_required_keys=None):
+    def __init__(self, name=None, additional_required_keys=None, get_data=True):
         if not hasattr(self, 'required_keys'):
             self.required_keys = []
 
@@ -54,7 +56,8 @@ class RelationContext(dict):
             self.name = name
         if additional_required_keys:
             self.required_keys.extend(additional_required_keys)
-        self.get_data()
+        if get_data:
+            self.get_data()
 
     def __bool__(self):
         """
@@ -94,7 +97,8 @@ class RelationContext(dict):
         and 'db:2', with 'db:1' having two units, 'wordpress/0' and 'wordpress/1',
         and 'db:2' having one unit, 'mediawiki/0', all of which have a complete
         set of data, the relation data for the units will be stored in the
-        order: 'wordpress/0', 'wordpress/1', 'mediawiki/0'.
+        order: 'wordpress/0', 'wordpress/1', 'mediawiki/0'. The data of all
+        the units is fetched concurrently, see `hookenv.relation_get_units`.
 
         If you only care about a single unit on the relation, you can just
         access it as `{{ interface[0]['key'] }}`.  However, if you can at all
@@ -114,11 +118,9 @@ class RelationContext(dict):
             return
 
         ns = self.setdefault(self.name, [])
-        for rid in sorted(hookenv.relation_ids(self.name)):
-            for unit in sorted(hookenv.related_units(rid)):
-                reldata = hookenv.relation_get(rid=rid, unit=unit)
-                if self._is_ready(reldata):
-                    ns.append(reldata)
+        for rid, unit, reldata in hookenv.relation_get_units(self.name):
+            if reldata is not None and self._is_ready(reldata):
+                ns.append(reldata)
 
     def provide_data(self):
         """
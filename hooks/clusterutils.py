@@ -0,0 +1,243 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the GPLv3, see copyright file for details.
+
+"""Utilities for running redis in cluster mode.
+
+When the cluster-enabled option is set, all the redis instances running on
+all the units of the application are nodes of a single redis cluster. Units
+publish the endpoints of their instances on the cluster peer relation, and
+the Juju leader uses the redis-cli cluster manager to create the cluster
+once enough nodes are available, and then to add new nodes as units join.
+New nodes are added as replicas of the masters lacking replicas, or as empty
+masters otherwise. Hash slots are only moved across masters when the
+rebalance action is run.
+"""
+
+from collections import namedtuple
+import os
+import subprocess
+
+from charmhelpers.core import hookenv
+
+import hookutils
+import instanceutils
+import redisclient
+import settings
+
+
+# Define a node as described by the CLUSTER NODES command. The endpoint is a
+# (hostname, port) tuple and slots is the list of slot ranges served by the
+# node.
+Node = namedtuple('Node', ['id', 'endpoint', 'flags', 'master_id', 'slots'])
+
+
+def manage(config, cluster_relation):
+    """Return a callback managing the redis cluster.
+
+    The config argument is the hook environment configuration and the
+    cluster_relation one is the cluster peer relation context. The callback
+    can be used in the services framework, and it only acts on the leader
+    unit when cluster mode is enabled. It must be called after the redis
+    configuration files are written.
+    """
+    def callback(service_name):
+        if not config['cluster-enabled'] or not hookenv.is_leader():
+            return
+        password = config['password'].strip() or None
+        endpoints = get_endpoints(config, cluster_relation)
+        try:
+            _update_cluster(endpoints, config['cluster-replicas'], password)
+        except (redisclient.RedisError, subprocess.CalledProcessError) as err:
+            # The cluster is updated again in the next hook.
+            hookutils.log('Cannot update the cluster: {}.'.format(err))
+
+    return callback
+
+
+def get_endpoints(config, cluster_relation):
+    """Return the endpoints of all the cluster nodes, as (hostname, port).
+
+    The endpoints of the redis instances running on this unit come first.
+    """
+    hostname = hookenv.unit_private_ip()
+    instances = instanceutils.get_instances(
+        config['port'], config['instances'])
+    endpoints = [(hostname, instance.port) for instance in instances]
+    remote_endpoints = []
+    for data in cluster_relation.get(cluster_relation.name, []):
+        remote_endpoints.extend(
+            instanceutils.parse_endpoints(data['endpoints']))
+    return endpoints + sorted(remote_endpoints)
+
+
+def get_nodes(endpoint, password=None):
+    """Return the cluster nodes as known by the node at the given endpoint.
+
+    Raise a RedisError if the node cannot be queried.
+    """
+    with redisclient.Client(*endpoint, password=password) as client:
+        return _parse_nodes(client.execute('CLUSTER', 'NODES'))
+
+
+def rebalance(endpoint, password=None, use_empty_masters=True, threshold=2,
+              drained_endpoints=()):
+    """Rebalance the hash slots across the cluster masters.
+
+    Receive the endpoint of a cluster node. If use_empty_masters is True,
+    also move slots to masters not serving any slots, like the ones added
+    when units join. The threshold is the percentage of imbalance above which
+    slots are moved. Masters at the given drained endpoints are emptied, so
+    that their units can be safely removed.
+
+    Return the redis-cli output.
+    Raise a CalledProcessError if the rebalance fails.
+    """
+    args = [
+        '--cluster', 'rebalance', _format_endpoint(endpoint),
+        '--cluster-threshold', threshold,
+    ]
+    if use_empty_masters:
+        args.append('--cluster-use-empty-masters')
+    if drained_endpoints:
+        nodes = get_nodes(endpoint, password)
+        weights = [
+            '{}=0'.format(node.id) for node in nodes
+            if node.endpoint in drained_endpoints]
+        if weights:
+            args.append('--cluster-weight')
+            args.extend(weights)
+    return _redis_cli(args, password)
+
+
+def _update_cluster(endpoints, replicas, password):
+    """Create the cluster or add new nodes to it.
+
+    Receive the endpoints of all the nodes, the number of replicas for each
+    master and the optional password used to connect to the nodes.
+    """
+    seed, nodes = _find_cluster(endpoints, password)
+    if seed is None:
+        required = settings.CLUSTER_MIN_MASTERS * (replicas + 1)
+        if len(endpoints) < required:
+            hookutils.log('Waiting for {} nodes to create the cluster.'.format(
+                required))
+            return
+        hookutils.log('Creating the cluster.')
+        args = ['--cluster', 'create']
+        args.extend(_format_endpoint(endpoint) for endpoint in endpoints)
+        args.extend(['--cluster-replicas', replicas, '--cluster-yes'])
+        _redis_cli(args, password)
+        return
+    for endpoint in endpoints:
+        if endpoint in [node.endpoint for node in nodes]:
+            continue
+        hookutils.log('Adding node {} to the cluster.'.format(
+            _format_endpoint(endpoint)))
+        args = [
+            '--cluster', 'add-node', _format_endpoint(endpoint),
+            _format_endpoint(seed),
+        ]
+        master = _get_master_lacking_replicas(nodes, replicas)
+        if master is not None:
+            args.extend(['--cluster-slave', '--cluster-master-id', master.id])
+        _redis_cli(args, password)
+        nodes = get_nodes(seed, password)
+    _forget_departed_nodes(nodes, endpoints, password)
+
+
+def _find_cluster(endpoints, password):
+    """Find a node already part of a cluster serving hash slots.
+
+    Return the node endpoint and the cluster nodes known by it, or
+    (None, None) if the cluster has not been created yet.
+    """
+    for endpoint in endpoints:
+        try:
+            nodes = get_nodes(endpoint, password)
+        except redisclient.RedisError as err:
+            hookutils.log('Cannot query node {}: {}.'.format(
+                _format_endpoint(endpoint), err))
+            continue
+        if any(node.slots for node in nodes):
+            return endpoint, nodes
+    return None, None
+
+
+def _get_master_lacking_replicas(nodes, replicas):
+    """Return the master with the fewest replicas, if less than required.
+
+    Return None if all the masters have the required number of replicas.
+    """
+    masters = [
+        node for node in nodes if 'master' in node.flags and node.slots]
+    counts = dict((master.id, 0) for master in masters)
+    for node in nodes:
+        if node.master_id in counts:
+            counts[node.master_id] += 1
+    candidates = [
+        master for master in masters if counts[master.id] < replicas]
+    if not candidates:
+        return None
+    return min(candidates, key=lambda master: counts[master.id])
+
+
+def _forget_departed_nodes(nodes, endpoints, password):
+    """Make the cluster forget failed nodes whose units departed.
+
+    Only nodes not serving any hash slots are forgotten.
+    """
+    departed = [
+        node for node in nodes
+        if node.endpoint not in endpoints and 'fail' in node.flags and
+        not node.slots]
+    if not departed:
+        return
+    for node in nodes:
+        if node in departed or node.endpoint not in endpoints:
+            continue
+        with redisclient.Client(*node.endpoint, password=password) as client:
+            for departed_node in departed:
+                hookutils.log('Forgetting departed node {}.'.format(
+                    departed_node.id))
+                client.execute('CLUSTER', 'FORGET', departed_node.id)
+
+
+def _parse_nodes(output):
+    """Parse the output of the CLUSTER NODES command.
+
+    Return a list of nodes.
+    """
+    nodes = []
+    for line in output.splitlines():
+        fields = line.split()
+        if len(fields) < 8:
+            continue
+        # The address looks like "ip:port@cport,hostname" in recent versions.
+        address = fields[1].split('@')[0].split(',')[0]
+        hostname, _, port = address.rpartition(':')
+        master_id = None if fields[3] == '-' else fields[3]
+        nodes.append(Node(
+            fields[0], (hostname, int(port)), fields[2].split(','), master_id,
+            fields[8:]))
+    return nodes
+
+
+def _format_endpoint(endpoint):
+    """Return the given (hostname, port) endpoint as "hostname:port"."""
+    return '{}:{}'.format(*endpoint)
+
+
+def _redis_cli(args, password):
+    """Run redis-cli with the given arguments and return its output.
+
+    The password is passed in the environment, so that it is not exposed in
+    the process list. Raise a CalledProcessError if the command fails.
+    """
+    cmd = ['redis-cli']
+    cmd.extend('{}'.format(arg) for arg in args)
+    env = dict(os.environ)
+    env.pop('REDISCLI_AUTH', None)
+    if password:
+        env['REDISCLI_AUTH'] = password
+    return subprocess.check_output(
+        cmd, stderr=subprocess.STDOUT, env=env).decode('utf-8')
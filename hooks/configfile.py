@@ -4,7 +4,9 @@
 """Utilities for working with the redis configuration file."""
 
 import errno
+import grp
 import os
+import pwd
 import shutil
 import tempfile
 
@@ -14,22 +16,59 @@ import settings
 def include_config(target):
     """Include target configuration file at the end of the default config.
 
-    Note that this function is not idempotent. For this reason, it is only safe
-    to call it in the install hook.
+    The file is left untouched if it already includes the target, e.g. when
+    the charm is installed again on a unit keeping the redis data.
 
     Raise an IOError if the configuration file does not exist or it is not
     writable.
     """
+    line = 'include {}\n'.format(target)
+    with open(settings.DEFAULT_REDIS_CONF, 'r') as conf_file:
+        if line in conf_file:
+            return
     _backup(settings.DEFAULT_REDIS_CONF)
     with open(settings.DEFAULT_REDIS_CONF, 'a') as conf_file:
-        conf_file.write('include {}\n'.format(target))
+        conf_file.write(line)
 
 
-def write(options, target):
+def read(target):
+    """Read the redis customized configuration file.
+
+    Receive the path to a configuration file previously generated by the
+    write function below.
+
+    Return a dict mapping option names to their values as strings, or to lists
+    of strings if the option is repeated in the file. An empty dict is returned
+    if the configuration file does not exist.
+    Raise an IOError if a problem is encountered in the operation.
+    """
+    try:
+        content = open(target, 'r').read()
+    except IOError as err:
+        if err.errno != errno.ENOENT:
+            raise
+        return {}
+    options = {}
+    for line in content.splitlines():
+        key, _, value = line.partition(' ')
+        if not key:
+            continue
+        if key not in options:
+            options[key] = value
+        elif isinstance(options[key], list):
+            options[key].append(value)
+        else:
+            options[key] = [options[key], value]
+    return options
+
+
+def write(options, target, owner=None, group=None, perms=0o644):
     """Write the redis customized configuration file.
 
     Receive the redis charm configuration options and the target file where to
-    write configuration to.
+    write configuration to. Options with a list value are repeated in the file
+    once for each of the values, preserving their order. The file is owned by
+    the given owner and group names, if provided, with the given permissions.
 
     Report whether the new and old configurations differ.
     Raise an IOError if a problem is encountered in the operation.
@@ -41,8 +80,11 @@ def write(options, target):
             raise
         # It is acceptable that the customized configuration does not exist.
         old_content = ''
-    new_content = ''.join(
-        '{} {}\n'.format(key, value) for key, value in sorted(options.items()))
+    lines = []
+    for key, value in sorted(options.items()):
+        values = value if isinstance(value, list) else [value]
+        lines.extend('{} {}\n'.format(key, item) for item in values)
+    new_content = ''.join(lines)
     # If there are no differences in the new and old configuration, we can
     # avoid writing the file and/or doing backups.
     if new_content == old_content:
@@ -62,7 +104,11 @@ def write(options, target):
     temp_file.flush()
     os.fsync(temp_file.fileno())
     temp_file.close()
-    os.chmod(temp_file.name, 0o644)
+    if owner is not None or group is not None:
+        uid = pwd.getpwnam(owner).pw_uid if owner is not None else -1
+        gid = grp.getgrnam(group).gr_gid if group is not None else -1
+        os.chown(temp_file.name, uid, gid)
+    os.chmod(temp_file.name, perms)
     # Rename the temporary file to the real target file.
     os.rename(temp_file.name, target)
     return True
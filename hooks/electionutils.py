@@ -0,0 +1,149 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the GPLv3, see copyright file for details.
+
+"""Utilities for electing the redis master inside a single application.
+
+When the peer-replication option is set, one unit of the application is the
+master and all the other units replicate it, so that a replicated deployment
+does not require two applications related through the master and slave
+relations. Units publish the endpoints of their instances on the replication
+peer relation, and the Juju leader stores the endpoints of the elected master
+unit in the leader settings. Each redis instance replicates the master
+instance with the same index.
+
+The first leader elects itself. When leadership changes, or when the master
+unit leaves the application, the new leader promotes the most caught-up unit,
+i.e. the reachable one with the highest replication offset. A master still
+reachable is never less caught-up than its replicas, so it keeps its role.
+"""
+
+from charmhelpers.core import hookenv
+
+import hookutils
+import instanceutils
+import redisclient
+import settings
+
+
+def is_enabled(config):
+    """Report whether the master is elected inside the application.
+
+    Peer replication is ignored in cluster mode.
+    """
+    return config['peer-replication'] and not config['cluster-enabled']
+
+
+def elect(config, replication_relation):
+    """Return a callback electing the master unit.
+
+    The config argument is the hook environment configuration and the
+    replication_relation one is the replication peer relation context. The
+    callback can be used in the services framework, and it only acts on the
+    leader unit when peer replication is enabled. It must be called before
+    the redis configuration files are written.
+    """
+    def callback(service_name):
+        if not is_enabled(config) or not hookenv.is_leader():
+            return
+        master = hookenv.leader_get(settings.MASTER_LEADER_KEY)
+        candidates = _get_candidates(config, replication_relation)
+        if master in candidates and hookenv.hook_name() != 'leader-elected':
+            return
+        # Prefer the current master, then this unit, in case of ties.
+        if master in candidates:
+            candidates.remove(master)
+            candidates.insert(0, master)
+        elected = _find_most_caught_up(
+            candidates, config['password'].strip() or None)
+        if elected is None:
+            # No candidate is reachable yet, e.g. in the first hooks.
+            elected = master or candidates[0]
+        if elected != master:
+            hookutils.log('Electing {} as the master.'.format(elected))
+            hookenv.leader_set({settings.MASTER_LEADER_KEY: elected})
+
+    return callback
+
+
+def failover(config, candidates):
+    """Promote the most caught-up unit other than the current master.
+
+    Receive the endpoints of all the units, as returned by
+    instanceutils.format_endpoints. This must be called on the leader unit.
+    Report whether a new master has been elected.
+    """
+    master = hookenv.leader_get(settings.MASTER_LEADER_KEY)
+    elected = _find_most_caught_up(
+        [candidate for candidate in candidates if candidate != master],
+        config['password'].strip() or None)
+    if elected is None:
+        hookutils.log('No replica can be promoted.')
+        return False
+    hookutils.log('Failing over to {}.'.format(elected))
+    hookenv.leader_set({settings.MASTER_LEADER_KEY: elected})
+    return True
+
+
+def get_master_endpoints():
+    """Return the endpoints of the elected master unit, as (hostname, port).
+
+    Return an empty list if no master has been elected yet.
+    """
+    value = hookenv.leader_get(settings.MASTER_LEADER_KEY)
+    return instanceutils.parse_endpoints(value or '')
+
+
+def get_master_endpoint(instance):
+    """Return the master endpoint to be replicated by the given instance.
+
+    Return a (hostname, port) tuple, or None if this unit is the master, if
+    no master has been elected yet or if the master does not run an instance
+    with the same index.
+    """
+    endpoints = get_master_endpoints()
+    if instance.index >= len(endpoints):
+        return None
+    hostname, port = endpoints[instance.index]
+    if hostname == hookenv.unit_private_ip():
+        return None
+    return hostname, port
+
+
+def _get_candidates(config, replication_relation):
+    """Return the endpoints of all the units, as published on the relation.
+
+    Each candidate is the string returned by instanceutils.format_endpoints,
+    and the endpoints of this unit come first.
+    """
+    instances = instanceutils.get_instances(
+        config['port'], config['instances'])
+    candidates = [instanceutils.format_endpoints(
+        hookenv.unit_private_ip(), instances)]
+    for data in replication_relation.get(replication_relation.name, []):
+        candidates.append(data['endpoints'])
+    return candidates
+
+
+def _find_most_caught_up(candidates, password):
+    """Return the candidate with the highest replication offset.
+
+    The offset of the main instance of each candidate is used. Candidates
+    which cannot be queried are ignored. Return None if no candidate can be
+    queried.
+    """
+    elected = None
+    highest = -1
+    for candidate in candidates:
+        endpoint = instanceutils.parse_endpoints(candidate)[0]
+        try:
+            with redisclient.Client(*endpoint, password=password) as client:
+                info = redisclient.parse_info(
+                    client.execute('INFO', 'replication'))
+        except redisclient.RedisError as err:
+            hookutils.log('Cannot query candidate {}: {}.'.format(
+                candidate, err))
+            continue
+        offset = int(info.get('master_repl_offset', 0))
+        if offset > highest:
+            elected, highest = candidate, offset
+    return elected
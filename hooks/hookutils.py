@@ -15,6 +15,7 @@ log = functools.partial(hookenv.log, level=hookenv.INFO)
 def hook_name_logged(function):
     """Decorate the given function so that the current hook name is logged.
 
+    The hook tool cache statistics are also logged when exiting the hook.
     The given function must accept no arguments.
     """
     @functools.wraps(function)
@@ -24,5 +25,10 @@ def hook_name_logged(function):
         try:
             return function()
         finally:
+            info = hookenv.cache_info()
+            hookenv.log(
+                'Hook tool cache: {} hits, {} misses.'.format(
+                    info.hits, info.misses),
+                level=hookenv.DEBUG)
             log('<<< Exiting hook: {}.'.format(hook_name))
     return decorated
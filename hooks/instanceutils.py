@@ -0,0 +1,116 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the GPLv3, see copyright file for details.
+
+"""Utilities for running several redis server instances on a single unit.
+
+Redis executes commands on a single thread, so a single instance cannot use
+all the CPUs of a big machine. The charm can run additional instances, each
+listening on its own port and storing data in its own directory.
+
+The main instance (index 0) is the one set up when installing the redis
+package, and it uses the customized configuration file included by the
+default redis configuration. Additional instances are managed using the
+templated systemd unit provided by the package, and their configuration files
+are self contained.
+"""
+
+from collections import namedtuple
+import os
+
+from charmhelpers.core import host
+
+import settings
+
+
+# Define a redis instance running on this unit.
+Instance = namedtuple('Instance', ['index', 'port', 'service_name', 'conf'])
+
+
+def get_instances(port, count):
+    """Return the list of redis instances running on this unit.
+
+    Receive the port of the main instance and the number of instances.
+    Additional instances listen on the ports following the main one.
+    Return an empty list if the port is None, e.g. when retrieving the
+    instances from the previous configuration in the first hook.
+    Raise a ValueError if the number of instances is not valid.
+    """
+    if port is None:
+        return []
+    if count is None:
+        # The previous configuration was created before instances were
+        # introduced in the charm.
+        count = 1
+    if count < 1:
+        raise ValueError('invalid number of instances: {}'.format(count))
+    instances = [Instance(0, port, settings.SERVICE_NAME, settings.REDIS_CONF)]
+    for index in range(1, count):
+        instances.append(Instance(
+            index, port + index,
+            settings.INSTANCE_SERVICE_NAME.format(index),
+            settings.INSTANCE_CONF.format(index)))
+    return instances
+
+
+def get_options(instance, logfile):
+    """Return the redis options specific to the given instance.
+
+    Receive the log file configured for the main instance, used to generate
+    a different log file for the additional instances. Additional instances
+    are run by the templated systemd unit, which expects the server to fork,
+    as configured for the main instance in the default redis configuration.
+    """
+    if not instance.index:
+        return {}
+    root, ext = os.path.splitext(logfile)
+    return {
+        'daemonize': 'yes',
+        'supervised': 'no',
+        'dir': settings.INSTANCE_DIR.format(instance.index),
+        'logfile': '{}-{}{}'.format(root, instance.index, ext),
+        'pidfile': settings.INSTANCE_PIDFILE.format(instance.index),
+    }
+
+
+def get_unixsocket(instance, path):
+    """Return the path to the unix socket the given instance listens to.
+
+    Receive the unix socket path configured for the main instance, or an
+    empty string if unix sockets are disabled, in which case an empty string
+    is returned.
+    """
+    if not path or not instance.index:
+        return path
+    return settings.INSTANCE_UNIXSOCKET.format(instance.index)
+
+
+def setup(instance):
+    """Set up the data directory used by the given instance.
+
+    The main instance uses the directory created when installing redis.
+    """
+    if instance.index:
+        host.mkdir(
+            settings.INSTANCE_DIR.format(instance.index),
+            owner=settings.REDIS_USER, group=settings.REDIS_USER,
+            perms=0o750)
+
+
+def format_endpoints(hostname, instances):
+    """Return a string describing the endpoints of the given instances.
+
+    The resulting string includes space separated "hostname:port" pairs.
+    """
+    return ' '.join('{}:{}'.format(hostname, i.port) for i in instances)
+
+
+def parse_endpoints(value):
+    """Parse the string returned by format_endpoints.
+
+    Return a list of (hostname, port) tuples.
+    """
+    endpoints = []
+    for endpoint in value.split():
+        hostname, _, port = endpoint.rpartition(':')
+        endpoints.append((hostname, int(port)))
+    return endpoints
@@ -0,0 +1,109 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the GPLv3, see copyright file for details.
+
+"""Utilities for tuning the kernel for running redis.
+
+Redis warns at startup if transparent huge pages are enabled, if memory
+overcommit is disabled or if the socket listen backlog is too low: the former
+causes latency spikes after every fork, the second can make background saves
+fail and the latter limits the rate at which new clients can connect.
+"""
+
+import errno
+import os
+
+from charmhelpers.core import (
+    host,
+    sysctl,
+)
+
+import hookutils
+import settings
+
+
+# Define the systemd drop-in command disabling transparent huge pages before
+# redis starts. The "+" prefix runs the command with full privileges regardless
+# of the sandboxing options in the redis unit, and the "-" prefix ignores
+# failures, e.g. when running in a container.
+_THP_COMMAND = "ExecStartPre=-+/bin/sh -c 'echo never > {}'\n"
+
+
+def apply(tcp_backlog):
+    """Apply the kernel tuning required by redis.
+
+    Receive the listen backlog configured in redis, so that the kernel accept
+    queue is large enough to honor it.
+    """
+    hookutils.log('Applying kernel tuning.')
+    somaxconn = max(tcp_backlog, _read_int(settings.SOMAXCONN_FILE))
+    sysctl.create({
+        'net.core.somaxconn': somaxconn,
+        'net.ipv4.tcp_max_syn_backlog': somaxconn,
+        'vm.overcommit_memory': 1,
+    }, settings.SYSCTL_CONF, ignore=True)
+    # Disable transparent huge pages now, and also every time redis starts.
+    _disable_thp()
+    content = '[Service]\n' + ''.join(
+        _THP_COMMAND.format(path) for path in settings.THP_FILES)
+    if _write_dropin(content):
+        host.service('daemon-reload')
+
+
+def remove():
+    """Remove the kernel tuning applied by the charm, if any.
+
+    Kernel parameters already set are left untouched until the next reboot.
+    """
+    removed = False
+    for path in (settings.SYSCTL_CONF, settings.THP_DROPIN):
+        try:
+            os.remove(path)
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+        else:
+            removed = True
+    if removed:
+        hookutils.log('Kernel tuning removed.')
+        host.service('daemon-reload')
+
+
+def _disable_thp():
+    """Disable transparent huge pages for the running system."""
+    for path in settings.THP_FILES:
+        try:
+            with open(path, 'w') as thp_file:
+                thp_file.write('never')
+        except IOError as err:
+            # Kernel settings are usually read only in containers.
+            hookutils.log('Cannot disable transparent huge pages: {}.'.format(
+                err))
+
+
+def _write_dropin(content):
+    """Write the transparent huge pages systemd drop-in for redis.
+
+    Report whether the drop-in file changed.
+    """
+    try:
+        if open(settings.THP_DROPIN, 'r').read() == content:
+            return False
+    except IOError as err:
+        if err.errno != errno.ENOENT:
+            raise
+    dirname = os.path.dirname(settings.THP_DROPIN)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    with open(settings.THP_DROPIN, 'w') as dropin_file:
+        dropin_file.write(content)
+    return True
+
+
+def _read_int(path):
+    """Return the integer stored in the given file, or 0 if it is missing."""
+    try:
+        return int(open(path, 'r').read().strip())
+    except IOError as err:
+        if err.errno != errno.ENOENT:
+            raise
+        return 0
@@ -0,0 +1,122 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the GPLv3, see copyright file for details.
+
+"""A minimal client used by the charm to talk to the local redis server.
+
+Only the small subset of the redis protocol (RESP) required to send commands
+and parse their replies is implemented here, so that the charm does not need
+any additional Python dependency.
+"""
+
+import socket
+
+
+# Define the number of seconds after which socket operations are abandoned.
+DEFAULT_TIMEOUT = 10
+
+
+class RedisError(Exception):
+    """An error reply or a connection failure talking to the redis server."""
+
+
+class ConnectionClosed(RedisError):
+    """The connection has been closed by the server, e.g. on SHUTDOWN."""
+
+
+class Client(object):
+    """A simple synchronous redis client.
+
+    Use the client as a context manager so that the connection is closed on
+    exit, e.g.:
+
+        with redisclient.Client('10.0.0.1', 6379, password='secret') as c:
+            c.execute('CONFIG', 'SET', 'loglevel', 'debug')
+    """
+
+    def __init__(self, host, port, password=None, timeout=DEFAULT_TIMEOUT):
+        """Initialize the client and connect to the given redis server.
+
+        If a password is provided, also authenticate the connection.
+        Raise a RedisError if the connection or the authentication fail.
+        """
+        try:
+            self._socket = socket.create_connection((host, port), timeout)
+        except (socket.error, socket.timeout) as err:
+            raise RedisError(
+                'cannot connect to {}:{}: {}'.format(host, port, err))
+        self._file = self._socket.makefile('rb')
+        if password:
+            self.execute('AUTH', password)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Close the connection to the redis server."""
+        self._file.close()
+        self._socket.close()
+
+    def execute(self, *args):
+        """Send the given command to the server and return its reply.
+
+        Status and bulk replies are returned as strings, integer replies as
+        integers and multi-bulk replies as lists.
+        Raise a RedisError if the server returns an error.
+        """
+        try:
+            self._socket.sendall(_encode(args))
+            return self._read_reply()
+        except (socket.error, socket.timeout) as err:
+            raise RedisError('cannot execute {}: {}'.format(args[0], err))
+
+    def _read_reply(self):
+        """Read and return a single reply from the server."""
+        line = self._file.readline()
+        if not line.endswith(b'\r\n'):
+            raise ConnectionClosed('connection closed by the server')
+        kind, payload = line[:1], line[1:-2].decode('utf-8')
+        if kind == b'+':
+            return payload
+        if kind == b'-':
+            raise RedisError(payload)
+        if kind == b':':
+            return int(payload)
+        if kind == b'$':
+            length = int(payload)
+            if length == -1:
+                return None
+            # Also read the trailing CRLF.
+            return self._file.read(length + 2)[:-2].decode('utf-8')
+        if kind == b'*':
+            length = int(payload)
+            if length == -1:
+                return None
+            return [self._read_reply() for _ in range(length)]
+        raise RedisError('unexpected reply: {!r}'.format(line))
+
+
+def parse_info(reply):
+    """Parse the reply of the INFO command.
+
+    Return a dict mapping field names to their values as strings. Section
+    headers and empty lines are ignored.
+    """
+    info = {}
+    for line in reply.splitlines():
+        if line.startswith('#') or ':' not in line:
+            continue
+        key, _, value = line.partition(':')
+        info[key] = value
+    return info
+
+
+def _encode(args):
+    """Encode the given command arguments using the redis protocol."""
+    parts = [u'*{}\r\n'.format(len(args))]
+    for arg in args:
+        arg = u'{}'.format(arg)
+        parts.append(u'${}\r\n{}\r\n'.format(len(arg.encode('utf-8')), arg))
+    return u''.join(parts).encode('utf-8')
@@ -6,37 +6,191 @@
 from charmhelpers.core import hookenv
 from charmhelpers.core.services import helpers
 
+import clusterutils
+import electionutils
+import instanceutils
+import replicationutils
+import restartutils
+import sentinelutils
+import upgradeutils
+
 
 class DbRelation(helpers.RelationContext):
     """Define the redis db relation.
 
     Subscribers are provided the server "hostname", "port" and "password"
     values in the relation payload. If the redis server does not use
-    authentication, the password is an empty string.
+    authentication, the password is an empty string. The "ready" value is
+    "true" when all the redis instances on the unit can serve clients, i.e.
+    they finished loading their dataset and replicas are in sync with their
+    master, and "false" otherwise. While the unit is not ready, all the other
+    values are empty, so that clients do not connect to a loading server. The
+    "unixsocket" value is the path to the unix socket the main redis instance
+    listens to, usable by clients running on the same machine, or an empty
+    string if the socket is disabled. The "endpoints" value includes the space
+    separated "hostname:port" pairs of all the redis instances running on the
+    unit, so that clients can shard data across them. The first endpoint is
+    always the one described by the "hostname" and "port" values. In cluster
+    mode, the "cluster-seeds" value also includes the "hostname:port" pairs of
+    all the cluster nodes. Otherwise, the "replicas" value includes the
+    "hostname:port" pairs of the slaves replicating this unit that are online
+    and up to date, so that clients can send read only commands to them. When
+    peer replication is enabled, the "master" value is the "hostname:port"
+    pair of the main instance of the elected master unit. When the sentinel is
+    enabled, the "sentinel-master" value is the name of the master monitored
+    by the sentinels, and the "sentinels" value includes the "hostname:port"
+    pairs of the sentinels. These optional values are empty strings when they
+    do not apply, so that they are removed from the relation when the
+    corresponding mode is disabled.
     """
 
     name = 'db'
     interface = 'redis'
+    # Whether the connection values are withheld while the servers are not
+    # ready to serve clients.
+    withhold_until_ready = True
 
     def provide_data(self):
         """Return data to be relation_set for this interface."""
         config = hookenv.config()
-        return {
-            'hostname': hookenv.unit_private_ip(),
+        hostname = hookenv.unit_private_ip()
+        instances = instanceutils.get_instances(
+            config['port'], config['instances'])
+        password = config['password'].strip()
+        ready = all(
+            restartutils.is_server_ready(
+                hostname, instance.port, password or None)
+            for instance in instances)
+        data = {
+            'hostname': hostname,
             'port': config['port'],
-            'password': config['password'].strip(),
+            'password': password,
+            'endpoints': instanceutils.format_endpoints(hostname, instances),
+            'ready': 'true' if ready else 'false',
+            'unixsocket': config['unixsocket'].strip(),
+            # Values not relevant in the current mode are empty, so that they
+            # are removed from the relation when a mode is disabled.
+            'cluster-seeds': '',
+            'master': '',
+            'replicas': '',
+            'sentinel-master': '',
+            'sentinels': '',
         }
+        if not ready and self.withhold_until_ready:
+            # Clients only connect once the servers loaded their dataset.
+            data = dict((key, '') for key in data)
+            data['ready'] = 'false'
+            return data
+        if config['cluster-enabled']:
+            endpoints = clusterutils.get_endpoints(config, ClusterRelation())
+            data['cluster-seeds'] = ' '.join(
+                '{}:{}'.format(*endpoint) for endpoint in endpoints)
+        else:
+            replica_relations = [MasterRelation()]
+            if electionutils.is_enabled(config):
+                replica_relations.append(ReplicationRelation())
+                data['master'] = ' '.join(
+                    '{}:{}'.format(*endpoint)
+                    for endpoint in electionutils.get_master_endpoints()[:1])
+            replicas = replicationutils.get_replicas(
+                config, *replica_relations)
+            data['replicas'] = ' '.join(
+                '{}:{}'.format(*endpoint) for endpoint in replicas)
+        if sentinelutils.is_enabled(config):
+            slave_relation = SlaveRelation()
+            data.update(sentinelutils.get_relation_data(
+                config, slave_relation if slave_relation.is_ready() else None))
+        return data
+
+
+class LocalRelation(DbRelation):
+    """Define the container scoped redis local relation.
+
+    Subordinate clients running on the same machine are provided the same
+    data as the db relation, and they are expected to use the unix socket.
+    """
+
+    name = 'local'
 
 
 class MasterRelation(DbRelation):
-    """Define the redis master relation."""
+    """Define the redis master relation.
+
+    In addition to the db relation data, slaves are provided the
+    "master-name" value, used to identify the master when monitored by the
+    sentinels. Slaves are always provided the connection values, so that
+    they keep replicating a master which is restarting.
+    """
 
     name = 'master'
+    withhold_until_ready = False
+
+    def provide_data(self):
+        """Return data to be relation_set for this interface."""
+        data = super(MasterRelation, self).provide_data()
+        data['master-name'] = hookenv.service_name()
+        return data
 
 
 class SlaveRelation(helpers.RelationContext):
-    """Define the redis slave relation."""
+    """Define the redis slave relation.
+
+    Each slave unit publishes the space separated "hostname:port" pairs of its
+    redis instances in the "endpoints" value, so that the master can advertise
+    them as read replicas.
+    """
 
     name = 'slave'
     interface = 'redis'
     required_keys = ['hostname', 'port']
+
+    def provide_data(self):
+        """Return data to be relation_set for this interface."""
+        config = hookenv.config()
+        instances = instanceutils.get_instances(
+            config['port'], config['instances'])
+        return {
+            'endpoints': instanceutils.format_endpoints(
+                hookenv.unit_private_ip(), instances),
+        }
+
+
+class ClusterRelation(helpers.RelationContext):
+    """Define the redis cluster peer relation.
+
+    Each unit publishes the space separated "hostname:port" pairs of its
+    redis instances in the "endpoints" value.
+    """
+
+    name = 'cluster'
+    interface = 'redis-cluster'
+    required_keys = ['endpoints']
+
+    def provide_data(self):
+        """Return data to be relation_set for this interface."""
+        config = hookenv.config()
+        instances = instanceutils.get_instances(
+            config['port'], config['instances'])
+        return {
+            'endpoints': instanceutils.format_endpoints(
+                hookenv.unit_private_ip(), instances),
+        }
+
+
+class ReplicationRelation(ClusterRelation):
+    """Define the redis replication peer relation.
+
+    Each unit publishes the space separated "hostname:port" pairs of its
+    redis instances in the "endpoints" value, so that the leader can elect
+    the master among them, and the token of the last redis upgrade it
+    completed in the "upgraded" value.
+    """
+
+    name = 'replication'
+    interface = 'redis-replication'
+
+    def provide_data(self):
+        """Return data to be relation_set for this interface."""
+        data = super(ReplicationRelation, self).provide_data()
+        data['upgraded'] = upgradeutils.get_completed() or ''
+        return data
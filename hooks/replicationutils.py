@@ -0,0 +1,252 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the GPLv3, see copyright file for details.
+
+"""Utilities for tuning redis replication.
+
+When a replica disconnects, it can resume replication with a partial resync
+only if the writes it missed are still in the master replication backlog.
+Otherwise a full resync is required: the master forks to produce an RDB
+snapshot which is then transferred to the replica. The backlog can be sized
+automatically so that it holds the writes of a given number of seconds: the
+write rate is estimated by sampling the growth of the replication offset of
+each server in the update-status hook.
+
+Initial syncs of new replicas are expensive for the master, which forks to
+produce the snapshot: when many replicas join at once, concurrent syncs can
+double the master memory usage due to copy-on-write. Initial syncs are then
+admitted using a lock granted by the Juju leader to a batch of units at a
+time, so that their syncs can be served by a single fork on masters using
+diskless replication with a sync delay. Only fresh replicas, with no previous
+master, an empty keyspace and no replication history, are subject to
+admission control. The lock is
+granted by the leader of the replica application, so the number of concurrent
+syncs is bounded per replica application: a master replicated by several
+applications can serve one batch of each of them at a time.
+
+Masters also advertise their replicas to clients, so that read only commands
+can be sent to them. Only replicas belonging to the related slave units that
+are online and not lagging too much behind the master are advertised.
+"""
+
+import math
+import time
+
+from charmhelpers import coordinator
+from charmhelpers.core import (
+    hookenv,
+    unitdata,
+)
+
+import hookutils
+import instanceutils
+import redisclient
+import resources
+import settings
+
+
+# Define the key used to store the replication offset samples.
+_SAMPLES_KEY = 'replicationutils.samples'
+
+
+def sample_write_rate(config):
+    """Return a callback sampling the write rate of the redis servers.
+
+    The config argument is the hook environment configuration. The callback
+    can be used in the services framework, and it only samples the
+    replication offsets in the update-status hook, so that samples are taken
+    at regular intervals. It must be called before the redis configuration
+    files are written.
+    """
+    def callback(service_name):
+        if hookenv.hook_name() != 'update-status':
+            return
+        if config['repl-backlog-size'].strip() != 'auto':
+            return
+        instances = instanceutils.get_instances(
+            config['port'], config['instances'])
+        hostname = hookenv.unit_private_ip()
+        password = config['password'].strip() or None
+        kv = unitdata.kv()
+        samples = kv.get(_SAMPLES_KEY, {})
+        for instance in instances:
+            try:
+                with redisclient.Client(
+                        hostname, instance.port, password=password) as client:
+                    info = redisclient.parse_info(
+                        client.execute('INFO', 'replication'))
+            except redisclient.RedisError as err:
+                hookutils.log('Cannot sample the write rate: {}.'.format(err))
+                continue
+            samples[instance.service_name] = _update_sample(
+                samples.get(instance.service_name),
+                int(info.get('master_repl_offset', 0)), time.time())
+        kv.set(_SAMPLES_KEY, samples)
+        kv.flush()
+
+    return callback
+
+
+def get_backlog_size(value, seconds, service_name, num_instances=1):
+    """Return the replication backlog size in bytes for the given value.
+
+    The value can be "auto", an absolute size (e.g. "64mb") or an empty
+    string to use the redis default, in which case None is returned. In the
+    first case the backlog is sized to hold the given number of seconds of
+    writes, as observed on the given redis service. The size is rounded up to
+    a power of two, so that it does not change at every sample, and capped to
+    a fraction of the memory available to each instance.
+    Raise a ValueError if the value is not valid.
+    """
+    value = value.strip()
+    if not value:
+        return None
+    if value != 'auto':
+        return resources.parse_size(value)
+    sample = unitdata.kv().get(_SAMPLES_KEY, {}).get(service_name)
+    rate = sample['rate'] if sample else 0
+    size = max(int(rate * seconds), settings.REPL_BACKLOG_MIN_SIZE)
+    size = 2 ** int(math.ceil(math.log(size, 2)))
+    limit = int(
+        resources.get_memory_limit() * settings.REPL_BACKLOG_MAX_FRACTION /
+        num_instances)
+    return max(min(size, limit), settings.REPL_BACKLOG_MIN_SIZE)
+
+
+def get_replicas(config, *relations):
+    """Return the endpoints of the replicas that can serve reads.
+
+    The config argument is the hook environment configuration and the
+    relations are the master relation or replication peer relation contexts,
+    in which slave units publish the endpoints of their instances. The
+    replication status of each replica is retrieved from the local redis
+    servers, and only online replicas whose replication offset is close
+    enough to the master one are returned, as (hostname, port) tuples.
+    """
+    endpoints = set()
+    for relation in relations:
+        for data in relation.get(relation.name, []):
+            if 'endpoints' in data:
+                endpoints.update(
+                    instanceutils.parse_endpoints(data['endpoints']))
+    if not endpoints:
+        return []
+    instances = instanceutils.get_instances(
+        config['port'], config['instances'])
+    hostname = hookenv.unit_private_ip()
+    password = config['password'].strip() or None
+    replicas = []
+    for instance in instances:
+        try:
+            with redisclient.Client(
+                    hostname, instance.port, password=password) as client:
+                info = redisclient.parse_info(
+                    client.execute('INFO', 'replication'))
+        except redisclient.RedisError as err:
+            hookutils.log('Cannot retrieve the replicas: {}.'.format(err))
+            continue
+        offset = int(info.get('master_repl_offset', 0))
+        for index in range(int(info.get('connected_slaves', 0))):
+            replica = _parse_replica(info.get('slave{}'.format(index), ''))
+            endpoint = (replica.get('ip'), int(replica.get('port', 0)))
+            if endpoint not in endpoints or replica.get('state') != 'online':
+                continue
+            lag = offset - int(replica.get('offset', 0))
+            if lag > settings.REPLICA_MAX_LAG:
+                hookutils.log('Replica {}:{} is {} bytes behind.'.format(
+                    endpoint[0], endpoint[1], lag))
+                continue
+            replicas.append(endpoint)
+    return sorted(replicas)
+
+
+class SyncCoordinator(coordinator.Serial):
+    """Grant the initial sync lock to a batch of units at a time.
+
+    The batch size is defined by the sync-batch-size option.
+    """
+
+    def grant_sync(self, lock, unit, granted, queue):
+        """Grant the lock to the first units in the queue, up to batch size.
+
+        See coordinator.Serial.default_grant for a description of the
+        arguments.
+        """
+        available = hookenv.config()['sync-batch-size'] - len(granted)
+        return unit in queue[:max(available, 0)]
+
+
+def setup():
+    """Set up the coordinator used to admit initial syncs.
+
+    This must be called before the services framework manager runs, so that
+    the lock requests are handled in every hook.
+    """
+    SyncCoordinator(relation_key='sync-coordinator')
+
+
+def admit_sync(config):
+    """Report whether this unit can start the initial sync with its master.
+
+    If admission control is enabled, request the sync lock, which can be
+    granted in a later hook. The lock is released at the end of the hook in
+    which it is granted, and the hook waits for the sync for a bounded time
+    only, so that it does not hold the machine lock for too long: syncs of
+    large datasets may then overlap with the ones of the next batch.
+    """
+    if not config['sync-batch-size']:
+        return True
+    if SyncCoordinator().acquire(settings.SYNC_LOCK):
+        return True
+    hookutils.log('Waiting for the initial sync lock.')
+    return False
+
+
+def is_fresh(hostname, port, password=None):
+    """Report whether the redis server has no data and never replicated.
+
+    The server is fresh if its keyspace is empty and its replication offset
+    is zero, i.e. it never had a master nor replicas. Files left on disk,
+    like an empty dump.rdb written when the server first stopped, are not
+    taken into account. A server which cannot be queried, e.g. because it
+    is not running yet, is considered fresh.
+    """
+    try:
+        with redisclient.Client(hostname, port, password=password) as client:
+            info = redisclient.parse_info(client.execute('INFO'))
+    except redisclient.RedisError as err:
+        hookutils.log('Cannot query the server: {}.'.format(err))
+        return True
+    if any(_is_keyspace_field(key) for key in info):
+        return False
+    return info.get('master_repl_offset', '0') == '0'
+
+
+def _is_keyspace_field(key):
+    """Report whether the INFO field describes the keys of a database."""
+    return key.startswith('db') and key[2:].isdigit()
+
+
+def _update_sample(sample, offset, timestamp):
+    """Return a new sample for the given replication offset.
+
+    The write rate, in bytes per second, is the highest rate observed, slowly
+    decaying over time so that the backlog can shrink when writes decrease.
+    """
+    rate = 0
+    if sample is not None:
+        rate = sample['rate'] * settings.REPL_BACKLOG_RATE_DECAY
+        elapsed = timestamp - sample['time']
+        # The offset is reset when the server restarts without persistence.
+        if elapsed > 0 and offset >= sample['offset']:
+            rate = max(rate, (offset - sample['offset']) / elapsed)
+    return {'offset': offset, 'rate': rate, 'time': timestamp}
+
+
+def _parse_replica(value):
+    """Parse a replica description as reported by INFO replication.
+
+    The value looks like "ip=1.2.3.4,port=6379,state=online,offset=42,lag=0".
+    Return a dict mapping the fields to their string values.
+    """
+    fields = (field.partition('=') for field in value.split(',') if field)
+    return dict((key, val) for key, _, val in fields)
@@ -0,0 +1,113 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the GPLv3, see copyright file for details.
+
+"""Utilities for inspecting the machine resources available to the unit."""
+
+import errno
+import math
+import multiprocessing
+import os
+import re
+
+from charmhelpers.core import host
+
+
+# Define the cgroup files exposing the memory limit (cgroup v2 and v1).
+CGROUP_MEMORY_LIMIT_FILES = (
+    '/sys/fs/cgroup/memory.max',
+    '/sys/fs/cgroup/memory/memory.limit_in_bytes',
+)
+
+# Define the cgroup v2 file exposing the CPU bandwidth limit.
+CGROUP_CPU_MAX_FILE = '/sys/fs/cgroup/cpu.max'
+
+# Define the multipliers for the memory units understood by redis.
+_SIZE_UNITS = {
+    '': 1,
+    'k': 1000,
+    'kb': 1024,
+    'm': 1000 ** 2,
+    'mb': 1024 ** 2,
+    'g': 1000 ** 3,
+    'gb': 1024 ** 3,
+}
+_SIZE_PATTERN = re.compile(r'^(\d+)\s*([kmg]b?)?$', re.IGNORECASE)
+
+
+def get_memory_limit():
+    """Return the amount of memory in bytes the unit is allowed to use.
+
+    This is the total RAM reported by the host, capped by the cgroup memory
+    limit when the unit runs in a constrained container.
+    """
+    limit = host.get_total_ram()
+    cgroup_limit = _get_cgroup_memory_limit()
+    if cgroup_limit is not None:
+        limit = min(limit, cgroup_limit)
+    return limit
+
+
+def get_cpu_count():
+    """Return the number of CPUs the unit is allowed to use.
+
+    This is the number of CPUs in the cpuset of the current process, capped by
+    the cgroup CPU bandwidth limit when the unit runs in a constrained
+    container.
+    """
+    try:
+        count = len(os.sched_getaffinity(0))
+    except AttributeError:
+        # The affinity is not available on all platforms.
+        count = multiprocessing.cpu_count()
+    quota = _get_cgroup_cpu_quota()
+    if quota is not None:
+        count = min(count, quota)
+    return max(count, 1)
+
+
+def parse_size(value):
+    """Convert the given redis memory size string to a number of bytes.
+
+    Sizes can be expressed using the units supported by the redis
+    configuration file, e.g. "1048576", "100m" or "4gb".
+    Raise a ValueError if the value cannot be parsed.
+    """
+    match = _SIZE_PATTERN.match(value.strip())
+    if match is None:
+        raise ValueError('invalid memory size: {!r}'.format(value))
+    number, unit = match.groups()
+    return int(number) * _SIZE_UNITS[(unit or '').lower()]
+
+
+def _get_cgroup_memory_limit():
+    """Return the cgroup memory limit in bytes, or None if not limited."""
+    for path in CGROUP_MEMORY_LIMIT_FILES:
+        try:
+            content = open(path, 'r').read().strip()
+        except IOError as err:
+            if err.errno != errno.ENOENT:
+                raise
+            continue
+        # On cgroup v1 unlimited groups report a huge number which is always
+        # greater than the host RAM, so there is no need to special case it.
+        if content.isdigit():
+            return int(content)
+        return None
+    return None
+
+
+def _get_cgroup_cpu_quota():
+    """Return the cgroup CPU bandwidth limit in CPUs, or None if not limited.
+
+    Fractional limits are rounded up.
+    """
+    try:
+        content = open(CGROUP_CPU_MAX_FILE, 'r').read().split()
+    except IOError as err:
+        if err.errno != errno.ENOENT:
+            raise
+        return None
+    # The file content is "$MAX $PERIOD", where $MAX can be "max".
+    if len(content) != 2 or not content[0].isdigit():
+        return None
+    return int(math.ceil(float(content[0]) / int(content[1])))
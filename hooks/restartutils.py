@@ -0,0 +1,241 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the GPLv3, see copyright file for details.
+
+"""Utilities for restarting redis on one unit at a time.
+
+Restarting all the units of an application at once, e.g. when an option
+requiring a restart is changed, makes the whole application unavailable.
+Restarts of running servers are instead serialized using a lock granted by
+the Juju leader, and each unit only releases the lock when its servers are
+ready again, i.e. when they loaded the dataset and, for replicas, when the
+replication link with the master is up.
+
+Restarts waiting for the lock are stored in the unit key/value store, so
+that they are performed in a later hook, once the lock is granted.
+
+Running servers are restarted warm: the dataset is saved when the server is
+stopped through systemd, or right before on older redis versions, so that
+writes are not lost regardless of the persistence settings, and the loading
+progress is reported in the unit status.
+"""
+
+import time
+
+from charmhelpers import coordinator
+from charmhelpers.core import (
+    hookenv,
+    host,
+    unitdata,
+)
+
+import hookutils
+import instanceutils
+import redisclient
+import settings
+
+
+# Define the key used to store the services waiting to be restarted.
+_PENDING_KEY = 'restartutils.pending'
+
+
+def setup():
+    """Set up the coordinator used to grant the restart lock.
+
+    This must be called before the services framework manager runs, so that
+    the lock requests are handled in every hook.
+    """
+    coordinator.Serial()
+
+
+def restart(service_names, endpoints, running_endpoints=None):
+    """Restart the given redis services, once the restart lock is granted.
+
+    Receive the names of the services to be restarted, a dict mapping
+    service names to the (hostname, port, password) tuples used to check
+    that the restarted servers are ready, and an optional dict mapping
+    service names to the (hostname, port, password) tuples the running
+    servers listen to, which differ from the former when the address or the
+    password changed. Services previously waiting for the lock are also
+    restarted. Report whether any service has been restarted.
+    """
+    kv = unitdata.kv()
+    # Map service names to dicts including the "endpoint" used to check the
+    # restarted server and the "running" endpoint used to shut it down.
+    pending = kv.get(_PENDING_KEY, {})
+    running_endpoints = running_endpoints or {}
+    for service_name in service_names:
+        pending.setdefault(service_name, {})
+    if not pending:
+        return False
+    for service_name, entry in pending.items():
+        endpoint = endpoints.get(service_name)
+        if endpoint is not None:
+            entry['endpoint'] = endpoint
+            # The running server keeps listening to the address it used when
+            # the restart was first requested.
+            entry.setdefault(
+                'running', running_endpoints.get(service_name, endpoint))
+    kv.set(_PENDING_KEY, pending)
+    kv.flush()
+    if not coordinator.Serial().acquire(settings.RESTART_LOCK):
+        hookutils.log('Waiting for the restart lock.')
+        return False
+    for service_name, entry in sorted(pending.items()):
+        endpoint = entry.get('endpoint')
+        if endpoint is None:
+            hookutils.log('Restarting service {}.'.format(service_name))
+            host.service_restart(service_name)
+        else:
+            warm_restart(service_name, *endpoint, running=entry.get('running'))
+    kv.unset(_PENDING_KEY)
+    kv.flush()
+    return True
+
+
+def warm_restart(
+        service_name, hostname, port, password=None,
+        timeout=settings.RESTART_READY_TIMEOUT, running=None):
+    """Restart the given redis service, saving its dataset first.
+
+    Receive the address of the server and its optional password, as
+    configured after the restart. If the running server listens to a
+    different address, or uses a different password, these are passed as a
+    (hostname, port, password) running tuple. The dataset of the running
+    server is saved, then the server is stopped and started again through
+    systemd. Report whether the server is ready again before the timeout (in
+    seconds) expires, see wait_until_ready.
+    """
+    hookutils.log('Restarting service {}.'.format(service_name))
+    if running is None:
+        running = (hostname, port, password)
+    if host.service_running(service_name):
+        _prepare_stop(*running)
+        # The packaged systemd units restart redis when it exits on its own,
+        # so the server is stopped by systemd rather than by SHUTDOWN: an
+        # explicit stop is never followed by an automatic restart.
+        host.service_stop(service_name)
+    host.service_start(service_name)
+    return wait_until_ready(hostname, port, password, timeout=timeout)
+
+
+def wait_until_ready(
+        hostname, port, password=None,
+        timeout=settings.RESTART_READY_TIMEOUT):
+    """Wait for the redis server to be ready to serve clients.
+
+    The server is ready when it is not loading the dataset and, if it is a
+    replica, when the link with its master is up. While the dataset is
+    loading, the progress is reported in the unit status. If the server is
+    not ready before the timeout, the unit status is set to blocked if the
+    server cannot be reached, or to waiting otherwise, until update_status
+    reports the server as ready.
+    Report whether the server is ready before the timeout (in seconds)
+    expires.
+    """
+    started = time.time()
+    deadline = started + timeout
+    loading = False
+    while True:
+        info = None
+        try:
+            with redisclient.Client(
+                    hostname, port, password=password) as client:
+                info = redisclient.parse_info(client.execute('INFO'))
+        except redisclient.RedisError as err:
+            hookutils.log('Cannot query the server: {}.'.format(err))
+        else:
+            if info.get('loading') == '1':
+                loading = True
+                hookenv.status_set(
+                    'maintenance', 'Loading dataset on port {}: {}%'.format(
+                        port, info.get('loading_loaded_perc', '0')))
+            elif loading:
+                loading = False
+                hookutils.log('Dataset loaded on port {} in {:.1f}s.'.format(
+                    port, time.time() - started))
+                hookenv.status_set('active', '')
+            if is_ready(info):
+                return True
+        if time.time() >= deadline:
+            hookutils.log('Server {}:{} not ready after {} seconds.'.format(
+                hostname, port, timeout))
+            if info is None:
+                hookenv.status_set(
+                    'blocked',
+                    'Redis on port {} is not reachable'.format(port))
+            else:
+                hookenv.status_set(
+                    'waiting', 'Redis on port {} not ready after {}s'.format(
+                        port, timeout))
+            return False
+        time.sleep(settings.RESTART_READY_INTERVAL)
+
+
+def update_status(config):
+    """Return a callback reporting the readiness of the servers.
+
+    The config argument is the hook environment configuration. The callback
+    can be used in the services framework, and it sets the unit status to
+    active when all the redis servers are ready, or to waiting otherwise.
+    """
+    def callback(service_name):
+        hostname = hookenv.unit_private_ip()
+        password = config['password'].strip() or None
+        instances = instanceutils.get_instances(
+            config['port'], config['instances'])
+        waiting = [
+            instance.port for instance in instances
+            if not is_server_ready(hostname, instance.port, password)]
+        if waiting:
+            hookenv.status_set('waiting', 'Redis not ready on port {}'.format(
+                ', '.join(str(port) for port in waiting)))
+        else:
+            hookenv.status_set('active', '')
+
+    return callback
+
+
+def is_server_ready(hostname, port, password=None):
+    """Report whether the redis server is ready to serve clients.
+
+    Return False if the server cannot be queried.
+    """
+    try:
+        with redisclient.Client(hostname, port, password=password) as client:
+            info = redisclient.parse_info(client.execute('INFO'))
+    except redisclient.RedisError as err:
+        hookutils.log('Cannot query the server: {}.'.format(err))
+        return False
+    return is_ready(info)
+
+
+def is_ready(info):
+    """Report whether the server is ready, given its parsed INFO reply."""
+    if info.get('loading') != '0':
+        return False
+    return (
+        info.get('role') != 'slave' or
+        info.get('master_link_status') == 'up')
+
+
+def _prepare_stop(hostname, port, password):
+    """Make sure the redis server saves its dataset when it is stopped.
+
+    Servers supporting it (redis 7.0 or later) are configured to save the
+    dataset when receiving the SIGTERM sent by systemd, so that writes
+    accepted until the very end are kept. Older servers save the dataset
+    right away. Failures are logged, so that the server can be restarted
+    anyway. Report whether the dataset is going to be saved or is saved.
+    """
+    try:
+        with redisclient.Client(
+                hostname, port, password=password,
+                timeout=settings.SAVE_TIMEOUT) as client:
+            try:
+                client.execute('CONFIG', 'SET', 'shutdown-on-sigterm', 'save')
+            except redisclient.RedisError:
+                client.execute('SAVE')
+    except redisclient.RedisError as err:
+        hookutils.log('Cannot save the dataset: {}.'.format(err))
+        return False
+    return True
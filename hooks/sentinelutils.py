@@ -0,0 +1,232 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the GPLv3, see copyright file for details.
+
+"""Utilities for running the redis sentinel.
+
+When the sentinel-enabled option is set, each unit also runs a redis sentinel
+monitoring the main redis instance of the master unit, i.e. the unit itself
+when it is a master, or the master described by the slave relation data
+otherwise. Sentinels monitoring the same master discover each other, and when
+the master is unreachable for more than the configured time they promote one
+of its replicas. The master is identified by the name of the application
+running it, which is published on the db relation together with the sentinel
+endpoints, so that sentinel-aware clients can follow failovers.
+
+The master to be monitored is only given to the sentinel when it does not
+already know it: after a failover, the sentinel is the source of truth for
+the master address.
+"""
+
+from charmhelpers import fetch
+from charmhelpers.core import (
+    hookenv,
+    host,
+)
+
+import configfile
+import hookutils
+import redisclient
+import settings
+
+
+def is_enabled(config):
+    """Report whether the sentinel must run on this unit.
+
+    The sentinel is not used in cluster mode, as the cluster itself handles
+    failovers.
+    """
+    return config['sentinel-enabled'] and not config['cluster-enabled']
+
+
+def configure(config, slave_relation=None):
+    """Return a callback setting up the redis sentinel.
+
+    The config argument is the hook environment configuration and the
+    slave_relation one is the slave relation context, if this unit is a slave.
+    The callback can be used in the services framework, and it installs,
+    configures and starts the sentinel, or stops it when the sentinel is
+    disabled. It must be called after the redis configuration files are
+    written.
+    """
+    def callback(service_name):
+        port = config['sentinel-port']
+        previous_port = config.previous('sentinel-port')
+        if previous_port is not None and previous_port != port:
+            hookenv.close_port(previous_port)
+        if not is_enabled(config):
+            _disable(port)
+            return
+        fetch.apt_install(
+            fetch.filter_installed_packages([settings.SENTINEL_PACKAGE]))
+        changed = _write_config(port)
+        if changed or not host.service_running(settings.SENTINEL_SERVICE_NAME):
+            hookutils.log('Restarting the sentinel.')
+            host.service_restart(settings.SENTINEL_SERVICE_NAME)
+        hookenv.open_port(port)
+        name = get_master_name(slave_relation)
+        master = _get_related_master(config, slave_relation)
+        password = _get_master_password(config, slave_relation)
+        try:
+            with _connect(config) as client:
+                _monitor(client, name, master, password, config)
+        except redisclient.RedisError as err:
+            # The sentinel is configured again in the next hook.
+            hookutils.log('Cannot configure the sentinel: {}.'.format(err))
+
+    return callback
+
+
+def get_master_name(slave_relation=None):
+    """Return the name identifying the monitored master.
+
+    This is the name of the application running the master.
+    """
+    if slave_relation:
+        name = slave_relation[slave_relation.name][0].get('master-name')
+        if name:
+            return name
+    return hookenv.service_name()
+
+
+def get_current_master(config, slave_relation=None):
+    """Return the endpoint of the master as known by the local sentinel.
+
+    Return a (hostname, port) tuple, or None if the sentinel is not
+    monitoring the master yet or it cannot be queried.
+    """
+    name = get_master_name(slave_relation)
+    try:
+        with _connect(config) as client:
+            address = client.execute(
+                'SENTINEL', 'GET-MASTER-ADDR-BY-NAME', name)
+    except redisclient.RedisError as err:
+        hookutils.log('Cannot query the sentinel: {}.'.format(err))
+        return None
+    if not address:
+        return None
+    return address[0], int(address[1])
+
+
+def get_relation_data(config, slave_relation=None):
+    """Return the sentinel data to be published on the db relation.
+
+    The "sentinel-master" value is the name of the monitored master and the
+    "sentinels" value includes the space separated "hostname:port" pairs of
+    all the known sentinels monitoring it, the local one being the first.
+    """
+    name = get_master_name(slave_relation)
+    local = (hookenv.unit_private_ip(), config['sentinel-port'])
+    others = []
+    try:
+        with _connect(config) as client:
+            for sentinel in client.execute('SENTINEL', 'SENTINELS', name):
+                info = _as_dict(sentinel)
+                others.append((info['ip'], int(info['port'])))
+    except redisclient.RedisError as err:
+        hookutils.log('Cannot query the sentinel: {}.'.format(err))
+    endpoints = [local] + sorted(set(others) - set([local]))
+    return {
+        'sentinel-master': name,
+        'sentinels': ' '.join('{}:{}'.format(*i) for i in endpoints),
+    }
+
+
+def _disable(port):
+    """Stop the sentinel if it is running, and close its port."""
+    if host.service_running(settings.SENTINEL_SERVICE_NAME):
+        hookutils.log('Stopping the sentinel.')
+        host.service_stop(settings.SENTINEL_SERVICE_NAME)
+        host.service('disable', settings.SENTINEL_SERVICE_NAME)
+    hookenv.close_port(port)
+
+
+def _write_config(port):
+    """Update the options managed by the charm in the sentinel config file.
+
+    The sentinel rewrites the file itself, e.g. after failovers or when
+    receiving SENTINEL SET commands, so the file is only written when the
+    options managed by the charm change. The sentinel state stored in the
+    file is preserved.
+    Report whether the file changed.
+    """
+    current = configfile.read(settings.SENTINEL_CONF)
+    managed = {
+        'bind': hookenv.unit_private_ip(),
+        'port': port,
+    }
+    if all(current.get(key) == '{}'.format(value)
+           for key, value in managed.items()):
+        return False
+    options = dict(
+        (key, value) for key, value in current.items()
+        if not key.startswith('#'))
+    options.update(managed)
+    hookutils.log('Writing the sentinel configuration file.')
+    # The sentinel refuses to start if it cannot rewrite its config file.
+    return configfile.write(
+        options, settings.SENTINEL_CONF, owner=settings.REDIS_USER,
+        group=settings.REDIS_USER, perms=settings.SENTINEL_CONF_PERMS)
+
+
+def _get_related_master(config, slave_relation):
+    """Return the endpoint of the master as described by the charm.
+
+    This is the main redis instance running on this unit, or the one
+    described by the slave relation data.
+    """
+    if slave_relation:
+        data = slave_relation[slave_relation.name][0]
+        return data['hostname'], int(data['port'])
+    return hookenv.unit_private_ip(), config['port']
+
+
+def _get_master_password(config, slave_relation):
+    """Return the password used by the sentinel to connect to the servers."""
+    if slave_relation:
+        password = slave_relation[slave_relation.name][0].get('password')
+        if password:
+            return password
+    return config['password'].strip()
+
+
+def _monitor(client, name, master, password, config):
+    """Make the sentinel monitor the master with the given name.
+
+    The master (hostname, port) endpoint is only used if the master is not
+    already monitored.
+    Masters with other names, like the one included in the default sentinel
+    configuration file, are removed.
+    """
+    masters = client.execute('SENTINEL', 'MASTERS')
+    names = [_as_dict(master)['name'] for master in masters]
+    for other in names:
+        if other != name:
+            hookutils.log('Removing master {} from the sentinel.'.format(
+                other))
+            client.execute('SENTINEL', 'REMOVE', other)
+    if name not in names:
+        hookutils.log('Monitoring master {} at {}:{}.'.format(name, *master))
+        client.execute(
+            'SENTINEL', 'MONITOR', name, master[0], master[1],
+            config['sentinel-quorum'])
+    args = [
+        'quorum', config['sentinel-quorum'],
+        'down-after-milliseconds', config['sentinel-down-after-milliseconds'],
+    ]
+    if password:
+        args.extend(['auth-pass', password])
+    client.execute('SENTINEL', 'SET', name, *args)
+
+
+def _connect(config):
+    """Return a client connected to the local sentinel.
+
+    Raise a RedisError if the sentinel cannot be reached.
+    """
+    return redisclient.Client(
+        hookenv.unit_private_ip(), config['sentinel-port'])
+
+
+def _as_dict(reply):
+    """Convert the given flat list of names and values to a dict."""
+    return dict(zip(reply[::2], reply[1::2]))
@@ -13,11 +13,22 @@ redis-slave. The idea is that either the former or the latter can be ready at
 the same time, but not both or none. If the "redis1:master redis2:slave"
 relation is established and ready, then the redis-slave service definition is
 enabled on redis2 units. In all the other cases the redis-master definition is
-enabled.
+enabled. In cluster mode the slave relation is ignored, and all the units of
+the application are nodes of the same redis cluster, managed by the leader.
+When peer replication is enabled and the slave relation is not established,
+the units of the application replicate a master elected by the leader.
 
 The redis server itself is always running, and it is only restarted when a
-change is detected in its configuration file, due to charm config changes or to
-slave relation established.
+change that cannot be applied at runtime is detected in its configuration file,
+due to charm config changes or to slave relation established. Depending on the
+charm configuration, several redis instances can run on each unit: all of them
+are managed by the same service definition. When enabled, the redis sentinel
+also runs on each unit, monitoring the master and promoting a slave if the
+master fails.
+
+Hooks of the db and local relations only provide data to clients: the service
+manager does not reconfigure the services in these hooks, so that the cost of
+each of them does not grow with the number of clients.
 """
 
 import functools
@@ -25,23 +36,53 @@ import functools
 from charmhelpers.core import hookenv
 from charmhelpers.core.services import base
 
+import clusterutils
+import electionutils
 import hookutils
+import instanceutils
 import serviceutils
 import relations
+import replicationutils
+import restartutils
+import sentinelutils
+import upgradeutils
+
+
+# Define the relations whose hooks only affect the data provided to clients,
+# mapped to their relation contexts.
+PROVIDER_RELATIONS = {
+    'db': relations.DbRelation,
+    'local': relations.LocalRelation,
+}
 
 
 @hookutils.hook_name_logged
 def manage():
     """Set up the service manager for redis."""
+    relation_name = hookenv.hook_name().partition('-relation-')[0]
+    if relation_name in PROVIDER_RELATIONS:
+        provide_data(PROVIDER_RELATIONS[relation_name](get_data=False))
+        return
     config = hookenv.config()
+    instances = instanceutils.get_instances(
+        config['port'], config['instances'])
+    previous_instances = instanceutils.get_instances(
+        config.previous('port'), config.previous('instances'))
+    ports = [instance.port for instance in instances]
     service_start = functools.partial(
-        serviceutils.service_start, config['port'], config.previous('port'))
-    service_stop = functools.partial(serviceutils.service_stop, config['port'])
+        serviceutils.service_start, instances, previous_instances)
+    service_stop = functools.partial(
+        serviceutils.service_stop, config, instances)
     # Handle relations.
     db_relation = relations.DbRelation()
+    local_relation = relations.LocalRelation()
     master_relation = relations.MasterRelation()
     slave_relation = relations.SlaveRelation()
-    slave_relation_ready = slave_relation.is_ready()
+    # In cluster mode replication is managed by the cluster itself.
+    slave_relation_ready = (
+        slave_relation.is_ready() and not config['cluster-enabled'])
+    cluster_relation = relations.ClusterRelation()
+    replication_relation = relations.ReplicationRelation()
 
     # Set up the service manager.
     manager = base.ServiceManager([
@@ -50,20 +91,32 @@ def manage():
             'service': 'redis-master',
 
             # Ports to open when the service starts.
-            'ports': [config['port']],
+            'ports': ports,
 
             # Context managers for provided relations.
-            'provided_data': [db_relation, master_relation],
+            'provided_data': [
+                db_relation, local_relation, master_relation,
+                cluster_relation, replication_relation,
+            ],
 
             # Data (contexts) required to start the service.
             'required_data': [config, not slave_relation_ready],
 
             # Callables called when required data is ready.
             'data_ready': [
+                serviceutils.configure_kernel(config),
+                replicationutils.sample_write_rate(config),
+                electionutils.elect(config, replication_relation),
                 serviceutils.write_config_file(
                     config,
                     db_relation=db_relation,
+                    local_relation=local_relation,
                     master_relation=master_relation),
+                clusterutils.manage(config, cluster_relation),
+                sentinelutils.configure(config),
+                upgradeutils.upgrade(
+                    config, [db_relation, local_relation, master_relation]),
+                restartutils.update_status(config),
             ],
 
             # Callables called when it is time to start the service.
@@ -77,20 +130,29 @@ def manage():
             'service': 'redis-slave',
 
             # Ports to open when the service starts.
-            'ports': [config['port']],
+            'ports': ports,
 
             # Context managers for provided relations.
-            'provided_data': [db_relation],
+            'provided_data': [
+                db_relation, local_relation, slave_relation,
+                replication_relation,
+            ],
 
             # Data (contexts) required to start the service.
             'required_data': [config, slave_relation_ready],
 
             # Callables called when required data is ready.
             'data_ready': [
+                serviceutils.configure_kernel(config),
+                replicationutils.sample_write_rate(config),
                 serviceutils.write_config_file(
                     config,
                     db_relation=db_relation,
+                    local_relation=local_relation,
                     slave_relation=slave_relation),
+                sentinelutils.configure(config, slave_relation=slave_relation),
+                upgradeutils.upgrade(config, [db_relation, local_relation]),
+                restartutils.update_status(config),
             ],
 
             # Callables called when it is time to start the service.
@@ -100,4 +162,34 @@ def manage():
             'stop': [service_stop],
         }
     ])
+    # The restart, sync and upgrade locks must be handled before the manager
+    # runs the callbacks.
+    restartutils.setup()
+    replicationutils.setup()
+    upgradeutils.setup()
     manager.manage()
+
+
+def provide_data(relation):
+    """Handle a hook of a relation which only provides data to clients.
+
+    Client units joining or changing the relation do not affect the redis
+    configuration, so the services are not reconfigured, and the relation
+    data is only set on the relation of the current hook. Nothing is done when
+    units depart. This keeps the cost of each hook independent from the
+    number of clients.
+    """
+    manager = base.ServiceManager([
+        {
+            # The name of the service providing data to clients.
+            'service': 'redis-clients',
+
+            # Context managers for provided relations.
+            'provided_data': [relation],
+        },
+    ])
+    # The locks must still be handled, as in any other hook.
+    restartutils.setup()
+    replicationutils.setup()
+    upgradeutils.setup()
+    manager.manage(provide_only=True)
@@ -7,6 +7,8 @@ This module includes closures and callbacks suitable to be used when
 registering callables in the services framework manager.
 """
 
+import re
+
 from charmhelpers import fetch
 from charmhelpers.core import (
     hookenv,
@@ -14,47 +16,131 @@ from charmhelpers.core import (
 )
 
 import configfile
+import electionutils
 import hookutils
+import instanceutils
+import kerneltuning
+import redisclient
+import replicationutils
+import resources
+import restartutils
+import sentinelutils
 import settings
 
 
-def service_start(port, previous_port, service_name):
-    """Start the service if not already running.
+def service_start(instances, previous_instances, service_name):
+    """Start the redis instances if not already running.
 
-    Receive the current port on which the redis server is listening to and the
-    previous one. Open/close the Juju ports accordingly.
+    Receive the redis instances which must be running on this unit and the
+    ones which were running before the current hook. Stop the instances which
+    are no longer required, and open/close the Juju ports accordingly.
     """
-    if not host.service_running(settings.SERVICE_NAME):
-        hookutils.log('Starting service {}.'.format(service_name))
-        host.service_start(settings.SERVICE_NAME)
-    if previous_port is not None:
-        hookenv.close_port(previous_port)
-    hookenv.open_port(port)
+    for instance in instances:
+        if not host.service_running(instance.service_name):
+            hookutils.log('Starting service {}.'.format(
+                _describe(service_name, instance)))
+            if instance.index:
+                # Additional instances must also be started at boot.
+                host.service('enable', instance.service_name)
+            host.service_start(instance.service_name)
+    ports = [instance.port for instance in instances]
+    for instance in previous_instances:
+        if instance.index >= len(instances):
+            _remove_instance(instance, service_name)
+        if instance.port not in ports:
+            hookenv.close_port(instance.port)
+    for port in ports:
+        hookenv.open_port(port)
 
 
-def service_stop(port, service_name):
-    """Stop the service if it is running and if the stop hook is executing.
+def service_stop(config, instances, service_name):
+    """Stop the redis instances if running and if the stop hook is executing.
 
-    Receive the current port on which the redis server is listening to.
+    Receive the hook environment configuration and the redis instances
+    running on this unit.
 
     If the stop hook is executing, also close the service ports and remove the
-    redis package and its configuration files.
+    redis package and its configuration files. If the keep-data-on-stop
+    option is set, the datasets are saved to disk before stopping the
+    servers, and the package, configuration and data files are preserved, so
+    that redeploying on the same machine starts with a warm dataset.
     """
     if hookenv.hook_name() != 'stop':
         # There is no need to stop the service if we are not in the stop hook.
         return
-    if host.service_running(settings.SERVICE_NAME):
-        hookutils.log('Stopping service {}.'.format(service_name))
-        host.service_stop(settings.SERVICE_NAME)
-    # Close the service port.
-    hookenv.close_port(port)
-    # Remove redis package and clean up files.
+    keep_data = config['keep-data-on-stop']
+    for instance in instances:
+        if host.service_running(instance.service_name):
+            if keep_data:
+                _save(instance, config['password'].strip() or None)
+            hookutils.log('Stopping service {}.'.format(
+                _describe(service_name, instance)))
+            host.service_stop(instance.service_name)
+        # Close the service port.
+        hookenv.close_port(instance.port)
+    if keep_data:
+        hookutils.log('Keeping system packages and data.')
+        return
+    # Remove redis packages, including the sentinel, and clean up files.
     hookutils.log('Removing system packages.')
-    fetch.apt_purge(settings.PACKAGES)
+    fetch.apt_purge(settings.PACKAGES + [settings.SENTINEL_PACKAGE])
+
+
+def _save(instance, password):
+    """Synchronously save the dataset of the given redis instance to disk.
+
+    Failures are logged, so that the server can be stopped anyway.
+    """
+    hookutils.log('Saving the dataset of {}.'.format(instance.service_name))
+    try:
+        with redisclient.Client(
+                hookenv.unit_private_ip(), instance.port, password=password,
+                timeout=settings.SAVE_TIMEOUT) as client:
+            client.execute('SAVE')
+    except redisclient.RedisError as err:
+        hookutils.log('Cannot save the dataset: {}.'.format(err))
+
+
+def _remove_instance(instance, service_name):
+    """Stop and disable an additional redis instance no longer required.
+
+    The instance data directory is preserved.
+    """
+    if host.service_running(instance.service_name):
+        hookutils.log('Stopping service {}.'.format(
+            _describe(service_name, instance)))
+        host.service_stop(instance.service_name)
+    host.service('disable', instance.service_name)
+
+
+def _describe(service_name, instance):
+    """Return a description of the given redis instance for logging."""
+    if instance.index:
+        return '{} instance {}'.format(service_name, instance.index)
+    return service_name
+
+
+def configure_kernel(config):
+    """Return a callback tuning the kernel for redis.
+
+    The config argument is the hook environment configuration. The callback
+    can be used in the services framework, and it applies or removes the
+    kernel tuning depending on the kernel-tuning option. It must be called
+    before the redis configuration file is written, so that the tuning is
+    already in place if the service is restarted.
+    """
+    def callback(service_name):
+        if config['kernel-tuning']:
+            kerneltuning.apply(config['tcp-backlog'])
+        else:
+            kerneltuning.remove()
+
+    return callback
 
 
 def write_config_file(
-        config, db_relation=None, master_relation=None, slave_relation=None):
+        config, db_relation=None, local_relation=None, master_relation=None,
+        slave_relation=None):
     """Wrap the configfile.write function building options for the config.
 
     The config argument is the hook environment configuration.
@@ -62,36 +148,99 @@ def write_config_file(
     assumed to be ready.
 
     Return a function that can be used as a callback in the services framework,
-    and that generates the redis configuration file.
+    and that generates the configuration files of all the redis instances
+    running on this unit.
 
-    This returned functions also takes care of restarting the service if the
-    configuration changed.
+    This returned functions also takes care of applying configuration changes
+    to the running servers, restarting them only if the changes cannot be
+    applied at runtime. Running servers are restarted on one unit at a time,
+    possibly in a later hook.
     """
     def callback(service_name):
-        options = _get_service_options(config, slave_relation)
-        hookutils.log(
-            'Writing configuration file for {}.'.format(service_name))
-        changed = configfile.write(options, settings.REDIS_CONF)
-        if changed:
+        instances = instanceutils.get_instances(
+            config['port'], config['instances'])
+        changed = False
+        restarts = []
+        endpoints = {}
+        running_endpoints = {}
+        admitted = None
+        syncing = []
+        for instance in instances:
+            instanceutils.setup(instance)
+            options = _get_service_options(
+                config, slave_relation, instance, len(instances))
+            endpoints[instance.service_name] = (
+                options['bind'], options['port'], options.get('requirepass'))
+            hookutils.log('Writing configuration file for {}.'.format(
+                _describe(service_name, instance)))
+            previous_options = configfile.read(instance.conf)
+            if previous_options:
+                # Running servers are shut down using their current address.
+                running_endpoints[instance.service_name] = (
+                    previous_options['bind'], int(previous_options['port']),
+                    previous_options.get('requirepass'))
+            slaveof = options.get('slaveof')
+            # Only fresh replicas are admitted: servers already replicating
+            # are re-pointed immediately, and can often partially resync,
+            # and servers holding data or with a replication history are
+            # not new to the replication setup.
+            initial_sync = (
+                slaveof is not None and
+                not previous_options.get('slaveof') and
+                replicationutils.is_fresh(*running_endpoints.get(
+                    instance.service_name,
+                    endpoints[instance.service_name])))
+            if initial_sync:
+                # Replicating a master for the first time requires a full
+                # initial sync.
+                if admitted is None:
+                    admitted = replicationutils.admit_sync(config)
+                if not admitted:
+                    _keep_replication(previous_options, options)
+                    initial_sync = False
+            if not configfile.write(options, instance.conf):
+                continue
+            changed = True
+            if initial_sync:
+                syncing.append(instance.service_name)
+            if _apply_runtime_changes(
+                    previous_options, options, instance.service_name):
+                continue
             hookutils.log('Restarting service due to configuration change.')
-            host.service_restart(settings.SERVICE_NAME)
-            # If the configuration changed, it is possible that related units
-            # require notification of changes. For this reason, update all the
-            # existing established relations. This is required because
-            # "services.provide_data" is only called when the current hook
-            # is a relation joined or changed.
-            _update_relations(filter(None, [db_relation, master_relation]))
-        else:
+            if (host.service_running(instance.service_name) and
+                    instance.service_name not in syncing):
+                # Restart running servers on one unit at a time. Servers
+                # starting their initial sync are already serialized.
+                restarts.append(instance.service_name)
+            else:
+                host.service_restart(instance.service_name)
+        restarted = restartutils.restart(
+            restarts, endpoints, running_endpoints)
+        for name in syncing:
+            # The sync lock is released at the end of the hook.
+            hookutils.log(
+                'Waiting for {} to complete the initial sync.'.format(name))
+            restartutils.wait_until_ready(
+                *endpoints[name], timeout=settings.SYNC_TIMEOUT)
+        if not changed:
             hookutils.log('No changes detected in the configuration file.')
+        if changed or restarted:
+            # If the configuration changed, or the servers restarted, it is
+            # possible that related units require notification of changes.
+            # For this reason, update all the existing established relations
+            # right away, rather than when the whole hook completes.
+            update_relations(filter(
+                None, [db_relation, local_relation, master_relation]))
 
     return callback
 
 
-def _get_service_options(config, slave_relation=None):
+def _get_service_options(config, slave_relation, instance, num_instances):
     """Return a dict containing the redis service configuration options.
 
-    Receive the hook environment config object and optionally the slave
-    relation context.
+    Receive the hook environment config object, the slave relation context
+    (or None), the redis instance being configured and the total number of
+    instances running on this unit.
     """
     hookutils.log('Retrieving service options.')
     # To introduce more redis configuration options in the charm, add them to
@@ -104,29 +253,339 @@ def _get_service_options(config, slave_relation=None):
         'databases': config['databases'],
         'logfile': config['logfile'],
         'loglevel': config['loglevel'],
-        'port': config['port'],
+        'port': instance.port,
         'tcp-keepalive': config['tcp-keepalive'],
         'timeout': config['timeout'],
     }
+    options.update(instanceutils.get_options(instance, config['logfile']))
+    unixsocket = instanceutils.get_unixsocket(
+        instance, config['unixsocket'].strip())
+    if unixsocket:
+        # Co-located clients can skip the TCP stack by using the socket.
+        options['unixsocket'] = unixsocket
+        options['unixsocketperm'] = config['unixsocketperm']
     password = config['password'].strip()
     if password:
         options['requirepass'] = password
+    maxmemory = config['maxmemory'].strip()
+    if maxmemory:
+        options['maxmemory'] = _get_maxmemory(maxmemory, num_instances)
+        options['maxmemory-policy'] = config['maxmemory-policy']
+    options.update(_get_persistence_options(config))
+    backlog_size = replicationutils.get_backlog_size(
+        config['repl-backlog-size'], config['repl-backlog-seconds'],
+        instance.service_name, num_instances)
+    if backlog_size:
+        options['repl-backlog-size'] = backlog_size
+    # Any server can be the master of other units, e.g. after a failover.
+    options.update({
+        'repl-diskless-sync': _yes_no(config['repl-diskless-sync']),
+        'repl-diskless-sync-delay': config['repl-diskless-sync-delay'],
+    })
+    io_threads = _get_io_threads(config['io-threads'], num_instances)
+    if io_threads > 1:
+        options['io-threads'] = io_threads
+        options['io-threads-do-reads'] = _yes_no(config['io-threads-do-reads'])
+    if config['kernel-tuning']:
+        # The kernel accept queue is only large enough to honor the backlog
+        # if the kernel has been tuned by the charm.
+        options['tcp-backlog'] = config['tcp-backlog']
+    if config['cluster-enabled']:
+        options.update({
+            'cluster-config-file': settings.CLUSTER_CONFIG_FILE,
+            'cluster-enabled': 'yes',
+            'cluster-node-timeout': config['cluster-node-timeout'],
+        })
+    master = masterauth = None
     if slave_relation is not None:
         hookutils.log('Setting up slave relation.')
         # If slave_relation is defined, it is assumed that the relation is
         # ready, i.e. that the slave_relation dict evaluates to True.
         data = slave_relation[slave_relation.name][0]
-        options['slaveof'] = '{hostname} {port}'.format(**data)
-        password = data.get('password')
-        if password:
-            options['masterauth'] = password
+        master = _get_master_endpoint(data, instance)
+        masterauth = data.get('password')
+    elif electionutils.is_enabled(config):
+        # Units of the same application share the same password.
+        master = electionutils.get_master_endpoint(instance)
+        masterauth = password
+    if sentinelutils.is_enabled(config) and not instance.index:
+        # After a failover the sentinels know better than the relation data
+        # which server is the master. Replicas of another application are
+        # assumed to share the same password.
+        current_master = sentinelutils.get_current_master(
+            config, slave_relation)
+        if current_master is not None:
+            master = current_master
+            if master == (options['bind'], instance.port):
+                master = None
+            masterauth = masterauth or password
+    if master is not None:
+        options['slaveof'] = '{} {}'.format(*master)
+        if masterauth:
+            options['masterauth'] = masterauth
+        options.update(_get_replica_options(config))
+    return _exclude_unsupported_options(options)
+
+
+def _keep_replication(previous_options, options):
+    """Keep the replication settings of the previous options.
+
+    This is used to delay the replication of the master until the initial
+    sync of a fresh replica is admitted.
+    """
+    for key in ('masterauth', 'slaveof'):
+        if key in previous_options:
+            options[key] = previous_options[key]
+        else:
+            options.pop(key, None)
+
+
+def _get_replica_options(config):
+    """Return the redis options tuning how replicas load the master data.
+
+    Raise a ValueError if the diskless load mode is not valid.
+    """
+    mode = config['repl-diskless-load']
+    if mode not in settings.REPL_DISKLESS_LOAD_MODES:
+        raise ValueError('invalid diskless load mode: {!r}'.format(mode))
+    return {
+        'repl-diskless-load': mode,
+        'replica-lazy-flush': _yes_no(config['replica-lazy-flush']),
+    }
+
+
+def _get_master_endpoint(data, instance):
+    """Return the master endpoint to be replicated by the given instance.
+
+    Receive the slave relation data. Each redis instance replicates the
+    master instance with the same index, if available.
+    Return a (hostname, port) tuple, or None if there is no master instance
+    to be replicated.
+    """
+    if not instance.index:
+        return data['hostname'], data['port']
+    endpoints = instanceutils.parse_endpoints(data.get('endpoints', ''))
+    if instance.index < len(endpoints):
+        return endpoints[instance.index]
+    return None
+
+
+def _get_io_threads(value, num_instances=1):
+    """Return the number of redis I/O threads for the given option value.
+
+    The value can be "auto" or a number of threads. In the former case, the
+    CPUs available to the unit are split between the redis instances.
+    Raise a ValueError if the value is not valid.
+    """
+    value = '{}'.format(value).strip()
+    if value == 'auto':
+        cpus = resources.get_cpu_count() // num_instances
+        if cpus < settings.IO_THREADS_MIN_CPUS:
+            return 1
+        return min(
+            int(cpus * settings.IO_THREADS_CPU_FRACTION),
+            settings.IO_THREADS_MAX)
+    if not value.isdigit() or int(value) < 1:
+        raise ValueError('invalid number of I/O threads: {!r}'.format(value))
+    return int(value)
+
+
+def _get_persistence_options(config):
+    """Return the redis options implementing the selected persistence profile.
+
+    Raise a ValueError if the persistence profile is not valid.
+    """
+    profile = config['persistence']
+    if profile not in settings.PERSISTENCE_PROFILES:
+        raise ValueError('invalid persistence profile: {!r}'.format(profile))
+    rdb = profile in ('rdb', 'rdb+aof')
+    aof = profile in ('aof', 'rdb+aof')
+    options = {
+        'appendonly': _yes_no(aof),
+        # The empty save point resets the ones defined in the default redis
+        # configuration file, so that RDB snapshots are disabled unless save
+        # points are added below.
+        'save': ['""'],
+    }
+    if rdb:
+        options['save'].extend(settings.RDB_SAVE_POINTS)
+        # Fsync the RDB file incrementally while saving it, in order to avoid
+        # big latency spikes when the whole file is flushed to disk.
+        options['rdb-save-incremental-fsync'] = 'yes'
+    if aof:
+        options.update({
+            'aof-use-rdb-preamble': 'yes',
+            'appendfsync': config['appendfsync'],
+            'auto-aof-rewrite-min-size': settings.AOF_REWRITE_MIN_SIZE,
+            'auto-aof-rewrite-percentage': settings.AOF_REWRITE_PERCENTAGE,
+            'no-appendfsync-on-rewrite': _yes_no(
+                config['no-appendfsync-on-rewrite']),
+        })
     return options
 
 
-def _update_relations(relations):
+def _exclude_unsupported_options(options):
+    """Remove from options the ones not supported by the installed redis.
+
+    Return the resulting options.
+    """
+    version = _get_redis_version()
+    for key, min_version in settings.OPTION_MIN_VERSIONS.items():
+        if key in options and (version is None or version < min_version):
+            hookutils.log(
+                'Option {} not supported by the installed redis.'.format(key))
+            del options[key]
+    if 'cluster-enabled' not in options:
+        # Cluster options are only valid if cluster mode is enabled.
+        options.pop('cluster-config-file', None)
+        options.pop('cluster-node-timeout', None)
+    return options
+
+
+def _get_redis_version():
+    """Return the installed redis version as a (major, minor) tuple.
+
+    Return None if redis is not installed or its version cannot be parsed.
+    """
+    version = fetch.get_installed_version(settings.REDIS_PACKAGE)
+    if version is None:
+        return None
+    # Debian versions look like "5:6.0.16-1ubuntu1": strip the epoch.
+    match = re.match(r'(\d+)\.(\d+)', version.ver_str.split(':')[-1])
+    if match is None:
+        return None
+    return tuple(int(i) for i in match.groups())
+
+
+def _yes_no(value):
+    """Return the redis representation of the given boolean value."""
+    return 'yes' if value else 'no'
+
+
+def _get_maxmemory(value, num_instances=1):
+    """Return the redis maxmemory in bytes for the given option value.
+
+    The value can be "auto", a percentage of the memory available to the unit
+    (e.g. "75%") or an absolute size (e.g. "4gb"). In the first two cases the
+    memory is split between the redis instances running on this unit, while
+    absolute sizes apply to each instance.
+    Raise a ValueError if the value is not valid.
+    """
+    if value == 'auto':
+        fraction = settings.MAXMEMORY_AUTO_FRACTION
+    elif value.endswith('%'):
+        try:
+            percentage = float(value[:-1])
+        except ValueError:
+            percentage = None
+        if percentage is None or not 0 < percentage <= 100:
+            raise ValueError('invalid memory percentage: {!r}'.format(value))
+        fraction = percentage / 100
+    else:
+        return resources.parse_size(value)
+    return int(resources.get_memory_limit() * fraction / num_instances)
+
+
+def _apply_runtime_changes(previous_options, options, service_name):
+    """Apply configuration changes to the running redis server.
+
+    Receive the options in the previous and in the new configuration files,
+    and the name of the system service running the server. Changes are
+    applied using CONFIG SET, or REPLICAOF for the replicated master,
+    connecting to the server as described by the previous options.
+
+    Return True if all the changes have been applied. Return False if at least
+    one of the changed options cannot be modified at runtime, or if the server
+    could not be updated: in these cases the service must be restarted.
+    """
+    if not previous_options or not host.service_running(service_name):
+        return False
+    changes = {}
+    slaveof_changed = False
+    for key in set(previous_options).union(options):
+        values = _as_strings(options.get(key))
+        if values == _as_strings(previous_options.get(key)):
+            continue
+        if key == 'slaveof':
+            # Replication is changed at runtime after the other options, so
+            # that the server keeps its replication ID and offset and it can
+            # continue with a partial resync from the new master.
+            slaveof_changed = True
+            continue
+        if key not in settings.RUNTIME_OPTIONS:
+            hookutils.log(
+                'Option {} cannot be changed at runtime.'.format(key))
+            return False
+        if values is None:
+            changes[key] = settings.RUNTIME_OPTIONS[key]
+            continue
+        # Repeated options, like RDB save points, are set all at once. In this
+        # case the empty placeholder used in the file to reset the option is
+        # not required.
+        changes[key] = ' '.join(i for i in values if i != '""')
+    hookutils.log('Applying configuration changes at runtime.')
+    try:
+        with redisclient.Client(
+                previous_options['bind'], previous_options['port'],
+                password=previous_options.get('requirepass')) as client:
+            for key, value in sorted(changes.items()):
+                client.execute('CONFIG', 'SET', key, value)
+            # The sentinel reconfigures replication at runtime when failing
+            # over, in which case the server already replicates the master.
+            slaveof = options.get('slaveof')
+            if slaveof_changed and not _is_replicating(client, slaveof):
+                _replicate(client, slaveof)
+    except redisclient.RedisError as err:
+        hookutils.log('Cannot apply changes at runtime: {}.'.format(err))
+        return False
+    return True
+
+
+def _replicate(client, slaveof):
+    """Make the server replicate the given master at runtime.
+
+    Receive a client connected to the server and the "hostname port" master
+    address, or None if the server must stop replicating and become a master.
+    """
+    args = slaveof.split() if slaveof else ['NO', 'ONE']
+    hookutils.log('Replicating {} at runtime.'.format(slaveof or 'no master'))
+    # REPLICAOF is the new name of the SLAVEOF command since redis 5.0.
+    version = _get_redis_version()
+    command = 'REPLICAOF' if version and version >= (5, 0) else 'SLAVEOF'
+    client.execute(command, *args)
+
+
+def _is_replicating(client, slaveof):
+    """Report whether the server is already replicating the given master.
+
+    Receive a client connected to the server and the "hostname port" master
+    address, or None if the server must be a master.
+    """
+    values = redisclient.parse_info(client.execute('INFO', 'replication'))
+    if slaveof is None:
+        return values.get('role') == 'master'
+    hostname, port = slaveof.split()
+    return (
+        values.get('role') == 'slave' and
+        values.get('master_host') == hostname and
+        values.get('master_port') == port)
+
+
+def _as_strings(value):
+    """Return the given option value as a list of strings.
+
+    Return None if the value is None.
+    """
+    if value is None:
+        return None
+    values = value if isinstance(value, list) else [value]
+    return ['{}'.format(i) for i in values]
+
+
+def update_relations(relations):
     """Update existing established relations."""
     for relation in relations:
         name = relation.name
         for relation_id in hookenv.relation_ids(name):
             hookutils.log('Updating data for relation {}.'.format(name))
-            hookenv.relation_set(relation_id, relation.provide_data())
+            hookenv.relation_set_changed(relation_id, relation.provide_data())
@@ -9,7 +9,174 @@ DEFAULT_REDIS_CONF = '/etc/redis/redis.conf'
 REDIS_CONF = '/etc/redis/redis-charm.conf'
 
 # Define Debian packages to be installed.
-PACKAGES = ['redis-server']
+REDIS_PACKAGE = 'redis-server'
+PACKAGES = [REDIS_PACKAGE]
 
 # Define the name of the init service set up when installing redis.
 SERVICE_NAME = 'redis-server'
+
+# Define the system user running redis.
+REDIS_USER = 'redis'
+
+# Define the templated systemd service, the configuration file, the data
+# directory, the pid file and the unix socket used by additional redis
+# instances. The pid file must match the one expected by the systemd unit
+# provided by the package, and the socket is stored in the same runtime
+# directory, which only exists while the instance is running.
+INSTANCE_SERVICE_NAME = 'redis-server@{}'
+INSTANCE_CONF = '/etc/redis/redis-{}.conf'
+INSTANCE_DIR = '/var/lib/redis/instance-{}'
+INSTANCE_PIDFILE = '/run/redis-{}/redis-server.pid'
+INSTANCE_UNIXSOCKET = '/run/redis-{}/redis-server.sock'
+
+# Define the redis options which can be changed at runtime using CONFIG SET,
+# mapped to the values restoring the redis defaults when the options are
+# removed from the customized configuration file. The slaveof option is also
+# changed at runtime, using the REPLICAOF command. A change to any other option
+# requires the service to be restarted.
+RUNTIME_OPTIONS = {
+    'aof-use-rdb-preamble': 'yes',
+    'appendfsync': 'everysec',
+    'appendonly': 'no',
+    'auto-aof-rewrite-min-size': '64mb',
+    'auto-aof-rewrite-percentage': '100',
+    'cluster-node-timeout': '15000',
+    'loglevel': 'notice',
+    'masterauth': '',
+    'maxmemory': '0',
+    'maxmemory-policy': 'noeviction',
+    'no-appendfsync-on-rewrite': 'no',
+    'rdb-save-incremental-fsync': 'yes',
+    'repl-backlog-size': '1mb',
+    'repl-diskless-load': 'disabled',
+    'repl-diskless-sync': 'no',
+    'repl-diskless-sync-delay': '5',
+    'replica-lazy-flush': 'no',
+    'requirepass': '',
+    'save': '900 1 300 10 60 10000',
+    'tcp-keepalive': '300',
+    'timeout': '0',
+}
+
+# Define the minimum redis versions supporting configuration options which are
+# not available in all the redis releases the charm can be deployed with.
+# Options are not included in the configuration file if the installed redis
+# version does not support them.
+OPTION_MIN_VERSIONS = {
+    'aof-use-rdb-preamble': (4, 0),
+    # Cluster mode is available since redis 3.0, but the charm relies on the
+    # cluster manager introduced in redis-cli 5.0.
+    'cluster-enabled': (5, 0),
+    'io-threads': (6, 0),
+    'io-threads-do-reads': (6, 0),
+    'rdb-save-incremental-fsync': (5, 0),
+    'repl-diskless-load': (6, 0),
+    'replica-lazy-flush': (5, 0),
+}
+
+# Define the fraction of the memory available to the unit used as redis
+# maxmemory when the maxmemory option is "auto". The remaining memory is left
+# for the copy-on-write pages duplicated while forking to persist the dataset
+# and for the replication and client output buffers.
+MAXMEMORY_AUTO_FRACTION = 0.5
+
+# Define the persistence profiles supported by the persistence option.
+PERSISTENCE_PROFILES = ('none', 'rdb', 'aof', 'rdb+aof')
+
+# Define when to save the RDB snapshots if RDB persistence is enabled, as
+# "seconds changes" pairs: a snapshot is saved after the given number of
+# seconds if at least the given number of keys changed.
+RDB_SAVE_POINTS = ['900 1', '300 10', '60 10000']
+
+# Define how replicas load the dataset received from the master when the
+# replication is diskless: "disabled" stores it on disk first, "on-empty-db"
+# loads it directly from the socket only if the dataset is empty, and "swapdb"
+# keeps the current dataset in memory while loading the new one.
+REPL_DISKLESS_LOAD_MODES = ('disabled', 'on-empty-db', 'swapdb')
+
+# Define when the append only file is automatically rewritten if AOF
+# persistence is enabled: the file is rewritten when it grows by the given
+# percentage since the last rewrite and it is at least of the given size.
+AOF_REWRITE_PERCENTAGE = 100
+AOF_REWRITE_MIN_SIZE = '64mb'
+
+# Define the files used to tune the kernel for redis.
+SYSCTL_CONF = '/etc/sysctl.d/50-redis-charm.conf'
+THP_DROPIN = '/etc/systemd/system/{}.service.d/50-redis-charm-thp.conf'.format(
+    SERVICE_NAME)
+THP_FILES = (
+    '/sys/kernel/mm/transparent_hugepage/enabled',
+    '/sys/kernel/mm/transparent_hugepage/defrag',
+)
+SOMAXCONN_FILE = '/proc/sys/net/core/somaxconn'
+
+# Define how I/O threads are sized when the io-threads option is "auto". Only
+# use I/O threads if the unit has at least the given number of CPUs, leave
+# some of them to the main thread and to the rest of the system, and never
+# use more than the maximum number of threads, as there is no performance gain
+# beyond that.
+IO_THREADS_MIN_CPUS = 4
+IO_THREADS_CPU_FRACTION = 0.75
+IO_THREADS_MAX = 8
+
+# Define the minimum number of masters required to create a redis cluster.
+CLUSTER_MIN_MASTERS = 3
+
+# Define the name of the cluster configuration file, stored in the data
+# directory of each redis instance.
+CLUSTER_CONFIG_FILE = 'nodes.conf'
+
+# Define the Debian package, the system service and the configuration file of
+# the redis sentinel. The configuration file is also used by the sentinel to
+# persist its state, so the charm only updates the options it manages.
+SENTINEL_PACKAGE = 'redis-sentinel'
+SENTINEL_SERVICE_NAME = 'redis-sentinel'
+SENTINEL_CONF = '/etc/redis/sentinel.conf'
+SENTINEL_CONF_PERMS = 0o640
+
+# Define the number of seconds a redis server is given to save its dataset to
+# disk before being stopped.
+SAVE_TIMEOUT = 600
+
+# Define the lock used to restart redis on one unit at a time, and the number
+# of seconds a restarted server is given to load its dataset and to connect
+# to its master before the lock is released anyway.
+RESTART_LOCK = 'restart'
+RESTART_READY_TIMEOUT = 600
+RESTART_READY_INTERVAL = 2
+
+# Define how the replication backlog is sized when the repl-backlog-size
+# option is "auto". The backlog is never smaller than the minimum size, and
+# never larger than the given fraction of the memory available to each
+# instance. The observed write rate decays by the given factor at every
+# sample, so that the backlog can shrink when writes decrease.
+REPL_BACKLOG_MIN_SIZE = 16 * 1024 * 1024
+REPL_BACKLOG_MAX_FRACTION = 0.1
+REPL_BACKLOG_RATE_DECAY = 0.9
+
+# Define the lock admitting initial syncs of new replicas, and the number of
+# seconds a replica is given to complete its initial sync before the lock is
+# released anyway. The hook waits for the sync while holding the machine
+# lock, so the wait is bounded like restarts: longer syncs complete in the
+# background, and their progress is reported in the update-status hook.
+SYNC_LOCK = 'sync'
+SYNC_TIMEOUT = RESTART_READY_TIMEOUT
+
+# Define the leader settings key storing the endpoints of the master unit
+# elected when peer replication is enabled.
+MASTER_LEADER_KEY = 'master-endpoints'
+
+# Define how many bytes a replica can lag behind its master before it stops
+# being advertised as a read replica on the db relation.
+REPLICA_MAX_LAG = 1024 * 1024
+
+# Define the lock used to upgrade redis on one unit at a time, and the leader
+# settings key storing the last upgrade requested by the upgrade-redis action.
+UPGRADE_LOCK = 'upgrade'
+UPGRADE_LEADER_KEY = 'upgrade-requested'
+
+# Define the invoke-rc.d policy script used to prevent the package scripts
+# from restarting redis while it is upgraded, and its content, denying all
+# the actions (see /usr/share/doc/init-system-helpers/README.policy-rc.d).
+POLICY_RC_D = '/usr/sbin/policy-rc.d'
+POLICY_RC_D_CONTENT = '#!/bin/sh\nexit 101\n'
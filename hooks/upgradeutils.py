@@ -0,0 +1,208 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the GPLv3, see copyright file for details.
+
+"""Utilities for upgrading redis on all the units of the application.
+
+The upgrade-redis action, run on the leader unit, requests an upgrade by
+storing a new token in the leader settings. Each unit then requests the
+upgrade lock, which the leader grants to one unit at a time: the unit
+upgrades the redis packages, preventing the package scripts from restarting
+the servers cold, restarts them warm and only releases the lock when they are
+back in sync with their master.
+
+Replicas are upgraded first. When peer replication is enabled, the master
+unit is granted the lock only when all the other units completed the upgrade,
+and the leader then promotes the most caught-up replica, so that the old
+master is upgraded as a replica of the new one and writes are not
+interrupted. Units publish the last upgrade they completed on the
+replication peer relation.
+"""
+
+import contextlib
+from datetime import datetime
+import errno
+import os
+
+from charmhelpers import (
+    coordinator,
+    fetch,
+)
+from charmhelpers.core import (
+    hookenv,
+    unitdata,
+)
+
+import electionutils
+import hookutils
+import instanceutils
+import restartutils
+import sentinelutils
+import serviceutils
+import settings
+
+
+# Define the key used to store the token of the last completed upgrade.
+_COMPLETED_KEY = 'upgradeutils.completed'
+
+# Define the name of the peer relation where units publish their status.
+_PEER_RELATION_NAME = 'replication'
+
+
+def request():
+    """Request an upgrade of redis on all the units of the application.
+
+    This must be called on the leader unit. Return the upgrade token.
+    """
+    token = datetime.utcnow().isoformat()
+    hookenv.leader_set({settings.UPGRADE_LEADER_KEY: token})
+    return token
+
+
+def get_completed():
+    """Return the token of the last upgrade completed on this unit.
+
+    Return None if no upgrade has been completed yet.
+    """
+    return unitdata.kv().get(_COMPLETED_KEY)
+
+
+class UpgradeCoordinator(coordinator.Serial):
+    """Grant the upgrade lock to replicas first, then to the master."""
+
+    def grant_upgrade(self, lock, unit, granted, queue):
+        """Grant the lock to one unit at a time, the master unit last.
+
+        When granting the lock to the master unit, a replica is promoted.
+        See coordinator.Serial.default_grant for a description of the
+        arguments.
+        """
+        if granted:
+            return False
+        units = _get_units()
+        master = _get_master_unit(units)
+        replicas = [name for name in queue if name != master]
+        if replicas:
+            return unit == replicas[0]
+        token = hookenv.leader_get(settings.UPGRADE_LEADER_KEY)
+        pending = [
+            name for name, data in units.items()
+            if name != master and data.get('upgraded') != token]
+        if pending:
+            hookutils.log('Waiting for {} to be upgraded.'.format(
+                ', '.join(sorted(pending))))
+            return False
+        electionutils.failover(
+            hookenv.config(), [data['endpoints'] for data in units.values()])
+        return True
+
+
+def setup():
+    """Set up the coordinator used to grant the upgrade lock.
+
+    This must be called before the services framework manager runs, so that
+    the lock requests are handled in every hook.
+    """
+    UpgradeCoordinator(relation_key='upgrade-coordinator')
+
+
+def upgrade(config, relations=()):
+    """Return a callback upgrading redis when requested.
+
+    The config argument is the hook environment configuration. The callback
+    can be used in the services framework, and it must be called after the
+    redis configuration files are written, so that a former master already
+    replicates the new one when it is upgraded. The given provided relations
+    are updated as soon as the upgraded servers are restarted.
+    """
+    def callback(service_name):
+        token = hookenv.leader_get(settings.UPGRADE_LEADER_KEY)
+        if not token or token == get_completed():
+            return
+        if not UpgradeCoordinator().acquire(settings.UPGRADE_LOCK):
+            hookutils.log('Waiting for the upgrade lock.')
+            return
+        hookutils.log('Upgrading system packages.')
+        packages = list(settings.PACKAGES)
+        if sentinelutils.is_enabled(config):
+            packages.append(settings.SENTINEL_PACKAGE)
+        hostname = hookenv.unit_private_ip()
+        password = config['password'].strip() or None
+        instances = instanceutils.get_instances(
+            config['port'], config['instances'])
+        fetch.apt_update(fatal=True)
+        with _no_package_restarts():
+            fetch.apt_install(packages, fatal=True)
+        for instance in instances:
+            # The lock is released at the end of the hook.
+            restartutils.warm_restart(
+                instance.service_name, hostname, instance.port, password,
+                timeout=settings.SYNC_TIMEOUT)
+        kv = unitdata.kv()
+        kv.set(_COMPLETED_KEY, token)
+        kv.flush()
+        serviceutils.update_relations(relations)
+
+    return callback
+
+
+@contextlib.contextmanager
+def _no_package_restarts():
+    """Prevent the package scripts from restarting services in the block.
+
+    The redis-server package restarts the server when upgraded, without
+    saving its dataset first: servers are instead restarted warm by the
+    charm. An existing policy script is left untouched.
+    """
+    try:
+        fd = os.open(
+            settings.POLICY_RC_D, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o755)
+    except OSError as err:
+        if err.errno != errno.EEXIST:
+            raise
+        hookutils.log('Using the existing {}.'.format(settings.POLICY_RC_D))
+        yield
+        return
+    with os.fdopen(fd, 'w') as policy_file:
+        policy_file.write(settings.POLICY_RC_D_CONTENT)
+    try:
+        yield
+    finally:
+        os.remove(settings.POLICY_RC_D)
+
+
+def _get_units():
+    """Return a dict mapping unit names to their replication relation data.
+
+    The local unit is included.
+    """
+    config = hookenv.config()
+    instances = instanceutils.get_instances(
+        config['port'], config['instances'])
+    units = {
+        hookenv.local_unit(): {
+            'endpoints': instanceutils.format_endpoints(
+                hookenv.unit_private_ip(), instances),
+            'upgraded': get_completed(),
+        },
+    }
+    for relation_id in hookenv.relation_ids(_PEER_RELATION_NAME):
+        for unit in hookenv.related_units(relation_id):
+            data = hookenv.relation_get(unit=unit, rid=relation_id) or {}
+            if 'endpoints' in data:
+                units[unit] = data
+    return units
+
+
+def _get_master_unit(units):
+    """Return the name of the master unit elected inside the application.
+
+    Receive the dict returned by _get_units. Return None if peer replication
+    is not enabled.
+    """
+    if not electionutils.is_enabled(hookenv.config()):
+        return None
+    master = hookenv.leader_get(settings.MASTER_LEADER_KEY)
+    for name, data in units.items():
+        if data['endpoints'] == master:
+            return name
+    return None
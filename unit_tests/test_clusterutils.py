@@ -0,0 +1,217 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the GPLv3, see copyright file for details.
+
+import os
+from pkg_resources import resource_filename
+import subprocess
+import sys
+import unittest
+
+import mock
+
+# Allow importing modules and packages from the hooks directory.
+sys.path.append(resource_filename(__name__, '../hooks'))
+
+import clusterutils
+import redisclient
+
+
+CLUSTER_NODES = '\n'.join([
+    'id1 1.2.3.4:6379@16379 myself,master - 0 0 1 connected 0-5460',
+    'id2 1.2.3.5:6379@16379 master - 0 0 2 connected 5461-10922',
+    'id3 1.2.3.6:6379@16379 master - 0 0 3 connected 10923-16383',
+    'id4 1.2.3.7:6379@16379 slave id2 0 0 2 connected',
+])
+
+
+def make_cluster_relation(*endpoints):
+    """Create and return a cluster relation with the given unit endpoints."""
+    relation = {'cluster': [{'endpoints': value} for value in endpoints]}
+    return type('Relation', (dict,), {'name': 'cluster'})(relation)
+
+
+class TestParseNodes(unittest.TestCase):
+
+    def test_nodes(self):
+        nodes = clusterutils._parse_nodes(CLUSTER_NODES)
+        self.assertEqual(4, len(nodes))
+        self.assertEqual(
+            ('id1', ('1.2.3.4', 6379), ['myself', 'master'], None,
+             ['0-5460']),
+            nodes[0])
+        self.assertEqual(
+            ('id4', ('1.2.3.7', 6379), ['slave'], 'id2', []), nodes[3])
+
+    def test_hostname(self):
+        nodes = clusterutils._parse_nodes(
+            'id1 1.2.3.4:6379@16379,redis-0 master - 0 0 1 connected')
+        self.assertEqual(('1.2.3.4', 6379), nodes[0].endpoint)
+
+
+@mock.patch('charmhelpers.core.hookenv.unit_private_ip',
+            mock.Mock(return_value='1.2.3.4'))
+class TestGetEndpoints(unittest.TestCase):
+
+    def test_endpoints(self):
+        config = {'instances': 2, 'port': 6379}
+        relation = make_cluster_relation(
+            '1.2.3.6:6379 1.2.3.6:6380', '1.2.3.5:6379 1.2.3.5:6380')
+        endpoints = clusterutils.get_endpoints(config, relation)
+        expected_endpoints = [
+            ('1.2.3.4', 6379), ('1.2.3.4', 6380),
+            ('1.2.3.5', 6379), ('1.2.3.5', 6380),
+            ('1.2.3.6', 6379), ('1.2.3.6', 6380),
+        ]
+        self.assertEqual(expected_endpoints, endpoints)
+
+
+@mock.patch('hookutils.log', mock.Mock())
+@mock.patch('clusterutils._redis_cli')
+@mock.patch('clusterutils.get_nodes')
+class TestUpdateCluster(unittest.TestCase):
+
+    endpoints = [
+        ('1.2.3.4', 6379), ('1.2.3.5', 6379), ('1.2.3.6', 6379),
+        ('1.2.3.7', 6379),
+    ]
+
+    def test_create(self, mock_get_nodes, mock_redis_cli):
+        mock_get_nodes.return_value = []
+        clusterutils._update_cluster(self.endpoints[:3], 0, 'secret!')
+        mock_redis_cli.assert_called_once_with([
+            '--cluster', 'create', '1.2.3.4:6379', '1.2.3.5:6379',
+            '1.2.3.6:6379', '--cluster-replicas', 0, '--cluster-yes',
+        ], 'secret!')
+
+    def test_waiting_for_nodes(self, mock_get_nodes, mock_redis_cli):
+        mock_get_nodes.return_value = []
+        clusterutils._update_cluster(self.endpoints, 1, None)
+        self.assertFalse(mock_redis_cli.called)
+
+    def test_add_replica(self, mock_get_nodes, mock_redis_cli):
+        nodes = clusterutils._parse_nodes(CLUSTER_NODES)
+        mock_get_nodes.return_value = nodes[:3]
+        clusterutils._update_cluster(self.endpoints, 1, None)
+        mock_redis_cli.assert_called_once_with([
+            '--cluster', 'add-node', '1.2.3.7:6379', '1.2.3.4:6379',
+            '--cluster-slave', '--cluster-master-id', 'id1',
+        ], None)
+
+    def test_add_master(self, mock_get_nodes, mock_redis_cli):
+        mock_get_nodes.return_value = clusterutils._parse_nodes(CLUSTER_NODES)
+        endpoints = self.endpoints + [('1.2.3.8', 6379)]
+        clusterutils._update_cluster(endpoints, 0, None)
+        mock_redis_cli.assert_called_once_with([
+            '--cluster', 'add-node', '1.2.3.8:6379', '1.2.3.4:6379',
+        ], None)
+
+    def test_unreachable_node(self, mock_get_nodes, mock_redis_cli):
+        nodes = clusterutils._parse_nodes(CLUSTER_NODES)
+        mock_get_nodes.side_effect = [
+            redisclient.RedisError('bad wolf'), nodes, nodes]
+        clusterutils._update_cluster(self.endpoints, 0, None)
+        self.assertFalse(mock_redis_cli.called)
+        mock_get_nodes.assert_has_calls([
+            mock.call(('1.2.3.4', 6379), None),
+            mock.call(('1.2.3.5', 6379), None),
+        ])
+
+    def test_forget_departed(self, mock_get_nodes, mock_redis_cli):
+        output = CLUSTER_NODES + (
+            '\nid5 1.2.3.9:6379@16379 master,fail - 0 0 5 disconnected')
+        mock_get_nodes.return_value = clusterutils._parse_nodes(output)
+        with mock.patch('redisclient.Client') as mock_client:
+            clusterutils._update_cluster(self.endpoints, 0, None)
+        client = mock_client.return_value.__enter__.return_value
+        self.assertEqual(4, client.execute.call_count)
+        client.execute.assert_called_with('CLUSTER', 'FORGET', 'id5')
+
+
+@mock.patch('clusterutils._update_cluster')
+class TestManage(unittest.TestCase):
+
+    config = {
+        'cluster-enabled': True,
+        'cluster-replicas': 1,
+        'instances': 1,
+        'password': '',
+        'port': 6379,
+    }
+
+    def call(self, config, leader=True):
+        """Call the callback returned by manage using the given config."""
+        relation = make_cluster_relation('1.2.3.5:6379')
+        with mock.patch('charmhelpers.core.hookenv.is_leader',
+                        mock.Mock(return_value=leader)):
+            with mock.patch('charmhelpers.core.hookenv.unit_private_ip',
+                            mock.Mock(return_value='1.2.3.4')):
+                clusterutils.manage(config, relation)('foo')
+
+    def test_leader(self, mock_update_cluster):
+        self.call(self.config)
+        mock_update_cluster.assert_called_once_with(
+            [('1.2.3.4', 6379), ('1.2.3.5', 6379)], 1, None)
+
+    def test_not_leader(self, mock_update_cluster):
+        self.call(self.config, leader=False)
+        self.assertFalse(mock_update_cluster.called)
+
+    def test_cluster_disabled(self, mock_update_cluster):
+        self.call(dict(self.config, **{'cluster-enabled': False}))
+        self.assertFalse(mock_update_cluster.called)
+
+    def test_error(self, mock_update_cluster):
+        mock_update_cluster.side_effect = subprocess.CalledProcessError(
+            1, 'redis-cli')
+        with mock.patch('hookutils.log') as mock_log:
+            self.call(self.config)
+        self.assertEqual(1, mock_log.call_count)
+
+
+@mock.patch('clusterutils._redis_cli')
+class TestRebalance(unittest.TestCase):
+
+    def test_rebalance(self, mock_redis_cli):
+        clusterutils.rebalance(('1.2.3.4', 6379), password='secret!')
+        mock_redis_cli.assert_called_once_with([
+            '--cluster', 'rebalance', '1.2.3.4:6379',
+            '--cluster-threshold', 2, '--cluster-use-empty-masters',
+        ], 'secret!')
+
+    def test_drain(self, mock_redis_cli):
+        nodes = clusterutils._parse_nodes(CLUSTER_NODES)
+        with mock.patch('clusterutils.get_nodes',
+                        mock.Mock(return_value=nodes)):
+            clusterutils.rebalance(
+                ('1.2.3.4', 6379), use_empty_masters=False, threshold=1,
+                drained_endpoints=[('1.2.3.4', 6379)])
+        mock_redis_cli.assert_called_once_with([
+            '--cluster', 'rebalance', '1.2.3.4:6379',
+            '--cluster-threshold', 1, '--cluster-weight', 'id1=0',
+        ], None)
+
+
+class TestRedisCli(unittest.TestCase):
+
+    def test_command(self):
+        with mock.patch('subprocess.check_output',
+                        mock.Mock(return_value=b'OK')) as mock_check_output:
+            with mock.patch.dict(os.environ, {'PATH': '/bin'}, clear=True):
+                output = clusterutils._redis_cli(
+                    ['--cluster', 'check', '1.2.3.4:6379'], 'secret!')
+        self.assertEqual('OK', output)
+        # The password is not exposed on the command line.
+        mock_check_output.assert_called_once_with(
+            ['redis-cli', '--cluster', 'check', '1.2.3.4:6379'],
+            stderr=subprocess.STDOUT,
+            env={'PATH': '/bin', 'REDISCLI_AUTH': 'secret!'})
+
+    def test_no_password(self):
+        environ = {'PATH': '/bin', 'REDISCLI_AUTH': 'other'}
+        with mock.patch('subprocess.check_output',
+                        mock.Mock(return_value=b'OK')) as mock_check_output:
+            with mock.patch.dict(os.environ, environ, clear=True):
+                clusterutils._redis_cli(['--cluster', 'check', 'x'], None)
+        mock_check_output.assert_called_once_with(
+            ['redis-cli', '--cluster', 'check', 'x'],
+            stderr=subprocess.STDOUT, env={'PATH': '/bin'})
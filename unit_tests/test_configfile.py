@@ -30,6 +30,20 @@ class TestIncludeConfig(unittest.TestCase):
         expected_content = 'content\ninclude /my/customized/config\n'
         self.assertEqual(expected_content, open(conf.name, 'r').read())
 
+    def test_idempotent(self):
+        conf = tempfile.NamedTemporaryFile(mode='w', delete=False)
+        self.addCleanup(os.remove, conf.name)
+        self.addCleanup(os.remove, conf.name + '.bak')
+        conf.write('content\n')
+        conf.close()
+        with mock.patch('settings.DEFAULT_REDIS_CONF', conf.name):
+            configfile.include_config('/my/customized/config')
+            configfile.include_config('/my/customized/config')
+        expected_content = 'content\ninclude /my/customized/config\n'
+        self.assertEqual(expected_content, open(conf.name, 'r').read())
+        # The backup holds the original content.
+        self.assertEqual('content\n', open(conf.name + '.bak', 'r').read())
+
     def test_not_found(self):
         with mock.patch('settings.DEFAULT_REDIS_CONF', '/no/such/file'):
             with self.assertRaises(IOError) as ctx:
@@ -38,7 +52,7 @@ class TestIncludeConfig(unittest.TestCase):
         self.assertEqual(expected_error, bytes(ctx.exception))
 
 
-class TestWrite(unittest.TestCase):
+class TargetMixin(object):
 
     def make_target(self, content=None):
         """Return a target file path in a temporary directory.
@@ -54,6 +68,40 @@ class TestWrite(unittest.TestCase):
                 target_file.write(content)
         return target
 
+
+class TestRead(TargetMixin, unittest.TestCase):
+
+    def test_success(self):
+        target = self.make_target('bind 1.2.3.4\nsave 900 1\nrequirepass \n')
+        options = configfile.read(target)
+        expected_options = {
+            'bind': '1.2.3.4',
+            'requirepass': '',
+            'save': '900 1',
+        }
+        self.assertEqual(expected_options, options)
+
+    def test_repeated_options(self):
+        target = self.make_target('port 4242\nsave ""\nsave 900 1\n')
+        options = configfile.read(target)
+        self.assertEqual({'port': '4242', 'save': ['""', '900 1']}, options)
+
+    def test_unexisting_target(self):
+        target = self.make_target()
+        self.assertEqual({}, configfile.read(target))
+
+    def test_error(self):
+        target = self.make_target('original content')
+        os.chmod(target, 0)
+        self.addCleanup(os.chmod, target, 0666)
+        with self.assertRaises(IOError) as ctx:
+            configfile.read(target)
+        expected_error = "[Errno 13] Permission denied: '{}'".format(target)
+        self.assertEqual(expected_error, bytes(ctx.exception))
+
+
+class TestWrite(TargetMixin, unittest.TestCase):
+
     def assert_file_content(self, target, content):
         """Ensure a file exists with the given content."""
         self.assertTrue(os.path.isfile(target))
@@ -73,6 +121,14 @@ class TestWrite(unittest.TestCase):
         self.assert_file_content(target, 'bind 1.2.3.4\nport 7000\n')
         self.assert_file_content(target + '.bak', 'original content')
 
+    def test_repeated_options(self):
+        target = self.make_target()
+        changed = configfile.write(
+            {'port': 4242, 'save': ['""', '900 1', '60 10000']}, target)
+        self.assertTrue(changed)
+        self.assert_file_content(
+            target, 'port 4242\nsave ""\nsave 900 1\nsave 60 10000\n')
+
     def test_no_changes(self):
         target = self.make_target('bind 1.2.3.4\n')
         changed = configfile.write({'bind': '1.2.3.4'}, target)
@@ -80,6 +136,34 @@ class TestWrite(unittest.TestCase):
         self.assert_file_content(target, 'bind 1.2.3.4\n')
         self.assertFalse(os.path.exists(target + '.bak'))
 
+    def test_permissions(self):
+        target = self.make_target()
+        configfile.write({'bind': '1.2.3.4'}, target)
+        self.assertEqual(0o644, os.stat(target).st_mode & 0o777)
+
+    def test_owner(self):
+        target = self.make_target('bind 1.2.3.4\n')
+        with mock.patch('pwd.getpwnam') as mock_getpwnam:
+            mock_getpwnam.return_value.pw_uid = os.getuid()
+            with mock.patch('grp.getgrnam') as mock_getgrnam:
+                mock_getgrnam.return_value.gr_gid = os.getgid()
+                with mock.patch('os.chown', wraps=os.chown) as mock_chown:
+                    configfile.write(
+                        {'bind': '1.2.3.5'}, target, owner='redis',
+                        group='redis', perms=0o640)
+        mock_getpwnam.assert_called_once_with('redis')
+        mock_getgrnam.assert_called_once_with('redis')
+        # The file is owned by the given user before replacing the target.
+        self.assertEqual(1, mock_chown.call_count)
+        self.assertNotEqual(target, mock_chown.call_args[0][0])
+        self.assertEqual(
+            (os.getuid(), os.getgid()), mock_chown.call_args[0][1:])
+        stat = os.stat(target)
+        self.assertEqual(os.getuid(), stat.st_uid)
+        self.assertEqual(os.getgid(), stat.st_gid)
+        self.assertEqual(0o640, stat.st_mode & 0o777)
+        self.assert_file_content(target, 'bind 1.2.3.5\n')
+
     def test_error(self):
         target = self.make_target('original content')
         os.chmod(target, 0)
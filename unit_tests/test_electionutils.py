@@ -0,0 +1,205 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the GPLv3, see copyright file for details.
+
+import contextlib
+from pkg_resources import resource_filename
+import sys
+import unittest
+
+import mock
+
+# Allow importing modules and packages from the hooks directory.
+sys.path.append(resource_filename(__name__, '../hooks'))
+
+import electionutils
+import instanceutils
+import redisclient
+
+
+def make_relation(*endpoints):
+    """Create and return a replication relation with the given units."""
+    units = [{'endpoints': value} for value in endpoints]
+    return type('Relation', (dict,), {'name': 'replication'})(
+        {'replication': units})
+
+
+class TestIsEnabled(unittest.TestCase):
+
+    def test_enabled(self):
+        config = {'cluster-enabled': False, 'peer-replication': True}
+        self.assertTrue(electionutils.is_enabled(config))
+
+    def test_disabled(self):
+        config = {'cluster-enabled': False, 'peer-replication': False}
+        self.assertFalse(electionutils.is_enabled(config))
+
+    def test_cluster(self):
+        config = {'cluster-enabled': True, 'peer-replication': True}
+        self.assertFalse(electionutils.is_enabled(config))
+
+
+@mock.patch('charmhelpers.core.hookenv.unit_private_ip',
+            mock.Mock(return_value='1.2.3.4'))
+@mock.patch('hookutils.log', mock.Mock())
+class TestElect(unittest.TestCase):
+
+    config = {
+        'cluster-enabled': False,
+        'instances': 1,
+        'password': '',
+        'peer-replication': True,
+        'port': 4242,
+    }
+
+    def elect(self, master, offsets, hook='config-changed', leader=True,
+              config=None):
+        """Run the election callback.
+
+        The offsets argument maps the hostname of each unit to its replication
+        offset, or to None if the unit is not reachable.
+        Return the mock leader_set function.
+        """
+        relation = make_relation(*[
+            '{}:4242'.format(hostname) for hostname in sorted(offsets)
+            if hostname != '1.2.3.4'])
+
+        def make_client(hostname, port, password=None):
+            offset = offsets[hostname]
+            if offset is None:
+                raise redisclient.RedisError('bad wolf')
+            client = mock.MagicMock()
+            client.__enter__.return_value.execute.return_value = (
+                '# Replication\r\nmaster_repl_offset:{}\r\n'.format(offset))
+            return client
+
+        callback = electionutils.elect(config or self.config, relation)
+        with contextlib.nested(
+            mock.patch('charmhelpers.core.hookenv.is_leader',
+                       mock.Mock(return_value=leader)),
+            mock.patch('charmhelpers.core.hookenv.leader_get',
+                       mock.Mock(return_value=master)),
+            mock.patch('charmhelpers.core.hookenv.leader_set'),
+            mock.patch('charmhelpers.core.hookenv.hook_name',
+                       mock.Mock(return_value=hook)),
+            mock.patch('redisclient.Client', make_client),
+        ) as (_, _, mock_leader_set, _, _):
+            callback('foo')
+        return mock_leader_set
+
+    def test_first_leader(self):
+        mock_leader_set = self.elect(None, {'1.2.3.4': 0, '1.2.3.5': 0})
+        mock_leader_set.assert_called_once_with(
+            {'master-endpoints': '1.2.3.4:4242'})
+
+    def test_first_leader_not_reachable(self):
+        mock_leader_set = self.elect(None, {'1.2.3.4': None})
+        mock_leader_set.assert_called_once_with(
+            {'master-endpoints': '1.2.3.4:4242'})
+
+    def test_master_elected(self):
+        mock_leader_set = self.elect(
+            '1.2.3.5:4242', {'1.2.3.4': 10, '1.2.3.5': 0})
+        self.assertFalse(mock_leader_set.called)
+
+    def test_leadership_changed_master_alive(self):
+        mock_leader_set = self.elect(
+            '1.2.3.5:4242', {'1.2.3.4': 42, '1.2.3.5': 42, '1.2.3.6': 40},
+            hook='leader-elected')
+        self.assertFalse(mock_leader_set.called)
+
+    def test_leadership_changed_master_failed(self):
+        mock_leader_set = self.elect(
+            '1.2.3.5:4242', {'1.2.3.4': 40, '1.2.3.5': None, '1.2.3.6': 42},
+            hook='leader-elected')
+        mock_leader_set.assert_called_once_with(
+            {'master-endpoints': '1.2.3.6:4242'})
+
+    def test_master_departed(self):
+        mock_leader_set = self.elect(
+            '1.2.3.7:4242', {'1.2.3.4': 42, '1.2.3.5': 40},
+            hook='replication-relation-departed')
+        mock_leader_set.assert_called_once_with(
+            {'master-endpoints': '1.2.3.4:4242'})
+
+    def test_not_leader(self):
+        mock_leader_set = self.elect(None, {'1.2.3.4': 0}, leader=False)
+        self.assertFalse(mock_leader_set.called)
+
+    def test_disabled(self):
+        config = dict(self.config, **{'peer-replication': False})
+        mock_leader_set = self.elect(None, {'1.2.3.4': 0}, config=config)
+        self.assertFalse(mock_leader_set.called)
+
+
+@mock.patch('hookutils.log', mock.Mock())
+class TestFailover(unittest.TestCase):
+
+    candidates = ['1.2.3.4:4242', '1.2.3.5:4242', '1.2.3.6:4242']
+
+    def failover(self, offsets):
+        """Fail over from the 1.2.3.4 master.
+
+        The offsets argument maps hostnames to replication offsets.
+        Return the result and the mock leader_set function.
+        """
+        def make_client(hostname, port, password=None):
+            client = mock.MagicMock()
+            client.__enter__.return_value.execute.return_value = (
+                '# Replication\r\nmaster_repl_offset:{}\r\n'.format(
+                    offsets[hostname]))
+            return client
+
+        with contextlib.nested(
+            mock.patch('charmhelpers.core.hookenv.leader_get',
+                       mock.Mock(return_value='1.2.3.4:4242')),
+            mock.patch('charmhelpers.core.hookenv.leader_set'),
+            mock.patch('redisclient.Client', make_client),
+        ) as (_, mock_leader_set, _):
+            result = electionutils.failover(
+                {'password': ''}, self.candidates)
+        return result, mock_leader_set
+
+    def test_failover(self):
+        result, mock_leader_set = self.failover(
+            {'1.2.3.4': 50, '1.2.3.5': 40, '1.2.3.6': 42})
+        self.assertTrue(result)
+        mock_leader_set.assert_called_once_with(
+            {'master-endpoints': '1.2.3.6:4242'})
+
+    def test_no_replicas(self):
+        self.candidates = ['1.2.3.4:4242']
+        result, mock_leader_set = self.failover({'1.2.3.4': 50})
+        self.assertFalse(result)
+        self.assertFalse(mock_leader_set.called)
+
+
+@mock.patch('charmhelpers.core.hookenv.unit_private_ip',
+            mock.Mock(return_value='1.2.3.4'))
+class TestGetMasterEndpoint(unittest.TestCase):
+
+    def get_endpoint(self, value, index=0):
+        """Return the master endpoint for the instance with the given index.
+
+        The value is the one stored in the leader settings.
+        """
+        instance = instanceutils.get_instances(4242, index + 1)[index]
+        with mock.patch('charmhelpers.core.hookenv.leader_get',
+                        mock.Mock(return_value=value)):
+            return electionutils.get_master_endpoint(instance)
+
+    def test_slave(self):
+        self.assertEqual(
+            ('1.2.3.5', 4242), self.get_endpoint('1.2.3.5:4242'))
+
+    def test_additional_instance(self):
+        endpoint = self.get_endpoint('1.2.3.5:4242 1.2.3.5:4243', index=1)
+        self.assertEqual(('1.2.3.5', 4243), endpoint)
+
+    def test_missing_instance(self):
+        self.assertIsNone(self.get_endpoint('1.2.3.5:4242', index=1))
+
+    def test_master(self):
+        self.assertIsNone(self.get_endpoint('1.2.3.4:4242'))
+
+    def test_not_elected(self):
+        self.assertIsNone(self.get_endpoint(None))
@@ -0,0 +1,160 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the GPLv3, see copyright file for details.
+
+import io
+from pkg_resources import resource_filename
+import sys
+import unittest
+
+# Allow importing modules and packages from the hooks directory.
+sys.path.append(resource_filename(__name__, '../hooks'))
+
+from charmhelpers.core import (
+    gob,
+    hooktool,
+)
+
+
+# Define gob streams produced by the Go encoder (go1.21). The request stream
+# holds two hook tool requests, as sent by a net/rpc client.
+GO_REQUESTS = bytes.fromhex(
+    '2e7f030101075265717565737401ff80000102010d536572766963654d6574686f64'
+    '010c000103536571010600000011ff80010a4a756a75632e4d61696e0101005cff81'
+    '030101075265717565737401ff820001060109436f6e746578744964010c00010344'
+    '6972010c00010b436f6d6d616e644e616d65010c0001044172677301ff8400010853'
+    '7464696e5365740102000105537464696e010a00000016ff83020101085b5d737472'
+    '696e6701ff8400010c000026ff82010363747801042f746d70010c72656c6174696f'
+    '6e2d6765740102022d720464623a310013ff80010a4a756a75632e4d61696e01fe01'
+    '2c001fff82010363747801042f746d70010969732d6c656164657202010102696e00')
+
+# The response stream holds, as sent by a net/rpc server: a successful
+# response, an error with its empty body, and a failed hook tool.
+GO_RESPONSES = bytes.fromhex(
+    '3aff8503010108526573706f6e736501ff86000103010d536572766963654d657468'
+    '6f64010c00010353657101060001054572726f72010c00000011ff86010a4a756a75'
+    '632e4d61696e01010039ff870301010c45786563526573706f6e736501ff88000103'
+    '0104436f646501040001065374646f7574010a000106537464657272010a00000016'
+    'ff8802117b22706f7274223a202234323432227d0a002bff86010a4a756a75632e4d'
+    '61696e0102011862616420726571756573743a2062616420636f6e74657874000aff'
+    '89030102ff8a00000003ff8a0011ff86010a4a756a75632e4d61696e0103000fff88'
+    '0101020862616420776f6c6600')
+
+# The values stream holds a struct with fields of various kinds, followed by
+# an integer and a string, which are not structs.
+GO_VALUES = bytes.fromhex(
+    '41ff8b030101044d69736301ff8c00010601034e6567010400010342696701060001'
+    '014601080001014d01ff8e0001014101ff90000105496e6e657201ff920000001eff'
+    '8d0401010e6d61705b737472696e675d696e7401ff8e00010c0104000017ff8f0101'
+    '01075b325d626f6f6c01ff900001020104000022ff91020101135b5d6d61696e2e45'
+    '786563526573706f6e736501ff920001ff88000039ff870301010c45786563526573'
+    '706f6e736501ff880001030104436f646501040001065374646f7574010a00010653'
+    '7464657272010a00000021ff8c01fe010101fa01000000000001fef83f0101016102'
+    '0102000101010106000003040054050c00026869')
+
+
+def decoder(data):
+    """Return a decoder reading the given stream."""
+    return gob.Decoder(io.BytesIO(data).read)
+
+
+class TestEncoder(unittest.TestCase):
+
+    def test_requests(self):
+        encoder = gob.Encoder()
+        data = b''.join([
+            encoder.encode(hooktool.RPC_REQUEST, {
+                'ServiceMethod': 'Jujuc.Main', 'Seq': 1}),
+            encoder.encode(hooktool.REQUEST, {
+                'ContextId': 'ctx', 'Dir': '/tmp',
+                'CommandName': 'relation-get', 'Args': ['-r', 'db:1']}),
+            # Types are only defined the first time they are used.
+            encoder.encode(hooktool.RPC_REQUEST, {
+                'ServiceMethod': 'Jujuc.Main', 'Seq': 300}),
+            encoder.encode(hooktool.REQUEST, {
+                'ContextId': 'ctx', 'Dir': '/tmp', 'CommandName': 'is-leader',
+                'StdinSet': True, 'Stdin': b'in'}),
+        ])
+        self.assertEqual(GO_REQUESTS, data)
+
+    def test_round_trip(self):
+        gob_type = gob.Struct('Misc', [
+            ('Neg', gob.INT),
+            ('Big', gob.UINT),
+            ('F', gob.FLOAT),
+            ('M', gob.Map(gob.STRING, gob.INT)),
+            ('A', gob.Array(gob.BOOL, 2)),
+            ('Inner', gob.Slice(hooktool.EXEC_RESPONSE)),
+        ])
+        value = {
+            'Neg': -129, 'Big': 1 << 40, 'F': 1.5, 'M': {'a': 1},
+            'A': [False, True], 'Inner': [{'Code': 3}]}
+        encoder = gob.Encoder()
+        data = encoder.encode(gob_type, value) + encoder.encode(gob.INT, -7)
+        stream = decoder(data)
+        self.assertEqual(value, stream.decode())
+        self.assertEqual(-7, stream.decode())
+
+    def test_zero_fields(self):
+        data = gob.Encoder().encode(hooktool.EXEC_RESPONSE, {
+            'Code': 0, 'Stdout': b'', 'Stderr': b'bad wolf'})
+        self.assertEqual({'Stderr': b'bad wolf'}, decoder(data).decode())
+
+
+class TestDecoder(unittest.TestCase):
+
+    def test_requests(self):
+        stream = decoder(GO_REQUESTS)
+        self.assertEqual(
+            {'ServiceMethod': 'Jujuc.Main', 'Seq': 1}, stream.decode())
+        self.assertEqual({
+            'ContextId': 'ctx', 'Dir': '/tmp', 'CommandName': 'relation-get',
+            'Args': ['-r', 'db:1'],
+        }, stream.decode())
+        self.assertEqual(
+            {'ServiceMethod': 'Jujuc.Main', 'Seq': 300}, stream.decode())
+        self.assertEqual({
+            'ContextId': 'ctx', 'Dir': '/tmp', 'CommandName': 'is-leader',
+            'StdinSet': True, 'Stdin': b'in',
+        }, stream.decode())
+
+    def test_responses(self):
+        stream = decoder(GO_RESPONSES)
+        self.assertEqual(
+            {'ServiceMethod': 'Jujuc.Main', 'Seq': 1}, stream.decode())
+        self.assertEqual(
+            {'Stdout': b'{"port": "4242"}\n'}, stream.decode())
+        self.assertEqual({
+            'ServiceMethod': 'Jujuc.Main', 'Seq': 2,
+            'Error': 'bad request: bad context',
+        }, stream.decode())
+        self.assertEqual({}, stream.decode())
+        self.assertEqual(
+            {'ServiceMethod': 'Jujuc.Main', 'Seq': 3}, stream.decode())
+        self.assertEqual(
+            {'Code': -1, 'Stderr': b'bad wolf'}, stream.decode())
+
+    def test_values(self):
+        stream = decoder(GO_VALUES)
+        self.assertEqual({
+            'Neg': -129, 'Big': 1 << 40, 'F': 1.5, 'M': {'a': 1},
+            'A': [False, True], 'Inner': [{'Code': 3}],
+        }, stream.decode())
+        self.assertEqual(42, stream.decode())
+        self.assertEqual('hi', stream.decode())
+
+    def test_end_of_stream(self):
+        stream = decoder(GO_REQUESTS[:-1])
+        for _ in range(3):
+            stream.decode()
+        with self.assertRaises(EOFError):
+            stream.decode()
+
+    def test_unknown_type(self):
+        with self.assertRaises(gob.GobError):
+            decoder(b'\x03\xff\x90\x00').decode()
+
+    def test_reserved_type(self):
+        # Type definitions cannot replace the predefined types.
+        data = gob.Encoder().encode(hooktool.RPC_REQUEST, {})
+        with self.assertRaises(gob.GobError):
+            decoder(data.replace(b'\x7f', b'\x21', 1)).decode()
@@ -0,0 +1,290 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the GPLv3, see copyright file for details.
+
+import json
+import os
+from pkg_resources import resource_filename
+import sys
+import threading
+import time
+import unittest
+
+import mock
+
+# Allow importing modules and packages from the hooks directory.
+sys.path.append(resource_filename(__name__, '../hooks'))
+
+from charmhelpers.core import (
+    hookenv,
+    hooktool,
+)
+from charmhelpers.core.services import helpers
+
+
+# Define the units related through the db relation, by relation id.
+UNITS = {
+    'db:1': ['wordpress/1', 'wordpress/0'],
+    'db:2': ['mediawiki/0'],
+}
+
+
+def handler(command, args):
+    """Answer hook tool requests for the db relation."""
+    if command == 'relation-ids':
+        relids = sorted(UNITS) if args[-1] == 'db' else []
+        return 0, json.dumps(relids), ''
+    if command == 'relation-list':
+        return 0, json.dumps(UNITS[args[-1]]), ''
+    if command == 'relation-get':
+        unit = args[-1]
+        if unit == 'wordpress/1':
+            # This unit did not set its data yet.
+            return 0, json.dumps({}), ''
+        return 0, json.dumps({'name': unit, 'port': '4242'}), ''
+    return 1, '', 'unexpected command'
+
+
+class TestRelationGetUnits(unittest.TestCase):
+
+    def setUp(self):
+        hooktool.reset()
+        self.addCleanup(hooktool.reset)
+        hookenv.cache.clear()
+        self.addCleanup(hookenv.cache.clear)
+        patcher = mock.patch.dict(hookenv._cache_stats, hits=0, misses=0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+        self.agent = hooktool.StandInAgent(self.handler)
+        self.agent.start()
+        self.addCleanup(self.agent.stop)
+        patcher = mock.patch.dict(
+            os.environ, self.agent.environment(), clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def handler(self, command, args):
+        """Answer requests, slowly, recording how many run concurrently."""
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        try:
+            time.sleep(0.05)
+            return handler(command, args)
+        finally:
+            with self.lock:
+                self.running -= 1
+
+    def test_units(self):
+        units = hookenv.relation_get_units('db')
+        self.assertEqual([
+            ('db:1', 'wordpress/0', {'name': 'wordpress/0', 'port': '4242'}),
+            ('db:1', 'wordpress/1', {}),
+            ('db:2', 'mediawiki/0', {'name': 'mediawiki/0', 'port': '4242'}),
+        ], units)
+
+    def test_cached(self):
+        hookenv.relation_get_units('db')
+        requests = len(self.agent.requests)
+        data = hookenv.relation_get(rid='db:2', unit='mediawiki/0')
+        self.assertEqual({'name': 'mediawiki/0', 'port': '4242'}, data)
+        self.assertEqual(['mediawiki/0'], hookenv.related_units('db:2'))
+        self.assertEqual(requests, len(self.agent.requests))
+
+    def test_concurrent(self):
+        hookenv.relation_get_units('db')
+        # The data of the three related units is fetched at the same time.
+        self.assertEqual(3, self.max_running)
+        # The cache statistics are not corrupted by concurrent calls: there
+        # is one miss for relation-ids, two for relation-list and three for
+        # relation-get.
+        self.assertEqual((0, 6, 6), tuple(hookenv.cache_info()))
+
+    def test_max_workers(self):
+        units = hookenv.relation_get_units('db', max_workers=1)
+        self.assertEqual(3, len(units))
+        self.assertEqual(1, self.max_running)
+
+    def test_no_relations(self):
+        self.assertEqual([], hookenv.relation_get_units('cluster'))
+
+    def test_relation_context(self):
+        context = helpers.RelationContext(
+            name='db', additional_required_keys=['port'])
+        self.assertEqual(
+            ['wordpress/0', 'mediawiki/0'],
+            [data['name'] for data in context['db']])
+
+
+@mock.patch('charmhelpers.core.hookenv.relation_set')
+class TestRelationSetChanged(unittest.TestCase):
+
+    def setUp(self):
+        self.kv = {}
+        mock_kv = mock.Mock()
+        mock_kv.get.side_effect = self.kv.get
+        mock_kv.set.side_effect = self.kv.__setitem__
+        patcher = mock.patch(
+            'charmhelpers.core.unitdata.kv', mock.Mock(return_value=mock_kv))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(hookenv._relation_hashes.clear)
+        self.addCleanup(hookenv._atexit.__delitem__, slice(None))
+
+    def test_first_time(self, mock_relation_set):
+        published = hookenv.relation_set_changed('db:1', {'port': 4242})
+        self.assertTrue(published)
+        mock_relation_set.assert_called_once_with(
+            'db:1', {'port': '4242'}, app=False)
+
+    def test_unchanged_in_hook(self, mock_relation_set):
+        hookenv.relation_set_changed('db:1', {'port': 4242})
+        published = hookenv.relation_set_changed('db:1', {'port': '4242'})
+        self.assertFalse(published)
+        self.assertEqual(1, mock_relation_set.call_count)
+
+    def test_unchanged_since_last_hook(self, mock_relation_set):
+        hookenv.relation_set_changed('db:1', {'port': 4242})
+        hookenv._run_atexit()
+        self.assertEqual(1, len(self.kv))
+        hookenv._relation_hashes.clear()
+        published = hookenv.relation_set_changed('db:1', {'port': 4242})
+        self.assertFalse(published)
+        self.assertEqual(1, mock_relation_set.call_count)
+
+    def test_changed(self, mock_relation_set):
+        hookenv.relation_set_changed('db:1', {'port': 4242})
+        hookenv._run_atexit()
+        published = hookenv.relation_set_changed('db:1', {'port': 4243})
+        self.assertTrue(published)
+        self.assertEqual(2, mock_relation_set.call_count)
+
+    def test_other_relation(self, mock_relation_set):
+        hookenv.relation_set_changed('db:1', {'port': 4242})
+        published = hookenv.relation_set_changed('db:2', {'port': 4242})
+        self.assertTrue(published)
+        self.assertEqual(2, mock_relation_set.call_count)
+
+    def test_hook_failed(self, mock_relation_set):
+        # Hashes are not stored if the hook does not complete.
+        hookenv.relation_set_changed('db:1', {'port': 4242})
+        hookenv._relation_hashes.clear()
+        published = hookenv.relation_set_changed('db:1', {'port': 4242})
+        self.assertTrue(published)
+        self.assertEqual({}, self.kv)
+
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        hookenv.cache.clear()
+        self.addCleanup(hookenv.cache.clear)
+        patcher = mock.patch.dict(hookenv._cache_stats, hits=0, misses=0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.dict(
+            os.environ, {'JUJU_UNIT_NAME': 'redis/0'}, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.calls = []
+
+    def patch_hook_tools(self, outputs):
+        """Patch hook tools, returning the given outputs as JSON.
+
+        The outputs argument maps hook tool commands to their output.
+        """
+        def check_output(args):
+            self.calls.append(args)
+            return json.dumps(outputs[tuple(args)]).encode('utf-8')
+
+        patchers = [
+            mock.patch('charmhelpers.core.hooktool.check_output',
+                       check_output),
+            mock.patch('charmhelpers.core.hooktool.check_call'),
+            mock.patch('charmhelpers.core.hookenv._relation_set_accepts_file',
+                       mock.Mock(return_value=False)),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_keyword_order(self):
+        self.patch_hook_tools({
+            ('relation-get', '--format=json', '-r', 'db:1', '-', 'app/0'):
+            {'port': '4242'},
+        })
+        hookenv.relation_get(rid='db:1', unit='app/0')
+        hookenv.relation_get(unit='app/0', rid='db:1')
+        self.assertEqual(1, len(self.calls))
+        self.assertEqual((1, 1, 1), tuple(hookenv.cache_info()))
+
+    def test_unhashable_arguments(self):
+        calls = []
+
+        @hookenv.cached
+        def function(values):
+            calls.append(values)
+            return len(values)
+
+        self.assertEqual(2, function(['a', 'b']))
+        self.assertEqual(2, function(['a', 'b']))
+        self.assertEqual(1, len(calls))
+
+    def test_relation_set_write_through(self):
+        self.patch_hook_tools({
+            ('relation-get', '--format=json', '-r', 'db:1', '-', 'redis/0'):
+            {'hostname': '1.2.3.4', 'port': '4242'},
+            ('relation-get', '--format=json', '-r', 'db:1', 'port',
+             'redis/0'): '4242',
+        })
+        hookenv.relation_get(rid='db:1', unit='redis/0')
+        hookenv.relation_get('port', rid='db:1', unit='redis/0')
+        hookenv.relation_set('db:1', {'port': 4243, 'hostname': None})
+        self.assertEqual(
+            {'port': '4243'}, hookenv.relation_get(rid='db:1', unit='redis/0'))
+        # Cached single values are flushed.
+        key = hookenv._cache_key(
+            hookenv.relation_get._wrapped, ('port',),
+            {'rid': 'db:1', 'unit': 'redis/0'})
+        self.assertNotIn(key, hookenv.cache)
+        self.assertEqual(2, len(self.calls))
+
+    def test_write_through_strings(self):
+        self.patch_hook_tools({
+            ('relation-get', '--format=json', '-r', 'db:1', '-', 'redis/0'):
+            {'hostname': '1.2.3.4'},
+        })
+        hookenv.relation_get(rid='db:1', unit='redis/0')
+        hookenv._relation_write_through(
+            'db:1', 'redis/0', {'port': 4243, 'ready': True}, False)
+        self.assertEqual(
+            {'hostname': '1.2.3.4', 'port': '4243', 'ready': 'True'},
+            hookenv.relation_get(rid='db:1', unit='redis/0'))
+        self.assertEqual(1, len(self.calls))
+
+    def test_relation_set_other_units(self):
+        self.patch_hook_tools({
+            ('relation-get', '--format=json', '-r', 'db:1', '-', 'app/0'):
+            {'port': '4242'},
+            ('relation-get', '--format=json', '-r', 'db:2', '-', 'redis/0'):
+            {'port': '4242'},
+        })
+        hookenv.relation_get(rid='db:1', unit='app/0')
+        hookenv.relation_get(rid='db:2', unit='redis/0')
+        hookenv.relation_set('db:1', {'port': 4243})
+        hookenv.relation_get(rid='db:1', unit='app/0')
+        hookenv.relation_get(rid='db:2', unit='redis/0')
+        self.assertEqual(2, len(self.calls))
+
+    def test_leader_set_write_through(self):
+        self.patch_hook_tools({
+            ('leader-get', '--format=json', '-'): {'master': '1.2.3.4'},
+        })
+        self.assertEqual({'master': '1.2.3.4'}, hookenv.leader_get())
+        hookenv.leader_set({'master': '1.2.3.5', 'token': 42})
+        self.assertEqual(
+            {'master': '1.2.3.5', 'token': '42'}, hookenv.leader_get())
+        self.assertEqual('1.2.3.5', hookenv.leader_get('master'))
+        self.assertEqual(1, len(self.calls))
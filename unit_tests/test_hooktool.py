@@ -0,0 +1,136 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the GPLv3, see copyright file for details.
+
+import json
+import os
+from pkg_resources import resource_filename
+import subprocess
+import sys
+import threading
+import unittest
+
+import mock
+
+# Allow importing modules and packages from the hooks directory.
+sys.path.append(resource_filename(__name__, '../hooks'))
+
+from charmhelpers.core import (
+    hookenv,
+    hooktool,
+)
+
+
+def handler(command, args):
+    """Answer hook tool requests as the unit agent would."""
+    if command == 'relation-get':
+        return 0, json.dumps({'port': '4242'}), ''
+    if command == 'relation-set':
+        return 0, '', ''
+    return 1, '', 'bad wolf'
+
+
+class HookToolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        hooktool.reset()
+        self.addCleanup(hooktool.reset)
+        hookenv.cache.clear()
+        self.addCleanup(hookenv.cache.clear)
+
+    def patch_environ(self, environ):
+        """Patch the environment so that it only includes the given values."""
+        patcher = mock.patch.dict(os.environ, environ, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class TestAgentTransport(HookToolTestCase):
+
+    def test_relation_get(self):
+        with hooktool.StandInAgent(handler) as agent:
+            self.patch_environ(agent.environment())
+            with mock.patch('subprocess.check_output') as mock_check_output:
+                data = hookenv.relation_get(unit='redis/1', rid='db:1')
+        self.assertEqual({'port': '4242'}, data)
+        self.assertFalse(mock_check_output.called)
+        self.assertEqual(
+            [('relation-get',
+              ['--format=json', '-r', 'db:1', '-', 'redis/1'])],
+            agent.requests)
+
+    def test_single_connection(self):
+        with hooktool.StandInAgent(handler) as agent:
+            self.patch_environ(agent.environment())
+            hooktool.check_call(['relation-set', 'port=4242'])
+            transport = hooktool.get_transport()
+            connection = transport._local.connection
+            hooktool.check_call(['relation-set', 'port=4243'])
+            self.assertIs(connection, transport._local.connection)
+        self.assertEqual(2, len(agent.requests))
+
+    def test_threads(self):
+        outputs = []
+
+        def run():
+            outputs.append(hooktool.check_output(['relation-get']))
+
+        with hooktool.StandInAgent(handler) as agent:
+            self.patch_environ(agent.environment())
+            threads = [threading.Thread(target=run) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            # Each thread uses its own connection.
+            self.assertEqual(4, len(hooktool.get_transport()._connections))
+        self.assertEqual([b'{"port": "4242"}'] * 4, outputs)
+
+    def test_failure(self):
+        with hooktool.StandInAgent(handler) as agent:
+            self.patch_environ(agent.environment())
+            with self.assertRaises(subprocess.CalledProcessError) as ctx:
+                hooktool.check_output(['is-leader', '--format=json'])
+            self.assertEqual(1, hooktool.call(['is-leader']))
+        self.assertEqual(1, ctx.exception.returncode)
+        self.assertEqual(b'bad wolf', ctx.exception.stderr)
+
+    def test_abstract_address(self):
+        transport = hooktool.AgentTransport('@/var/lib/juju/agent.socket')
+        with mock.patch('socket.socket') as mock_socket:
+            with mock.patch('charmhelpers.core.hooktool._Connection'):
+                transport._connect()
+        mock_socket.return_value.connect.assert_called_once_with(
+            '\0/var/lib/juju/agent.socket')
+
+
+@mock.patch('subprocess.check_output', mock.Mock(return_value=b'true'))
+class TestFallback(HookToolTestCase):
+
+    def test_no_socket(self):
+        self.patch_environ({})
+        self.assertEqual(b'true', hooktool.check_output(['is-leader']))
+        self.assertIsNone(hooktool.get_transport())
+
+    def test_tcp_socket(self):
+        self.patch_environ({
+            'JUJU_AGENT_SOCKET_ADDRESS': '127.0.0.1:4242',
+            'JUJU_AGENT_SOCKET_NETWORK': 'tcp',
+        })
+        self.assertEqual(b'true', hooktool.check_output(['is-leader']))
+        self.assertIsNone(hooktool.get_transport())
+
+    def test_unreachable(self):
+        self.patch_environ({'JUJU_AGENT_SOCKET_ADDRESS': '/no/such/socket'})
+        self.assertEqual(b'true', hooktool.check_output(['is-leader']))
+        # The transport is disabled for the rest of the process.
+        self.assertIsNone(hooktool.get_transport())
+
+    def test_rpc_error(self):
+        with hooktool.StandInAgent(handler) as agent:
+            environ = agent.environment()
+            environ['JUJU_CONTEXT_ID'] = 'another-context'
+            self.patch_environ(environ)
+            output = hooktool.check_output(['is-leader'])
+        self.assertEqual(b'true', output)
+        self.assertEqual([], agent.requests)
+        self.assertIsNone(hooktool.get_transport())
@@ -10,6 +10,8 @@ import mock
 # Allow importing modules and packages from the hooks directory.
 sys.path.append(resource_filename(__name__, '../hooks'))
 
+from charmhelpers.core import hookenv
+
 import hookutils
 
 
@@ -25,11 +27,13 @@ def _failing_hook():
     raise TypeError
 
 
+@mock.patch('charmhelpers.core.hookenv.log')
 @mock.patch('charmhelpers.core.hookenv.hook_name')
 @mock.patch('hookutils.log')
 class TestHookNameLogged(unittest.TestCase):
 
-    def test_successful_hook(self, mock_log, mock_hook_name):
+    def test_successful_hook(
+            self, mock_log, mock_hook_name, mock_hookenv_log):
         mock_hook_name.return_value = 'config-changed'
         decorated = hookutils.hook_name_logged(_successful_hook)
         result = decorated()
@@ -42,7 +46,7 @@ class TestHookNameLogged(unittest.TestCase):
             mock.call('<<< Exiting hook: config-changed.'),
         ])
 
-    def test_failing_hook(self, mock_log, mock_hook_name):
+    def test_failing_hook(self, mock_log, mock_hook_name, mock_hookenv_log):
         mock_hook_name.return_value = 'start'
         decorated = hookutils.hook_name_logged(_failing_hook)
         with self.assertRaises(TypeError):
@@ -55,3 +59,12 @@ class TestHookNameLogged(unittest.TestCase):
             mock.call('failing'),
             mock.call('<<< Exiting hook: start.')
         ])
+
+    def test_cache_info(self, mock_log, mock_hook_name, mock_hookenv_log):
+        mock_hook_name.return_value = 'start'
+        info = hookenv.CacheInfo(hits=3, misses=5, size=2)
+        with mock.patch('charmhelpers.core.hookenv.cache_info',
+                        mock.Mock(return_value=info)):
+            hookutils.hook_name_logged(_successful_hook)()
+        mock_hookenv_log.assert_called_once_with(
+            'Hook tool cache: 3 hits, 5 misses.', level='DEBUG')
@@ -0,0 +1,114 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the GPLv3, see copyright file for details.
+
+from pkg_resources import resource_filename
+import sys
+import unittest
+
+import mock
+
+# Allow importing modules and packages from the hooks directory.
+sys.path.append(resource_filename(__name__, '../hooks'))
+
+import instanceutils
+import settings
+
+
+class TestGetInstances(unittest.TestCase):
+
+    def test_single_instance(self):
+        instances = instanceutils.get_instances(4242, 1)
+        expected_instances = [
+            (0, 4242, settings.SERVICE_NAME, settings.REDIS_CONF),
+        ]
+        self.assertEqual(expected_instances, instances)
+
+    def test_multiple_instances(self):
+        instances = instanceutils.get_instances(4242, 3)
+        expected_instances = [
+            (0, 4242, settings.SERVICE_NAME, settings.REDIS_CONF),
+            (1, 4243, 'redis-server@1', '/etc/redis/redis-1.conf'),
+            (2, 4244, 'redis-server@2', '/etc/redis/redis-2.conf'),
+        ]
+        self.assertEqual(expected_instances, instances)
+
+    def test_no_port(self):
+        self.assertEqual([], instanceutils.get_instances(None, None))
+
+    def test_no_count(self):
+        instances = instanceutils.get_instances(4242, None)
+        self.assertEqual([4242], [i.port for i in instances])
+
+    def test_invalid_count(self):
+        with self.assertRaises(ValueError) as ctx:
+            instanceutils.get_instances(4242, 0)
+        self.assertEqual('invalid number of instances: 0', str(ctx.exception))
+
+
+class TestGetOptions(unittest.TestCase):
+
+    def test_main_instance(self):
+        instance = instanceutils.get_instances(4242, 1)[0]
+        options = instanceutils.get_options(instance, '/var/log/redis.log')
+        self.assertEqual({}, options)
+
+    def test_additional_instance(self):
+        instance = instanceutils.get_instances(4242, 3)[2]
+        options = instanceutils.get_options(instance, '/var/log/redis.log')
+        expected_options = {
+            'daemonize': 'yes',
+            'supervised': 'no',
+            'dir': '/var/lib/redis/instance-2',
+            'logfile': '/var/log/redis-2.log',
+            'pidfile': '/run/redis-2/redis-server.pid',
+        }
+        self.assertEqual(expected_options, options)
+
+
+class TestGetUnixsocket(unittest.TestCase):
+
+    path = '/run/redis/redis.sock'
+
+    def test_main_instance(self):
+        instance = instanceutils.get_instances(4242, 1)[0]
+        self.assertEqual(
+            self.path, instanceutils.get_unixsocket(instance, self.path))
+
+    def test_additional_instance(self):
+        instance = instanceutils.get_instances(4242, 3)[2]
+        self.assertEqual(
+            '/run/redis-2/redis-server.sock',
+            instanceutils.get_unixsocket(instance, self.path))
+
+    def test_disabled(self):
+        instance = instanceutils.get_instances(4242, 3)[2]
+        self.assertEqual('', instanceutils.get_unixsocket(instance, ''))
+
+
+@mock.patch('charmhelpers.core.host.mkdir')
+class TestSetup(unittest.TestCase):
+
+    def test_main_instance(self, mock_mkdir):
+        instanceutils.setup(instanceutils.get_instances(4242, 1)[0])
+        self.assertFalse(mock_mkdir.called)
+
+    def test_additional_instance(self, mock_mkdir):
+        instanceutils.setup(instanceutils.get_instances(4242, 2)[1])
+        mock_mkdir.assert_called_once_with(
+            '/var/lib/redis/instance-1', owner='redis', group='redis',
+            perms=0o750)
+
+
+class TestEndpoints(unittest.TestCase):
+
+    def test_format(self):
+        instances = instanceutils.get_instances(4242, 2)
+        endpoints = instanceutils.format_endpoints('1.2.3.4', instances)
+        self.assertEqual('1.2.3.4:4242 1.2.3.4:4243', endpoints)
+
+    def test_parse(self):
+        endpoints = instanceutils.parse_endpoints('1.2.3.4:4242 ::1:4243')
+        self.assertEqual([('1.2.3.4', 4242), ('::1', 4243)], endpoints)
+
+    def test_parse_empty(self):
+        self.assertEqual([], instanceutils.parse_endpoints(''))
@@ -0,0 +1,84 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the GPLv3, see copyright file for details.
+
+import os
+from pkg_resources import resource_filename
+import shutil
+import sys
+import tempfile
+import unittest
+
+import mock
+
+# Allow importing modules and packages from the hooks directory.
+sys.path.append(resource_filename(__name__, '../hooks'))
+
+import kerneltuning
+
+
+@mock.patch('hookutils.log', mock.Mock())
+@mock.patch('charmhelpers.core.host.service')
+@mock.patch('charmhelpers.core.sysctl.create')
+class TestKernelTuning(unittest.TestCase):
+
+    def setUp(self):
+        # Set up a playground for the files written by the charm.
+        playground = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, playground)
+        self.sysctl_conf = os.path.join(playground, 'sysctl.conf')
+        self.dropin = os.path.join(playground, 'redis.service.d', 'thp.conf')
+        self.thp_file = os.path.join(playground, 'thp')
+        self.somaxconn_file = os.path.join(playground, 'somaxconn')
+        with open(self.somaxconn_file, 'w') as somaxconn_file:
+            somaxconn_file.write('128\n')
+        patches = [
+            mock.patch('settings.SYSCTL_CONF', self.sysctl_conf),
+            mock.patch('settings.THP_DROPIN', self.dropin),
+            mock.patch('settings.THP_FILES', (self.thp_file,)),
+            mock.patch('settings.SOMAXCONN_FILE', self.somaxconn_file),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_apply(self, mock_create, mock_service):
+        kerneltuning.apply(1024)
+        mock_create.assert_called_once_with({
+            'net.core.somaxconn': 1024,
+            'net.ipv4.tcp_max_syn_backlog': 1024,
+            'vm.overcommit_memory': 1,
+        }, self.sysctl_conf, ignore=True)
+        self.assertEqual('never', open(self.thp_file).read())
+        expected_dropin = (
+            "[Service]\n"
+            "ExecStartPre=-+/bin/sh -c 'echo never > {}'\n"
+        ).format(self.thp_file)
+        self.assertEqual(expected_dropin, open(self.dropin).read())
+        mock_service.assert_called_once_with('daemon-reload')
+
+    def test_apply_high_somaxconn(self, mock_create, mock_service):
+        with open(self.somaxconn_file, 'w') as somaxconn_file:
+            somaxconn_file.write('4096\n')
+        kerneltuning.apply(1024)
+        sysctl_dict = mock_create.call_args[0][0]
+        self.assertEqual(4096, sysctl_dict['net.core.somaxconn'])
+
+    def test_apply_unchanged_dropin(self, mock_create, mock_service):
+        kerneltuning.apply(1024)
+        mock_service.reset_mock()
+        kerneltuning.apply(1024)
+        self.assertFalse(mock_service.called)
+
+    def test_remove(self, mock_create, mock_service):
+        kerneltuning.apply(1024)
+        mock_service.reset_mock()
+        with open(self.sysctl_conf, 'w') as sysctl_conf:
+            sysctl_conf.write('vm.overcommit_memory=1\n')
+        kerneltuning.remove()
+        self.assertFalse(os.path.exists(self.sysctl_conf))
+        self.assertFalse(os.path.exists(self.dropin))
+        mock_service.assert_called_once_with('daemon-reload')
+
+    def test_remove_not_applied(self, mock_create, mock_service):
+        kerneltuning.remove()
+        self.assertFalse(mock_service.called)
@@ -0,0 +1,119 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the GPLv3, see copyright file for details.
+
+import io
+from pkg_resources import resource_filename
+import socket
+import sys
+import unittest
+
+import mock
+
+# Allow importing modules and packages from the hooks directory.
+sys.path.append(resource_filename(__name__, '../hooks'))
+
+import redisclient
+
+
+def make_socket(replies):
+    """Create and return a mock socket returning the given raw replies."""
+    sock = mock.Mock()
+    sock.makefile.return_value = io.BytesIO(replies)
+    return sock
+
+
+def patch_create_connection(sock):
+    """Patch the "socket.create_connection" function.
+
+    The mocked function returns the given socket.
+    """
+    return mock.patch(
+        'socket.create_connection', mock.Mock(return_value=sock))
+
+
+class TestClient(unittest.TestCase):
+
+    def test_connection(self):
+        sock = make_socket(b'')
+        with patch_create_connection(sock) as mock_create_connection:
+            with redisclient.Client('1.2.3.4', 4242):
+                pass
+        mock_create_connection.assert_called_once_with(
+            ('1.2.3.4', 4242), redisclient.DEFAULT_TIMEOUT)
+        self.assertFalse(sock.sendall.called)
+        sock.close.assert_called_once_with()
+
+    def test_connection_error(self):
+        error = socket.error('bad wolf')
+        with mock.patch('socket.create_connection', side_effect=error):
+            with self.assertRaises(redisclient.RedisError) as ctx:
+                redisclient.Client('1.2.3.4', 4242)
+        self.assertEqual(
+            'cannot connect to 1.2.3.4:4242: bad wolf', str(ctx.exception))
+
+    def test_authentication(self):
+        sock = make_socket(b'+OK\r\n')
+        with patch_create_connection(sock):
+            redisclient.Client('1.2.3.4', 4242, password='secret!')
+        sock.sendall.assert_called_once_with(
+            b'*2\r\n$4\r\nAUTH\r\n$7\r\nsecret!\r\n')
+
+    def test_status_reply(self):
+        sock = make_socket(b'+OK\r\n')
+        with patch_create_connection(sock):
+            client = redisclient.Client('1.2.3.4', 4242)
+            reply = client.execute('CONFIG', 'SET', 'timeout', 42)
+        self.assertEqual('OK', reply)
+        sock.sendall.assert_called_once_with(
+            b'*4\r\n$6\r\nCONFIG\r\n$3\r\nSET\r\n$7\r\ntimeout\r\n'
+            b'$2\r\n42\r\n')
+
+    def test_error_reply(self):
+        sock = make_socket(b'-ERR unsupported parameter\r\n')
+        with patch_create_connection(sock):
+            client = redisclient.Client('1.2.3.4', 4242)
+            with self.assertRaises(redisclient.RedisError) as ctx:
+                client.execute('CONFIG', 'SET', 'port', 42)
+        self.assertEqual('ERR unsupported parameter', str(ctx.exception))
+
+    def test_integer_reply(self):
+        sock = make_socket(b':47\r\n')
+        with patch_create_connection(sock):
+            client = redisclient.Client('1.2.3.4', 4242)
+            self.assertEqual(47, client.execute('DBSIZE'))
+
+    def test_bulk_reply(self):
+        sock = make_socket(b'$12\r\nhello\r\nworld\r\n$-1\r\n')
+        with patch_create_connection(sock):
+            client = redisclient.Client('1.2.3.4', 4242)
+            self.assertEqual('hello\r\nworld', client.execute('GET', 'a'))
+            self.assertIsNone(client.execute('GET', 'b'))
+
+    def test_multi_bulk_reply(self):
+        sock = make_socket(b'*2\r\n$7\r\ntimeout\r\n$1\r\n0\r\n')
+        with patch_create_connection(sock):
+            client = redisclient.Client('1.2.3.4', 4242)
+            reply = client.execute('CONFIG', 'GET', 'timeout')
+        self.assertEqual(['timeout', '0'], reply)
+
+    def test_connection_closed(self):
+        sock = make_socket(b'')
+        with patch_create_connection(sock):
+            client = redisclient.Client('1.2.3.4', 4242)
+            with self.assertRaises(redisclient.ConnectionClosed) as ctx:
+                client.execute('PING')
+        self.assertEqual('connection closed by the server', str(ctx.exception))
+
+
+class TestParseInfo(unittest.TestCase):
+
+    def test_parse(self):
+        reply = (
+            '# Persistence\r\nloading:0\r\n\r\n'
+            '# Replication\r\nrole:slave\r\nmaster_host:1.2.3.4\r\n')
+        expected_info = {
+            'loading': '0',
+            'master_host': '1.2.3.4',
+            'role': 'slave',
+        }
+        self.assertEqual(expected_info, redisclient.parse_info(reply))
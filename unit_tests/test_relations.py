@@ -33,6 +33,9 @@ def patch_unit_get(value):
         mock.Mock(return_value=value))
 
 
+@mock.patch('relations.MasterRelation', mock.Mock())
+@mock.patch('replicationutils.get_replicas', mock.Mock(return_value=[]))
+@mock.patch('restartutils.is_server_ready', mock.Mock(return_value=True))
 @mock.patch('hookutils.log', mock.Mock())
 class TestDbRelation(unittest.TestCase):
 
@@ -42,13 +45,287 @@ class TestDbRelation(unittest.TestCase):
             self.relation = relations.DbRelation()
 
     def test_provide_data(self):
-        with patch_config({'port': 4242, 'password': 'secret!'}):
+        config = {
+            'cluster-enabled': False,
+            'instances': 1,
+            'password': 'secret!',
+            'peer-replication': False,
+            'port': 4242,
+            'sentinel-enabled': False,
+            'unixsocket': '/run/redis/redis-server.sock',
+        }
+        with patch_config(config):
             with patch_unit_get('1.2.3.4') as mock_unit_get:
                 data = self.relation.provide_data()
         expected_data = {
+            'endpoints': '1.2.3.4:4242',
             'hostname': '1.2.3.4',
             'port': 4242,
             'password': 'secret!',
+            'ready': 'true',
+            # Values only used in other modes are removed from the relation.
+            'cluster-seeds': '',
+            'master': '',
+            'replicas': '',
+            'sentinel-master': '',
+            'sentinels': '',
+            'unixsocket': '/run/redis/redis-server.sock',
         }
         self.assertEqual(expected_data, data)
         mock_unit_get.assert_called_once_with('private-address')
+
+    def test_provide_data_multiple_instances(self):
+        config = {
+            'cluster-enabled': False,
+            'instances': 3,
+            'password': '',
+            'peer-replication': False,
+            'port': 4242,
+            'sentinel-enabled': False,
+            'unixsocket': '',
+        }
+        with patch_config(config):
+            with patch_unit_get('1.2.3.4'):
+                data = self.relation.provide_data()
+        self.assertEqual(
+            '1.2.3.4:4242 1.2.3.4:4243 1.2.3.4:4244', data['endpoints'])
+        self.assertEqual('1.2.3.4', data['hostname'])
+        self.assertEqual(4242, data['port'])
+
+    def test_provide_data_not_ready(self):
+        config = {
+            'cluster-enabled': False,
+            'instances': 2,
+            'password': 'secret!',
+            'peer-replication': False,
+            'port': 4242,
+            'sentinel-enabled': False,
+            'unixsocket': '',
+        }
+        with patch_config(config):
+            with patch_unit_get('1.2.3.4'):
+                with mock.patch(
+                        'restartutils.is_server_ready',
+                        mock.Mock(side_effect=[True, False])) as mock_ready:
+                    data = self.relation.provide_data()
+        expected_data = {
+            'endpoints': '',
+            'hostname': '',
+            'port': '',
+            'password': '',
+            'ready': 'false',
+            'cluster-seeds': '',
+            'master': '',
+            'replicas': '',
+            'sentinel-master': '',
+            'sentinels': '',
+            'unixsocket': '',
+        }
+        self.assertEqual(expected_data, data)
+        mock_ready.assert_has_calls([
+            mock.call('1.2.3.4', 4242, 'secret!'),
+            mock.call('1.2.3.4', 4243, 'secret!'),
+        ])
+
+    def test_provide_data_cluster(self):
+        config = {
+            'cluster-enabled': True,
+            'instances': 1,
+            'password': '',
+            'peer-replication': False,
+            'port': 4242,
+            'sentinel-enabled': False,
+            'unixsocket': '',
+        }
+        cluster_relation = {'cluster': [{'endpoints': '1.2.3.5:4242'}]}
+        with patch_config(config):
+            with patch_unit_get('1.2.3.4'):
+                with mock.patch(
+                        'relations.ClusterRelation',
+                        mock.Mock(return_value=type(
+                            'Relation', (dict,), {'name': 'cluster'})(
+                                cluster_relation))):
+                    data = self.relation.provide_data()
+        self.assertEqual('1.2.3.4:4242 1.2.3.5:4242', data['cluster-seeds'])
+        self.assertEqual('', data['replicas'])
+        self.assertEqual('', data['master'])
+
+    def test_provide_data_replicas(self):
+        config = {
+            'cluster-enabled': False,
+            'instances': 1,
+            'password': '',
+            'peer-replication': False,
+            'port': 4242,
+            'sentinel-enabled': False,
+            'unixsocket': '',
+        }
+        replicas = [('1.2.3.5', 4242), ('1.2.3.6', 4242)]
+        with patch_config(config):
+            with patch_unit_get('1.2.3.4'):
+                with mock.patch(
+                        'replicationutils.get_replicas',
+                        mock.Mock(return_value=replicas)) as mock_get:
+                    data = self.relation.provide_data()
+        self.assertEqual('1.2.3.5:4242 1.2.3.6:4242', data['replicas'])
+        mock_get.assert_called_once_with(
+            config, relations.MasterRelation.return_value)
+
+    def test_provide_data_peer_replication(self):
+        config = {
+            'cluster-enabled': False,
+            'instances': 1,
+            'password': '',
+            'peer-replication': True,
+            'port': 4242,
+            'sentinel-enabled': False,
+            'unixsocket': '',
+        }
+        with patch_config(config):
+            with patch_unit_get('1.2.3.4'):
+                with mock.patch('relations.ReplicationRelation') as mock_rel:
+                    with mock.patch(
+                            'electionutils.get_master_endpoints',
+                            mock.Mock(return_value=[
+                                ('1.2.3.5', 4242), ('1.2.3.5', 4243)])):
+                        with mock.patch(
+                                'replicationutils.get_replicas') as mock_get:
+                            mock_get.return_value = []
+                            data = self.relation.provide_data()
+        self.assertEqual('1.2.3.5:4242', data['master'])
+        mock_get.assert_called_once_with(
+            config, relations.MasterRelation.return_value,
+            mock_rel.return_value)
+
+    def test_provide_data_sentinel(self):
+        config = {
+            'cluster-enabled': False,
+            'instances': 1,
+            'password': '',
+            'peer-replication': False,
+            'port': 4242,
+            'sentinel-enabled': True,
+            'unixsocket': '',
+        }
+        sentinel_data = {
+            'sentinel-master': 'redis',
+            'sentinels': '1.2.3.4:26379',
+        }
+        with patch_config(config):
+            with patch_unit_get('1.2.3.4'):
+                with mock.patch('relations.SlaveRelation'):
+                    with mock.patch(
+                            'sentinelutils.get_relation_data',
+                            mock.Mock(return_value=sentinel_data)):
+                        data = self.relation.provide_data()
+        self.assertEqual('redis', data['sentinel-master'])
+        self.assertEqual('1.2.3.4:26379', data['sentinels'])
+
+    def test_without_data(self):
+        with mock.patch('charmhelpers.core.hookenv.relation_ids') as mock_ids:
+            relation = relations.DbRelation(get_data=False)
+        self.assertFalse(mock_ids.called)
+        self.assertFalse(relation.is_ready())
+
+
+@mock.patch('replicationutils.get_replicas', mock.Mock(return_value=[]))
+@mock.patch('restartutils.is_server_ready', mock.Mock(return_value=True))
+@mock.patch('hookutils.log', mock.Mock())
+class TestMasterRelation(unittest.TestCase):
+
+    def test_provide_data(self):
+        config = {
+            'cluster-enabled': False,
+            'instances': 1,
+            'password': '',
+            'peer-replication': False,
+            'port': 4242,
+            'sentinel-enabled': False,
+            'unixsocket': '',
+        }
+        relation_ids_path = 'charmhelpers.core.hookenv.relation_ids'
+        with mock.patch(relation_ids_path, mock.MagicMock()):
+            relation = relations.MasterRelation()
+        with patch_config(config):
+            with patch_unit_get('1.2.3.4'):
+                with mock.patch('charmhelpers.core.hookenv.service_name',
+                                mock.Mock(return_value='redis1')):
+                    with mock.patch(relation_ids_path, mock.MagicMock()):
+                        data = relation.provide_data()
+        self.assertEqual('redis1', data['master-name'])
+        self.assertEqual('1.2.3.4', data['hostname'])
+
+    def test_provide_data_not_ready(self):
+        config = {
+            'cluster-enabled': False,
+            'instances': 1,
+            'password': '',
+            'peer-replication': False,
+            'port': 4242,
+            'sentinel-enabled': False,
+            'unixsocket': '',
+        }
+        relation_ids_path = 'charmhelpers.core.hookenv.relation_ids'
+        with mock.patch(relation_ids_path, mock.MagicMock()):
+            relation = relations.MasterRelation()
+        with patch_config(config):
+            with patch_unit_get('1.2.3.4'):
+                with mock.patch('charmhelpers.core.hookenv.service_name',
+                                mock.Mock(return_value='redis1')):
+                    with mock.patch(relation_ids_path, mock.MagicMock()):
+                        with mock.patch(
+                                'restartutils.is_server_ready',
+                                mock.Mock(return_value=False)):
+                            data = relation.provide_data()
+        # Slaves keep replicating a master which is not ready.
+        self.assertEqual('false', data['ready'])
+        self.assertEqual('1.2.3.4', data['hostname'])
+        self.assertEqual(4242, data['port'])
+
+
+@mock.patch('hookutils.log', mock.Mock())
+class TestSlaveRelation(unittest.TestCase):
+
+    def setUp(self):
+        relation_ids_path = 'charmhelpers.core.hookenv.relation_ids'
+        with mock.patch(relation_ids_path, mock.MagicMock()):
+            self.relation = relations.SlaveRelation()
+
+    def test_provide_data(self):
+        with patch_config({'instances': 2, 'port': 4242}):
+            with patch_unit_get('1.2.3.5'):
+                data = self.relation.provide_data()
+        self.assertEqual({'endpoints': '1.2.3.5:4242 1.2.3.5:4243'}, data)
+
+
+@mock.patch('hookutils.log', mock.Mock())
+class TestClusterRelation(unittest.TestCase):
+
+    def setUp(self):
+        relation_ids_path = 'charmhelpers.core.hookenv.relation_ids'
+        with mock.patch(relation_ids_path, mock.MagicMock()):
+            self.relation = relations.ClusterRelation()
+
+    def test_provide_data(self):
+        with patch_config({'instances': 2, 'port': 4242}):
+            with patch_unit_get('1.2.3.4'):
+                data = self.relation.provide_data()
+        self.assertEqual({'endpoints': '1.2.3.4:4242 1.2.3.4:4243'}, data)
+
+
+@mock.patch('hookutils.log', mock.Mock())
+class TestReplicationRelation(unittest.TestCase):
+
+    def setUp(self):
+        relation_ids_path = 'charmhelpers.core.hookenv.relation_ids'
+        with mock.patch(relation_ids_path, mock.MagicMock()):
+            self.relation = relations.ReplicationRelation()
+
+    def test_provide_data(self):
+        with patch_config({'instances': 1, 'port': 4242}):
+            with patch_unit_get('1.2.3.4'):
+                with mock.patch('upgradeutils.get_completed',
+                                mock.Mock(return_value='2015-10-21')):
+                    data = self.relation.provide_data()
+        expected_data = {'endpoints': '1.2.3.4:4242', 'upgraded': '2015-10-21'}
+        self.assertEqual(expected_data, data)
@@ -0,0 +1,295 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the GPLv3, see copyright file for details.
+
+from pkg_resources import resource_filename
+import sys
+import unittest
+
+import mock
+
+# Allow importing modules and packages from the hooks directory.
+sys.path.append(resource_filename(__name__, '../hooks'))
+
+import redisclient
+import replicationutils
+
+
+MB = 1024 * 1024
+
+
+def patch_kv(data):
+    """Patch the unit key/value store, backing it with the given dict."""
+    kv = mock.Mock()
+    kv.get.side_effect = lambda key, default=None: data.get(key, default)
+    kv.set.side_effect = data.__setitem__
+    return mock.patch(
+        'charmhelpers.core.unitdata.kv', mock.Mock(return_value=kv))
+
+
+def patch_hook_name(name):
+    """Patch the "charmhelpers.core.hookenv.hook_name" function."""
+    return mock.patch(
+        'charmhelpers.core.hookenv.hook_name', mock.Mock(return_value=name))
+
+
+@mock.patch('charmhelpers.core.hookenv.unit_private_ip',
+            mock.Mock(return_value='1.2.3.4'))
+@mock.patch('hookutils.log', mock.Mock())
+class TestSampleWriteRate(unittest.TestCase):
+
+    config = {
+        'instances': 1,
+        'password': 'secret!',
+        'port': 4242,
+        'repl-backlog-size': 'auto',
+    }
+
+    def sample(
+            self, data, offset, timestamp, config=None, hook='update-status'):
+        """Run the callback, returning the given replication offset."""
+        callback = replicationutils.sample_write_rate(config or self.config)
+        with mock.patch('redisclient.Client') as mock_client:
+            client = mock_client.return_value.__enter__.return_value
+            client.execute.return_value = (
+                '# Replication\r\nmaster_repl_offset:{}\r\n'.format(offset))
+            with patch_kv(data):
+                with patch_hook_name(hook):
+                    with mock.patch('time.time',
+                                    mock.Mock(return_value=timestamp)):
+                        callback('foo')
+        return mock_client
+
+    def test_first_sample(self):
+        data = {}
+        mock_client = self.sample(data, 1000, 10)
+        mock_client.assert_called_once_with(
+            '1.2.3.4', 4242, password='secret!')
+        expected_samples = {
+            'redis-server': {'offset': 1000, 'rate': 0, 'time': 10},
+        }
+        self.assertEqual(
+            expected_samples, data['replicationutils.samples'])
+
+    def test_rate(self):
+        data = {}
+        self.sample(data, 1000, 10)
+        self.sample(data, 101000, 110)
+        sample = data['replicationutils.samples']['redis-server']
+        self.assertEqual(1000, sample['rate'])
+
+    def test_rate_decay(self):
+        data = {}
+        self.sample(data, 1000, 10)
+        self.sample(data, 101000, 110)
+        self.sample(data, 101000, 210)
+        sample = data['replicationutils.samples']['redis-server']
+        self.assertEqual(900, sample['rate'])
+
+    def test_offset_reset(self):
+        data = {}
+        self.sample(data, 1000, 10)
+        self.sample(data, 10, 110)
+        sample = data['replicationutils.samples']['redis-server']
+        self.assertEqual({'offset': 10, 'rate': 0, 'time': 110}, sample)
+
+    def test_other_hook(self):
+        data = {}
+        mock_client = self.sample(data, 1000, 10, hook='config-changed')
+        self.assertFalse(mock_client.called)
+        self.assertEqual({}, data)
+
+    def test_not_auto(self):
+        data = {}
+        config = dict(self.config, **{'repl-backlog-size': '64mb'})
+        mock_client = self.sample(data, 1000, 10, config=config)
+        self.assertFalse(mock_client.called)
+
+    def test_error(self):
+        data = {}
+        callback = replicationutils.sample_write_rate(self.config)
+        error = redisclient.RedisError('bad wolf')
+        with mock.patch('redisclient.Client', side_effect=error):
+            with patch_kv(data):
+                with patch_hook_name('update-status'):
+                    callback('foo')
+        self.assertEqual({}, data['replicationutils.samples'])
+
+
+@mock.patch('resources.get_memory_limit', mock.Mock(return_value=4096 * MB))
+class TestGetBacklogSize(unittest.TestCase):
+
+    def get_size(self, value, rate=None, num_instances=1):
+        """Return the backlog size for the given value and write rate."""
+        data = {}
+        if rate is not None:
+            data['replicationutils.samples'] = {
+                'redis-server': {'offset': 0, 'rate': rate, 'time': 0}}
+        with patch_kv(data):
+            return replicationutils.get_backlog_size(
+                value, 60, 'redis-server', num_instances)
+
+    def test_default(self):
+        self.assertIsNone(self.get_size(''))
+
+    def test_absolute(self):
+        self.assertEqual(64 * MB, self.get_size('64mb'))
+
+    def test_auto_no_samples(self):
+        self.assertEqual(16 * MB, self.get_size('auto'))
+
+    def test_auto(self):
+        # One minute of writes at 1MB/s, rounded up to a power of two.
+        self.assertEqual(64 * MB, self.get_size('auto', rate=MB))
+
+    def test_auto_capped(self):
+        self.assertEqual(
+            int(4096 * MB * 0.1 / 2),
+            self.get_size('auto', rate=100 * MB, num_instances=2))
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            self.get_size('bad wolf')
+
+
+@mock.patch('charmhelpers.core.hookenv.unit_private_ip',
+            mock.Mock(return_value='1.2.3.4'))
+@mock.patch('hookutils.log', mock.Mock())
+class TestGetReplicas(unittest.TestCase):
+
+    config = {'instances': 1, 'password': '', 'port': 4242}
+    info = (
+        '# Replication\r\nrole:master\r\nconnected_slaves:3\r\n'
+        'slave0:ip=1.2.3.5,port=4242,state=online,offset=5000000,lag=0\r\n'
+        'slave1:ip=1.2.3.6,port=4242,state=wait_bgsave,offset=0,lag=0\r\n'
+        'slave2:ip=1.2.3.7,port=4242,state=online,offset=1000,lag=1\r\n'
+        'master_repl_offset:5000042\r\n')
+
+    def get_replicas(self, units, info=None):
+        """Return the replicas for the given master relation units data."""
+        master_relation = type('Relation', (dict,), {'name': 'master'})(
+            {'master': units})
+        with mock.patch('redisclient.Client') as mock_client:
+            client = mock_client.return_value.__enter__.return_value
+            client.execute.return_value = info or self.info
+            replicas = replicationutils.get_replicas(
+                self.config, master_relation)
+        return replicas, mock_client
+
+    def test_replicas(self):
+        units = [
+            {'endpoints': '1.2.3.5:4242'},
+            {'endpoints': '1.2.3.6:4242'},
+        ]
+        replicas, mock_client = self.get_replicas(units)
+        self.assertEqual([('1.2.3.5', 4242)], replicas)
+        mock_client.assert_called_once_with('1.2.3.4', 4242, password=None)
+
+    def test_lagging_replica(self):
+        replicas, _ = self.get_replicas([{'endpoints': '1.2.3.7:4242'}])
+        self.assertEqual([], replicas)
+
+    def test_departed_replica(self):
+        # The replica is still connected but its unit left the relation.
+        replicas, _ = self.get_replicas([{'endpoints': '1.2.3.6:4242'}])
+        self.assertEqual([], replicas)
+
+    def test_no_slaves(self):
+        replicas, mock_client = self.get_replicas([{'private-address': 'a'}])
+        self.assertEqual([], replicas)
+        self.assertFalse(mock_client.called)
+
+    def test_error(self):
+        units = [{'endpoints': '1.2.3.5:4242'}]
+        with mock.patch(
+                'redisclient.Client',
+                mock.Mock(side_effect=redisclient.RedisError('bad wolf'))):
+            replicas = replicationutils.get_replicas(
+                self.config, type('Relation', (dict,), {'name': 'master'})(
+                    {'master': units}))
+        self.assertEqual([], replicas)
+
+
+@mock.patch('charmhelpers.core.hookenv.config',
+            mock.Mock(return_value={'sync-batch-size': 2}))
+class TestSyncCoordinator(unittest.TestCase):
+
+    def grant(self, unit, granted, queue):
+        """Return whether the sync lock is granted to the given unit."""
+        # Avoid instantiating the singleton, which requires a hook context.
+        coordinator = replicationutils.SyncCoordinator.__new__(
+            replicationutils.SyncCoordinator)
+        return coordinator.grant_sync('sync', unit, granted, queue)
+
+    def test_batch(self):
+        queue = ['redis/1', 'redis/2', 'redis/3']
+        self.assertTrue(self.grant('redis/1', set(), queue))
+        self.assertTrue(self.grant('redis/2', set(), queue))
+        self.assertFalse(self.grant('redis/3', set(), queue))
+
+    def test_batch_full(self):
+        granted = set(['redis/1', 'redis/2'])
+        self.assertFalse(self.grant('redis/3', granted, ['redis/3']))
+
+    def test_batch_partially_full(self):
+        granted = set(['redis/1'])
+        queue = ['redis/2', 'redis/3']
+        self.assertTrue(self.grant('redis/2', granted, queue))
+        self.assertFalse(self.grant('redis/3', granted, queue))
+
+
+@mock.patch('hookutils.log', mock.Mock())
+class TestAdmitSync(unittest.TestCase):
+
+    def test_disabled(self):
+        with mock.patch('replicationutils.SyncCoordinator') as mock_coord:
+            self.assertTrue(
+                replicationutils.admit_sync({'sync-batch-size': 0}))
+        self.assertFalse(mock_coord.called)
+
+    def test_granted(self):
+        with mock.patch('replicationutils.SyncCoordinator') as mock_coord:
+            mock_coord.return_value.acquire.return_value = True
+            self.assertTrue(
+                replicationutils.admit_sync({'sync-batch-size': 2}))
+        mock_coord.return_value.acquire.assert_called_once_with('sync')
+
+    def test_waiting(self):
+        with mock.patch('replicationutils.SyncCoordinator') as mock_coord:
+            mock_coord.return_value.acquire.return_value = False
+            self.assertFalse(
+                replicationutils.admit_sync({'sync-batch-size': 2}))
+
+
+@mock.patch('hookutils.log', mock.Mock())
+class TestIsFresh(unittest.TestCase):
+
+    def is_fresh(self, info=None, error=None):
+        """Report whether the server returning the given INFO is fresh."""
+        with mock.patch('redisclient.Client') as mock_client:
+            client = mock_client.return_value.__enter__.return_value
+            client.execute.return_value = info
+            client.execute.side_effect = error
+            fresh = replicationutils.is_fresh('1.2.3.4', 4242, 'secret!')
+        mock_client.assert_called_once_with(
+            '1.2.3.4', 4242, password='secret!')
+        return fresh
+
+    def test_fresh(self):
+        self.assertTrue(self.is_fresh(
+            '# Replication\r\nrole:master\r\nmaster_repl_offset:0\r\n'
+            '# Keyspace\r\n'))
+
+    def test_keys(self):
+        self.assertFalse(self.is_fresh(
+            '# Replication\r\nrole:master\r\nmaster_repl_offset:0\r\n'
+            '# Keyspace\r\ndb0:keys=1,expires=0,avg_ttl=0\r\n'))
+
+    def test_replication_history(self):
+        # The server had replicas or a master, even if the data was flushed.
+        self.assertFalse(self.is_fresh(
+            '# Replication\r\nrole:master\r\nmaster_repl_offset:42\r\n'
+            '# Keyspace\r\n'))
+
+    def test_unreachable(self):
+        self.assertTrue(self.is_fresh(
+            error=redisclient.RedisError('bad wolf')))
@@ -0,0 +1,126 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the GPLv3, see copyright file for details.
+
+import os
+from pkg_resources import resource_filename
+import shutil
+import sys
+import tempfile
+import unittest
+
+import mock
+
+# Allow importing modules and packages from the hooks directory.
+sys.path.append(resource_filename(__name__, '../hooks'))
+
+import resources
+
+
+def patch_total_ram(value):
+    """Patch the "charmhelpers.core.host.get_total_ram" function.
+
+    The mocked function returns the given value.
+    """
+    return mock.patch(
+        'charmhelpers.core.host.get_total_ram', lambda: value)
+
+
+class TestGetMemoryLimit(unittest.TestCase):
+
+    def make_files(self, *contents):
+        """Create the cgroup files with the given contents.
+
+        Return the list of their paths. None contents are not created.
+        """
+        playground = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, playground)
+        paths = []
+        for num, content in enumerate(contents):
+            path = os.path.join(playground, str(num))
+            if content is not None:
+                with open(path, 'w') as cgroup_file:
+                    cgroup_file.write(content)
+            paths.append(path)
+        return paths
+
+    def test_no_cgroup(self):
+        paths = self.make_files(None, None)
+        with mock.patch('resources.CGROUP_MEMORY_LIMIT_FILES', paths):
+            with patch_total_ram(4096):
+                self.assertEqual(4096, resources.get_memory_limit())
+
+    def test_cgroup_v2_limited(self):
+        paths = self.make_files('1024\n', None)
+        with mock.patch('resources.CGROUP_MEMORY_LIMIT_FILES', paths):
+            with patch_total_ram(4096):
+                self.assertEqual(1024, resources.get_memory_limit())
+
+    def test_cgroup_v2_unlimited(self):
+        paths = self.make_files('max\n', '1024\n')
+        with mock.patch('resources.CGROUP_MEMORY_LIMIT_FILES', paths):
+            with patch_total_ram(4096):
+                self.assertEqual(4096, resources.get_memory_limit())
+
+    def test_cgroup_v1(self):
+        paths = self.make_files(None, '9223372036854771712\n')
+        with mock.patch('resources.CGROUP_MEMORY_LIMIT_FILES', paths):
+            with patch_total_ram(4096):
+                self.assertEqual(4096, resources.get_memory_limit())
+
+
+class TestGetCpuCount(unittest.TestCase):
+
+    def patch_cpu_max(self, content=None):
+        """Patch the cgroup CPU bandwidth file using the given content.
+
+        The file is not created if content is None.
+        """
+        playground = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, playground)
+        path = os.path.join(playground, 'cpu.max')
+        if content is not None:
+            with open(path, 'w') as cgroup_file:
+                cgroup_file.write(content)
+        return mock.patch('resources.CGROUP_CPU_MAX_FILE', path)
+
+    def patch_affinity(self, cpus):
+        """Patch the "os.sched_getaffinity" function.
+
+        The mocked function returns a set with the given number of CPUs.
+        """
+        return mock.patch(
+            'os.sched_getaffinity', lambda pid: set(range(cpus)),
+            create=True)
+
+    def test_no_cgroup(self):
+        with self.patch_affinity(8), self.patch_cpu_max():
+            self.assertEqual(8, resources.get_cpu_count())
+
+    def test_cgroup_unlimited(self):
+        with self.patch_affinity(8), self.patch_cpu_max('max 100000\n'):
+            self.assertEqual(8, resources.get_cpu_count())
+
+    def test_cgroup_limited(self):
+        with self.patch_affinity(8), self.patch_cpu_max('250000 100000\n'):
+            self.assertEqual(3, resources.get_cpu_count())
+
+
+class TestParseSize(unittest.TestCase):
+
+    def test_units(self):
+        sizes = {
+            '42': 42,
+            '1k': 1000,
+            '1kb': 1024,
+            '2m': 2000000,
+            '2MB': 2 * 1024 ** 2,
+            '3g': 3000000000,
+            '3gb': 3 * 1024 ** 3,
+        }
+        for value, expected_size in sizes.items():
+            self.assertEqual(expected_size, resources.parse_size(value))
+
+    def test_invalid(self):
+        for value in ('', 'lots', '1tb', '-1'):
+            with self.assertRaises(ValueError):
+                resources.parse_size(value)
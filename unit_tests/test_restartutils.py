@@ -0,0 +1,346 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the GPLv3, see copyright file for details.
+
+from pkg_resources import resource_filename
+import sys
+import unittest
+
+import mock
+
+# Allow importing modules and packages from the hooks directory.
+sys.path.append(resource_filename(__name__, '../hooks'))
+
+import redisclient
+import restartutils
+import settings
+
+
+def patch_kv(data):
+    """Patch the unit key/value store, backing it with the given dict."""
+    kv = mock.Mock()
+    kv.get.side_effect = lambda key, default=None: data.get(key, default)
+    kv.set.side_effect = data.__setitem__
+    kv.unset.side_effect = lambda key: data.pop(key, None)
+    return mock.patch(
+        'charmhelpers.core.unitdata.kv', mock.Mock(return_value=kv))
+
+
+def patch_serial(granted):
+    """Patch the coordinator, granting or not the restart lock."""
+    serial = mock.Mock()
+    serial.acquire.return_value = granted
+    return mock.patch(
+        'charmhelpers.coordinator.Serial', mock.Mock(return_value=serial))
+
+
+@mock.patch('hookutils.log', mock.Mock())
+@mock.patch('restartutils.warm_restart')
+@mock.patch('charmhelpers.core.host.service_restart')
+class TestRestart(unittest.TestCase):
+
+    endpoints = {'redis-server': ('1.2.3.4', 4242, 'secret!')}
+
+    def test_granted(self, mock_service_restart, mock_warm_restart):
+        data = {}
+        with patch_kv(data):
+            with patch_serial(True) as mock_serial:
+                restarted = restartutils.restart(
+                    ['redis-server'], self.endpoints)
+        self.assertTrue(restarted)
+        mock_serial.return_value.acquire.assert_called_once_with(
+            settings.RESTART_LOCK)
+        mock_warm_restart.assert_called_once_with(
+            'redis-server', '1.2.3.4', 4242, 'secret!',
+            running=('1.2.3.4', 4242, 'secret!'))
+        self.assertFalse(mock_service_restart.called)
+        self.assertEqual({}, data)
+
+    def test_address_changed(self, mock_service_restart, mock_warm_restart):
+        running_endpoints = {'redis-server': ('1.2.3.4', 6379, None)}
+        with patch_kv({}):
+            with patch_serial(True):
+                restartutils.restart(
+                    ['redis-server'], self.endpoints, running_endpoints)
+        mock_warm_restart.assert_called_once_with(
+            'redis-server', '1.2.3.4', 4242, 'secret!',
+            running=('1.2.3.4', 6379, None))
+
+    def test_waiting(self, mock_service_restart, mock_warm_restart):
+        data = {}
+        running_endpoints = {'redis-server': ('1.2.3.4', 6379, None)}
+        with patch_kv(data):
+            with patch_serial(False):
+                restarted = restartutils.restart(
+                    ['redis-server'], self.endpoints, running_endpoints)
+        self.assertFalse(restarted)
+        self.assertFalse(mock_service_restart.called)
+        self.assertFalse(mock_warm_restart.called)
+        self.assertEqual({
+            'redis-server': {
+                'endpoint': ('1.2.3.4', 4242, 'secret!'),
+                'running': ('1.2.3.4', 6379, None),
+            },
+        }, data['restartutils.pending'])
+
+    def test_pending(self, mock_service_restart, mock_warm_restart):
+        # The running endpoint stored when the restart was first requested
+        # is used, even if the configuration changed again since then.
+        data = {'restartutils.pending': {
+            'redis-server': {
+                'endpoint': ['1.2.3.4', 4241, None],
+                'running': ['1.2.3.4', 6379, None],
+            },
+            'redis-server@1': {},
+        }}
+        running_endpoints = {'redis-server': ('1.2.3.4', 4241, None)}
+        with patch_kv(data):
+            with patch_serial(True):
+                restartutils.restart([], self.endpoints, running_endpoints)
+        mock_warm_restart.assert_called_once_with(
+            'redis-server', '1.2.3.4', 4242, 'secret!',
+            running=['1.2.3.4', 6379, None])
+        # The endpoint of the pending service is not known.
+        mock_service_restart.assert_called_once_with('redis-server@1')
+        self.assertEqual({}, data)
+
+    def test_nothing_to_do(self, mock_service_restart, mock_warm_restart):
+        with patch_kv({}):
+            with patch_serial(True) as mock_serial:
+                restarted = restartutils.restart([], self.endpoints)
+        self.assertFalse(restarted)
+        self.assertFalse(mock_serial.called)
+        self.assertFalse(mock_service_restart.called)
+
+
+@mock.patch('hookutils.log', mock.Mock())
+@mock.patch('restartutils.wait_until_ready')
+@mock.patch('charmhelpers.core.host.service_restart')
+@mock.patch('charmhelpers.core.host.service_start')
+@mock.patch('charmhelpers.core.host.service_stop')
+class TestWarmRestart(unittest.TestCase):
+
+    def restart(self, running=True, errors=(None,)):
+        """Warm restart the service, with commands failing with the errors."""
+        with mock.patch('charmhelpers.core.host.service_running',
+                        mock.Mock(return_value=running)):
+            with mock.patch('redisclient.Client') as mock_client:
+                client = mock_client.return_value.__enter__.return_value
+                client.execute.side_effect = errors
+                restartutils.warm_restart(
+                    'redis-server', '1.2.3.4', 4242, 'secret!')
+        return mock_client
+
+    def test_save_on_sigterm(
+            self, mock_service_stop, mock_service_start, mock_service_restart,
+            mock_wait_until_ready):
+        manager = mock.Mock()
+        manager.attach_mock(mock_service_stop, 'service_stop')
+        manager.attach_mock(mock_service_start, 'service_start')
+        mock_client = self.restart()
+        mock_client.assert_called_once_with(
+            '1.2.3.4', 4242, password='secret!',
+            timeout=settings.SAVE_TIMEOUT)
+        client = mock_client.return_value.__enter__.return_value
+        client.execute.assert_called_once_with(
+            'CONFIG', 'SET', 'shutdown-on-sigterm', 'save')
+        # The server is stopped by systemd, so it is not restarted behind
+        # the back of the charm.
+        self.assertEqual([
+            mock.call.service_stop('redis-server'),
+            mock.call.service_start('redis-server'),
+        ], manager.mock_calls)
+        self.assertFalse(mock_service_restart.called)
+        mock_wait_until_ready.assert_called_once_with(
+            '1.2.3.4', 4242, 'secret!',
+            timeout=settings.RESTART_READY_TIMEOUT)
+
+    def test_save(
+            self, mock_service_stop, mock_service_start, mock_service_restart,
+            mock_wait_until_ready):
+        mock_client = self.restart(errors=[
+            redisclient.RedisError("ERR Unknown option 'shutdown-on-sigterm'"),
+            'OK'])
+        client = mock_client.return_value.__enter__.return_value
+        self.assertEqual([
+            mock.call('CONFIG', 'SET', 'shutdown-on-sigterm', 'save'),
+            mock.call('SAVE'),
+        ], client.execute.call_args_list)
+        mock_service_stop.assert_called_once_with('redis-server')
+        mock_service_start.assert_called_once_with('redis-server')
+
+    def test_running_address(
+            self, mock_service_stop, mock_service_start, mock_service_restart,
+            mock_wait_until_ready):
+        with mock.patch('charmhelpers.core.host.service_running',
+                        mock.Mock(return_value=True)):
+            with mock.patch('redisclient.Client') as mock_client:
+                restartutils.warm_restart(
+                    'redis-server', '1.2.3.4', 4242, 'secret!',
+                    running=('1.2.3.4', 6379, None))
+        mock_client.assert_called_once_with(
+            '1.2.3.4', 6379, password=None, timeout=settings.SAVE_TIMEOUT)
+        mock_wait_until_ready.assert_called_once_with(
+            '1.2.3.4', 4242, 'secret!',
+            timeout=settings.RESTART_READY_TIMEOUT)
+
+    def test_save_error(
+            self, mock_service_stop, mock_service_start, mock_service_restart,
+            mock_wait_until_ready):
+        self.restart(errors=[
+            redisclient.RedisError('ERR unknown command'),
+            redisclient.RedisError('ERR Background save already in progress'),
+        ])
+        mock_service_stop.assert_called_once_with('redis-server')
+        mock_service_start.assert_called_once_with('redis-server')
+
+    def test_unreachable(
+            self, mock_service_stop, mock_service_start, mock_service_restart,
+            mock_wait_until_ready):
+        with mock.patch('charmhelpers.core.host.service_running',
+                        mock.Mock(return_value=True)):
+            with mock.patch('redisclient.Client') as mock_client:
+                mock_client.return_value.__enter__.side_effect = (
+                    redisclient.RedisError('connection refused'))
+                restartutils.warm_restart(
+                    'redis-server', '1.2.3.4', 4242, 'secret!')
+        mock_service_stop.assert_called_once_with('redis-server')
+        mock_service_start.assert_called_once_with('redis-server')
+
+    def test_not_running(
+            self, mock_service_stop, mock_service_start, mock_service_restart,
+            mock_wait_until_ready):
+        mock_client = self.restart(running=False)
+        self.assertFalse(mock_client.called)
+        self.assertFalse(mock_service_stop.called)
+        mock_service_start.assert_called_once_with('redis-server')
+        self.assertFalse(mock_service_restart.called)
+
+
+@mock.patch('hookutils.log', mock.Mock())
+@mock.patch('time.sleep')
+class TestWaitUntilReady(unittest.TestCase):
+
+    def test_ready(self, mock_sleep):
+        with mock.patch('redisclient.Client') as mock_client:
+            client = mock_client.return_value.__enter__.return_value
+            client.execute.side_effect = [
+                'loading:1\r\n', 'loading:0\r\nrole:master\r\n']
+            with mock.patch('charmhelpers.core.hookenv.status_set'):
+                ready = restartutils.wait_until_ready(
+                    '1.2.3.4', 4242, 'secret!')
+        self.assertTrue(ready)
+        mock_client.assert_called_with('1.2.3.4', 4242, password='secret!')
+        mock_sleep.assert_called_once_with(settings.RESTART_READY_INTERVAL)
+
+    def test_loading_progress(self, mock_sleep):
+        with mock.patch('redisclient.Client') as mock_client:
+            client = mock_client.return_value.__enter__.return_value
+            client.execute.side_effect = [
+                'loading:1\r\nloading_loaded_perc:42.50\r\n',
+                'loading:0\r\nrole:master\r\n']
+            with mock.patch(
+                    'charmhelpers.core.hookenv.status_set') as mock_status_set:
+                restartutils.wait_until_ready('1.2.3.4', 4242)
+        mock_status_set.assert_has_calls([
+            mock.call('maintenance', 'Loading dataset on port 4242: 42.50%'),
+            mock.call('active', ''),
+        ])
+
+    def test_timeout(self, mock_sleep):
+        error = redisclient.RedisError('bad wolf')
+        with mock.patch('redisclient.Client', side_effect=error):
+            with mock.patch('time.time', side_effect=[0, 1, 1000]):
+                with mock.patch('charmhelpers.core.hookenv.status_set') as (
+                        mock_status_set):
+                    ready = restartutils.wait_until_ready('1.2.3.4', 4242)
+        self.assertFalse(ready)
+        self.assertEqual(1, mock_sleep.call_count)
+        mock_status_set.assert_called_once_with(
+            'blocked', 'Redis on port 4242 is not reachable')
+
+    def test_timeout_loading(self, mock_sleep):
+        with mock.patch('redisclient.Client') as mock_client:
+            client = mock_client.return_value.__enter__.return_value
+            client.execute.return_value = 'loading:1\r\n'
+            with mock.patch('time.time', side_effect=[0, 1000, 1000]):
+                with mock.patch('charmhelpers.core.hookenv.status_set') as (
+                        mock_status_set):
+                    ready = restartutils.wait_until_ready(
+                        '1.2.3.4', 4242, timeout=600)
+        self.assertFalse(ready)
+        mock_status_set.assert_called_with(
+            'waiting', 'Redis on port 4242 not ready after 600s')
+
+
+@mock.patch('charmhelpers.core.hookenv.unit_private_ip',
+            mock.Mock(return_value='1.2.3.4'))
+class TestUpdateStatus(unittest.TestCase):
+
+    config = {'instances': 2, 'password': 'secret!', 'port': 4242}
+
+    def update_status(self, ready):
+        """Run the callback, with the given ports ready.
+
+        Return the mock status_set function.
+        """
+        def is_server_ready(hostname, port, password=None):
+            return port in ready
+
+        with mock.patch('restartutils.is_server_ready', is_server_ready):
+            with mock.patch(
+                    'charmhelpers.core.hookenv.status_set') as mock_status_set:
+                restartutils.update_status(self.config)('foo')
+        return mock_status_set
+
+    def test_ready(self):
+        mock_status_set = self.update_status([4242, 4243])
+        mock_status_set.assert_called_once_with('active', '')
+
+    def test_not_ready(self):
+        mock_status_set = self.update_status([4242])
+        mock_status_set.assert_called_once_with(
+            'waiting', 'Redis not ready on port 4243')
+
+
+@mock.patch('hookutils.log', mock.Mock())
+class TestIsServerReady(unittest.TestCase):
+
+    def test_ready(self):
+        with mock.patch('redisclient.Client') as mock_client:
+            client = mock_client.return_value.__enter__.return_value
+            client.execute.return_value = 'loading:0\r\nrole:master\r\n'
+            self.assertTrue(
+                restartutils.is_server_ready('1.2.3.4', 4242, 'secret!'))
+        mock_client.assert_called_once_with(
+            '1.2.3.4', 4242, password='secret!')
+        client.execute.assert_called_once_with('INFO')
+
+    def test_loading(self):
+        with mock.patch('redisclient.Client') as mock_client:
+            client = mock_client.return_value.__enter__.return_value
+            client.execute.return_value = 'loading:1\r\nrole:master\r\n'
+            self.assertFalse(restartutils.is_server_ready('1.2.3.4', 4242))
+
+    def test_error(self):
+        error = redisclient.RedisError('bad wolf')
+        with mock.patch('redisclient.Client', side_effect=error):
+            self.assertFalse(restartutils.is_server_ready('1.2.3.4', 4242))
+
+
+class TestIsReady(unittest.TestCase):
+
+    def test_master(self):
+        info = {'loading': '0', 'role': 'master'}
+        self.assertTrue(restartutils.is_ready(info))
+
+    def test_loading(self):
+        info = {'loading': '1', 'role': 'master'}
+        self.assertFalse(restartutils.is_ready(info))
+
+    def test_replica(self):
+        info = {'loading': '0', 'role': 'slave', 'master_link_status': 'up'}
+        self.assertTrue(restartutils.is_ready(info))
+
+    def test_replica_link_down(self):
+        info = {'loading': '0', 'role': 'slave', 'master_link_status': 'down'}
+        self.assertFalse(restartutils.is_ready(info))
@@ -0,0 +1,251 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the GPLv3, see copyright file for details.
+
+import contextlib
+from pkg_resources import resource_filename
+import sys
+import unittest
+
+import mock
+
+# Allow importing modules and packages from the hooks directory.
+sys.path.append(resource_filename(__name__, '../hooks'))
+
+import redisclient
+import sentinelutils
+import settings
+
+
+def make_config(data, previous=None):
+    """Create and return a mock config with the given data."""
+    config = mock.MagicMock(__getitem__=lambda self, key: data[key])
+    config.previous.side_effect = lambda key: (previous or {}).get(key)
+    return config
+
+
+def make_slave_relation(data):
+    """Create and return a slave relation with the given data."""
+    relation = type('Relation', (dict,), {'name': 'slave'})()
+    relation['slave'] = [data]
+    return relation
+
+
+def patch_client():
+    """Patch the redis client, returning the mock connected client."""
+    return mock.patch('redisclient.Client')
+
+
+def get_client(mock_client):
+    """Return the client used in the context manager."""
+    return mock_client.return_value.__enter__.return_value
+
+
+@mock.patch('charmhelpers.core.hookenv.unit_private_ip',
+            mock.Mock(return_value='1.2.3.4'))
+@mock.patch('charmhelpers.core.hookenv.service_name',
+            mock.Mock(return_value='redis1'))
+@mock.patch('hookutils.log', mock.Mock())
+class TestConfigure(unittest.TestCase):
+
+    data = {
+        'cluster-enabled': False,
+        'password': '',
+        'port': 6379,
+        'sentinel-down-after-milliseconds': 5000,
+        'sentinel-enabled': True,
+        'sentinel-port': 26379,
+        'sentinel-quorum': 2,
+    }
+
+    @contextlib.contextmanager
+    def patch_all(self, changed=False, running=True, masters=(),
+                  current=None):
+        """Mock all the external functions used by the callback."""
+        if current is None:
+            current = {'port': '26379', '# a': 'comment'}
+        mocks = {
+            'apt_install': mock.patch('charmhelpers.fetch.apt_install'),
+            'close_port': mock.patch('charmhelpers.core.hookenv.close_port'),
+            'filter_installed_packages': mock.patch(
+                'charmhelpers.fetch.filter_installed_packages',
+                mock.Mock(return_value=[])),
+            'open_port': mock.patch('charmhelpers.core.hookenv.open_port'),
+            'read': mock.patch(
+                'configfile.read', mock.Mock(return_value=current)),
+            'service': mock.patch('charmhelpers.core.host.service'),
+            'service_restart': mock.patch(
+                'charmhelpers.core.host.service_restart'),
+            'service_running': mock.patch(
+                'charmhelpers.core.host.service_running',
+                mock.Mock(return_value=running)),
+            'service_stop': mock.patch('charmhelpers.core.host.service_stop'),
+            'write': mock.patch(
+                'configfile.write', mock.Mock(return_value=changed)),
+        }
+        with patch_client() as mock_client:
+            get_client(mock_client).execute.side_effect = (
+                lambda *args: list(masters) if args[1] == 'MASTERS' else 'OK')
+            with contextlib.nested(*mocks.values()) as context_managers:
+                object_dict = dict(zip(mocks.keys(), context_managers))
+                object_dict['client'] = get_client(mock_client)
+                yield type('Mocks', (object,), object_dict)
+
+    def test_monitor(self):
+        callback = sentinelutils.configure(make_config(self.data))
+        with self.patch_all(changed=True) as mocks:
+            callback('foo')
+        # The sentinel keeps owning its config file.
+        mocks.write.assert_called_once_with(
+            {'bind': '1.2.3.4', 'port': 26379}, settings.SENTINEL_CONF,
+            owner='redis', group='redis', perms=0o640)
+        mocks.service_restart.assert_called_once_with(
+            settings.SENTINEL_SERVICE_NAME)
+        mocks.open_port.assert_called_once_with(26379)
+        mocks.client.execute.assert_has_calls([
+            mock.call('SENTINEL', 'MASTERS'),
+            mock.call('SENTINEL', 'MONITOR', 'redis1', '1.2.3.4', 6379, 2),
+            mock.call(
+                'SENTINEL', 'SET', 'redis1', 'quorum', 2,
+                'down-after-milliseconds', 5000),
+        ])
+
+    def test_already_monitored(self):
+        data = dict(self.data, password='secret!')
+        callback = sentinelutils.configure(make_config(data))
+        masters = [['name', 'redis1'], ['name', 'mymaster']]
+        with self.patch_all(masters=masters) as mocks:
+            callback('foo')
+        self.assertFalse(mocks.service_restart.called)
+        mocks.client.execute.assert_has_calls([
+            mock.call('SENTINEL', 'MASTERS'),
+            mock.call('SENTINEL', 'REMOVE', 'mymaster'),
+            mock.call(
+                'SENTINEL', 'SET', 'redis1', 'quorum', 2,
+                'down-after-milliseconds', 5000, 'auth-pass', 'secret!'),
+        ])
+        self.assertEqual(3, mocks.client.execute.call_count)
+
+    def test_rewritten_by_sentinel(self):
+        # The sentinel rewrote its state, but bind and port are unchanged.
+        current = {
+            '# Generated by CONFIG REWRITE': '',
+            'bind': '1.2.3.4',
+            'port': '26379',
+            'sentinel': ['myid 42', 'monitor redis1 1.2.3.5 6379 2'],
+        }
+        callback = sentinelutils.configure(make_config(self.data))
+        with self.patch_all(current=current) as mocks:
+            callback('foo')
+        self.assertFalse(mocks.write.called)
+        self.assertFalse(mocks.service_restart.called)
+
+    def test_slave(self):
+        slave_relation = make_slave_relation({
+            'hostname': '4.3.2.1',
+            'master-name': 'redis2',
+            'password': 'secret!',
+            'port': '4242',
+        })
+        callback = sentinelutils.configure(
+            make_config(self.data), slave_relation=slave_relation)
+        with self.patch_all() as mocks:
+            callback('foo')
+        mocks.client.execute.assert_has_calls([
+            mock.call('SENTINEL', 'MONITOR', 'redis2', '4.3.2.1', 4242, 2),
+            mock.call(
+                'SENTINEL', 'SET', 'redis2', 'quorum', 2,
+                'down-after-milliseconds', 5000, 'auth-pass', 'secret!'),
+        ])
+
+    def test_sentinel_error(self):
+        callback = sentinelutils.configure(make_config(self.data))
+        with self.patch_all() as mocks:
+            mocks.client.execute.side_effect = redisclient.RedisError('boo')
+            with mock.patch('hookutils.log') as mock_log:
+                callback('foo')
+        mock_log.assert_called_with('Cannot configure the sentinel: boo.')
+
+    def test_disabled(self):
+        data = dict(self.data, **{'sentinel-enabled': False})
+        callback = sentinelutils.configure(make_config(data))
+        with self.patch_all() as mocks:
+            callback('foo')
+        mocks.service_stop.assert_called_once_with(
+            settings.SENTINEL_SERVICE_NAME)
+        mocks.service.assert_called_once_with(
+            'disable', settings.SENTINEL_SERVICE_NAME)
+        mocks.close_port.assert_called_once_with(26379)
+        self.assertFalse(mocks.apt_install.called)
+        self.assertFalse(mocks.client.execute.called)
+
+    def test_port_changed(self):
+        config = make_config(self.data, previous={'sentinel-port': 26380})
+        callback = sentinelutils.configure(config)
+        with self.patch_all() as mocks:
+            callback('foo')
+        mocks.close_port.assert_called_once_with(26380)
+        mocks.open_port.assert_called_once_with(26379)
+
+
+@mock.patch('charmhelpers.core.hookenv.unit_private_ip',
+            mock.Mock(return_value='1.2.3.4'))
+@mock.patch('charmhelpers.core.hookenv.service_name',
+            mock.Mock(return_value='redis1'))
+@mock.patch('hookutils.log', mock.Mock())
+class TestQueries(unittest.TestCase):
+
+    config = {'sentinel-port': 26379}
+
+    def test_get_current_master(self):
+        with patch_client() as mock_client:
+            get_client(mock_client).execute.return_value = ['4.3.2.1', '90']
+            master = sentinelutils.get_current_master(self.config)
+        self.assertEqual(('4.3.2.1', 90), master)
+        mock_client.assert_called_once_with('1.2.3.4', 26379)
+        get_client(mock_client).execute.assert_called_once_with(
+            'SENTINEL', 'GET-MASTER-ADDR-BY-NAME', 'redis1')
+
+    def test_get_current_master_unknown(self):
+        with patch_client() as mock_client:
+            get_client(mock_client).execute.return_value = None
+            self.assertIsNone(sentinelutils.get_current_master(self.config))
+
+    def test_get_current_master_error(self):
+        with patch_client() as mock_client:
+            mock_client.side_effect = redisclient.RedisError('bad wolf')
+            self.assertIsNone(sentinelutils.get_current_master(self.config))
+
+    def test_get_relation_data(self):
+        with patch_client() as mock_client:
+            get_client(mock_client).execute.return_value = [
+                ['name', 'a', 'ip', '1.2.3.6', 'port', '26379'],
+                ['name', 'b', 'ip', '1.2.3.5', 'port', '26379'],
+            ]
+            data = sentinelutils.get_relation_data(self.config)
+        expected_data = {
+            'sentinel-master': 'redis1',
+            'sentinels': '1.2.3.4:26379 1.2.3.5:26379 1.2.3.6:26379',
+        }
+        self.assertEqual(expected_data, data)
+
+    def test_get_relation_data_error(self):
+        with patch_client() as mock_client:
+            mock_client.side_effect = redisclient.RedisError('bad wolf')
+            data = sentinelutils.get_relation_data(self.config)
+        self.assertEqual('1.2.3.4:26379', data['sentinels'])
+
+    def test_get_master_name_slave(self):
+        slave_relation = make_slave_relation({'master-name': 'redis2'})
+        self.assertEqual(
+            'redis2', sentinelutils.get_master_name(slave_relation))
+
+
+class TestIsEnabled(unittest.TestCase):
+
+    def test_enabled(self):
+        config = {'cluster-enabled': False, 'sentinel-enabled': True}
+        self.assertTrue(sentinelutils.is_enabled(config))
+
+    def test_cluster(self):
+        config = {'cluster-enabled': True, 'sentinel-enabled': True}
+        self.assertFalse(sentinelutils.is_enabled(config))
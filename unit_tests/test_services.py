@@ -17,13 +17,84 @@ import services
 @mock.patch('charmhelpers.core.hookenv.log', mock.Mock())
 @mock.patch('charmhelpers.core.hookenv.relation_ids', mock.MagicMock())
 @mock.patch('charmhelpers.core.hookenv.config')
+@mock.patch('restartutils.setup', mock.Mock())
+@mock.patch('replicationutils.setup', mock.Mock())
+@mock.patch('upgradeutils.setup', mock.Mock())
 @mock.patch('charmhelpers.core.services.base.ServiceManager')
 class TestManage(unittest.TestCase):
 
     def test_services(self, mock_manager, mock_config):
+        data = {'cluster-enabled': False, 'instances': 2, 'port': 4242}
+        mock_config.return_value = mock.MagicMock(
+            __getitem__=lambda self, key: data[key])
+        mock_config.return_value.previous.return_value = None
         services.manage()
         self.assertEqual(1, mock_manager.call_count)
         definitions = mock_manager.call_args[0][0]
         service_names = [i['service'] for i in definitions]
         self.assertEqual(['redis-master', 'redis-slave'], service_names)
         mock_config.assert_called_once_with()
+        for definition in definitions:
+            self.assertEqual([4242, 4243], definition['ports'])
+
+
+@mock.patch('hookutils.log', mock.Mock())
+@mock.patch('restartutils.setup', mock.Mock())
+@mock.patch('replicationutils.setup', mock.Mock())
+@mock.patch('upgradeutils.setup', mock.Mock())
+@mock.patch('charmhelpers.core.hookenv._run_atstart', mock.Mock())
+@mock.patch('charmhelpers.core.hookenv._run_atexit', mock.Mock())
+@mock.patch('charmhelpers.core.hookenv.charm_dir',
+            mock.Mock(return_value='/path/to/charm'))
+@mock.patch('charmhelpers.core.hookenv.relation_id',
+            mock.Mock(return_value='db:42'))
+@mock.patch('charmhelpers.core.hookenv.relation_ids',
+            mock.Mock(return_value=['db:1', 'db:42']))
+@mock.patch('charmhelpers.core.hookenv.related_units',
+            mock.Mock(return_value=['app/0']))
+@mock.patch('charmhelpers.core.hookenv.relation_set_changed')
+@mock.patch(
+    'charmhelpers.core.services.base.ServiceManager.reconfigure_services')
+class TestManageProviderHooks(unittest.TestCase):
+
+    def manage(self, hook_name):
+        """Run the manage function in the given hook.
+
+        Return the mock db relation context class.
+        """
+        mock_relation = mock.Mock()
+        mock_relation.return_value.name = 'db'
+        mock_relation.return_value.provide_data.return_value = {'port': 4242}
+        with mock.patch('charmhelpers.core.hookenv.hook_name',
+                        mock.Mock(return_value=hook_name)):
+            with mock.patch.dict(
+                    services.PROVIDER_RELATIONS, {'db': mock_relation}):
+                services.manage()
+        return mock_relation
+
+    def test_changed(self, mock_reconfigure, mock_relation_set_changed):
+        mock_relation = self.manage('db-relation-changed')
+        self.assertFalse(mock_reconfigure.called)
+        mock_relation.assert_called_once_with(get_data=False)
+        # Data is only provided on the relation of the current hook.
+        mock_relation_set_changed.assert_called_once_with(
+            'db:42', {'port': 4242})
+
+    def test_departed(self, mock_reconfigure, mock_relation_set_changed):
+        self.manage('db-relation-departed')
+        self.assertFalse(mock_reconfigure.called)
+        self.assertFalse(mock_relation_set_changed.called)
+
+    def test_other_relation(self, mock_reconfigure, mock_relation_set_changed):
+        data = {'cluster-enabled': False, 'instances': 1, 'port': 4242}
+        with mock.patch('charmhelpers.core.hookenv.config') as mock_config:
+            mock_config.return_value = mock.MagicMock(
+                __getitem__=lambda self, key: data[key])
+            mock_config.return_value.previous.return_value = None
+            with mock.patch('charmhelpers.core.hookenv.relation_ids',
+                            mock.MagicMock()):
+                with mock.patch(
+                        'charmhelpers.core.services.base.ServiceManager'
+                ) as mock_manager:
+                    self.manage('master-relation-changed')
+        mock_manager.return_value.manage.assert_called_once_with()
@@ -11,6 +11,9 @@ import mock
 # Allow importing modules and packages from the hooks directory.
 sys.path.append(resource_filename(__name__, '../hooks'))
 
+import instanceutils
+import redisclient
+import replicationutils
 import serviceutils
 import settings
 
@@ -46,7 +49,10 @@ class TestServiceStart(unittest.TestCase):
             mock_service_start):
         port, previous_port = 6379, None
         with patch_service_running(False):
-            serviceutils.service_start(port, previous_port, self.service_name)
+            serviceutils.service_start(
+                instanceutils.get_instances(port, 1),
+                instanceutils.get_instances(previous_port, 1),
+                self.service_name)
         mock_service_start.assert_called_once_with(settings.SERVICE_NAME)
         mock_log.assert_called_once_with(
             'Starting service {}.'.format(self.service_name))
@@ -58,7 +64,10 @@ class TestServiceStart(unittest.TestCase):
             mock_service_start):
         port, previous_port = 6379, None
         with patch_service_running(True):
-            serviceutils.service_start(port, previous_port, self.service_name)
+            serviceutils.service_start(
+                instanceutils.get_instances(port, 1),
+                instanceutils.get_instances(previous_port, 1),
+                self.service_name)
         self.assertFalse(mock_service_start.called)
         self.assertFalse(mock_log.called)
         mock_open_port.assert_called_once_with(port)
@@ -69,12 +78,59 @@ class TestServiceStart(unittest.TestCase):
             mock_service_start):
         port, previous_port = 4242, 6379
         with patch_service_running(True):
-            serviceutils.service_start(port, previous_port, self.service_name)
+            serviceutils.service_start(
+                instanceutils.get_instances(port, 1),
+                instanceutils.get_instances(previous_port, 1),
+                self.service_name)
         self.assertFalse(mock_service_start.called)
         self.assertFalse(mock_log.called)
         mock_open_port.assert_called_once_with(port)
         mock_close_port.assert_called_once_with(previous_port)
 
+    def test_multiple_instances(
+            self, mock_log, mock_close_port, mock_open_port,
+            mock_service_start):
+        instances = instanceutils.get_instances(6379, 2)
+        with patch_service_running(False):
+            with mock.patch('charmhelpers.core.host.service') as mock_service:
+                serviceutils.service_start(
+                    instances, instances, self.service_name)
+        mock_service_start.assert_has_calls([
+            mock.call(settings.SERVICE_NAME),
+            mock.call('redis-server@1'),
+        ])
+        mock_service.assert_called_once_with('enable', 'redis-server@1')
+        mock_log.assert_has_calls([
+            mock.call('Starting service {}.'.format(self.service_name)),
+            mock.call('Starting service {} instance 1.'.format(
+                self.service_name)),
+        ])
+        mock_open_port.assert_has_calls([mock.call(6379), mock.call(6380)])
+        self.assertFalse(mock_close_port.called)
+
+    def test_removed_instances(
+            self, mock_log, mock_close_port, mock_open_port,
+            mock_service_start):
+        instances = instanceutils.get_instances(6379, 1)
+        previous_instances = instanceutils.get_instances(6379, 3)
+        with patch_service_running(True):
+            with mock.patch('charmhelpers.core.host.service') as mock_service:
+                with mock.patch(
+                        'charmhelpers.core.host.service_stop') as mock_stop:
+                    serviceutils.service_start(
+                        instances, previous_instances, self.service_name)
+        self.assertFalse(mock_service_start.called)
+        mock_stop.assert_has_calls([
+            mock.call('redis-server@1'),
+            mock.call('redis-server@2'),
+        ])
+        mock_service.assert_has_calls([
+            mock.call('disable', 'redis-server@1'),
+            mock.call('disable', 'redis-server@2'),
+        ])
+        mock_open_port.assert_called_once_with(6379)
+        mock_close_port.assert_has_calls([mock.call(6380), mock.call(6381)])
+
 
 @mock.patch('charmhelpers.fetch.apt_purge')
 @mock.patch('charmhelpers.core.host.service_stop')
@@ -82,6 +138,7 @@ class TestServiceStart(unittest.TestCase):
 @mock.patch('hookutils.log')
 class TestServiceStop(unittest.TestCase):
 
+    config = {'keep-data-on-stop': False, 'password': ''}
     service_name = 'myservice'
     port = 6379
 
@@ -90,7 +147,9 @@ class TestServiceStop(unittest.TestCase):
             mock_apt_purge):
         with patch_service_running(True):
             with patch_hook_name('stop'):
-                serviceutils.service_stop(self.port, self.service_name)
+                serviceutils.service_stop(
+                    self.config, instanceutils.get_instances(self.port, 1),
+                    self.service_name)
         mock_service_stop.assert_called_once_with(settings.SERVICE_NAME)
         self.assertEqual(2, mock_log.call_count)
         mock_log.assert_has_calls([
@@ -104,7 +163,9 @@ class TestServiceStop(unittest.TestCase):
             mock_apt_purge):
         with patch_service_running(False):
             with patch_hook_name('stop'):
-                serviceutils.service_stop(self.port, self.service_name)
+                serviceutils.service_stop(
+                    self.config, instanceutils.get_instances(self.port, 1),
+                    self.service_name)
         self.assertFalse(mock_service_stop.called)
         mock_close_port.assert_called_once_with(self.port)
 
@@ -114,7 +175,9 @@ class TestServiceStop(unittest.TestCase):
         port = 4747
         with patch_service_running(False):
             with patch_hook_name('stop'):
-                serviceutils.service_stop(port, self.service_name)
+                serviceutils.service_stop(
+                    self.config, instanceutils.get_instances(port, 1),
+                    self.service_name)
         mock_close_port.assert_called_once_with(port)
 
     def test_cleaning_up(
@@ -123,16 +186,75 @@ class TestServiceStop(unittest.TestCase):
         port = 4747
         with patch_service_running(False):
             with patch_hook_name('stop'):
-                serviceutils.service_stop(port, self.service_name)
+                serviceutils.service_stop(
+                    self.config, instanceutils.get_instances(port, 1),
+                    self.service_name)
         mock_log.assert_called_once_with('Removing system packages.')
-        mock_apt_purge.assert_called_once_with(settings.PACKAGES)
+        mock_apt_purge.assert_called_once_with(
+            settings.PACKAGES + [settings.SENTINEL_PACKAGE])
+
+    def test_keep_data(
+            self, mock_log, mock_close_port, mock_service_stop,
+            mock_apt_purge):
+        config = {'keep-data-on-stop': True, 'password': 'secret!'}
+        with patch_service_running(True):
+            with patch_hook_name('stop'):
+                with mock.patch('charmhelpers.core.hookenv.unit_private_ip',
+                                mock.Mock(return_value='1.2.3.4')):
+                    with mock.patch('redisclient.Client') as mock_client:
+                        serviceutils.service_stop(
+                            config, instanceutils.get_instances(self.port, 1),
+                            self.service_name)
+        mock_client.assert_called_once_with(
+            '1.2.3.4', self.port, password='secret!',
+            timeout=settings.SAVE_TIMEOUT)
+        client = mock_client.return_value.__enter__.return_value
+        client.execute.assert_called_once_with('SAVE')
+        mock_service_stop.assert_called_once_with(settings.SERVICE_NAME)
+        mock_close_port.assert_called_once_with(self.port)
+        self.assertFalse(mock_apt_purge.called)
+
+    def test_keep_data_save_error(
+            self, mock_log, mock_close_port, mock_service_stop,
+            mock_apt_purge):
+        config = {'keep-data-on-stop': True, 'password': ''}
+        error = redisclient.RedisError('bad wolf')
+        with patch_service_running(True):
+            with patch_hook_name('stop'):
+                with mock.patch('charmhelpers.core.hookenv.unit_private_ip',
+                                mock.Mock(return_value='1.2.3.4')):
+                    with mock.patch('redisclient.Client', side_effect=error):
+                        serviceutils.service_stop(
+                            config, instanceutils.get_instances(self.port, 1),
+                            self.service_name)
+        mock_log.assert_any_call('Cannot save the dataset: bad wolf.')
+        mock_service_stop.assert_called_once_with(settings.SERVICE_NAME)
+
+    def test_multiple_instances(
+            self, mock_log, mock_close_port, mock_service_stop,
+            mock_apt_purge):
+        with patch_service_running(True):
+            with patch_hook_name('stop'):
+                serviceutils.service_stop(
+                    self.config, instanceutils.get_instances(self.port, 2),
+                    self.service_name)
+        mock_service_stop.assert_has_calls([
+            mock.call(settings.SERVICE_NAME),
+            mock.call('redis-server@1'),
+        ])
+        mock_close_port.assert_has_calls([
+            mock.call(self.port),
+            mock.call(self.port + 1),
+        ])
 
     def test_service_running_other_hook(
             self, mock_log, mock_close_port, mock_service_stop,
             mock_apt_purge):
         with patch_service_running(True):
             with patch_hook_name('config-changed'):
-                serviceutils.service_stop(self.port, self.service_name)
+                serviceutils.service_stop(
+                    self.config, instanceutils.get_instances(self.port, 1),
+                    self.service_name)
         self.assertFalse(mock_service_stop.called)
         self.assertFalse(mock_log.called)
         self.assertFalse(mock_close_port.called)
@@ -143,7 +265,9 @@ class TestServiceStop(unittest.TestCase):
             mock_apt_purge):
         with patch_service_running(False):
             with patch_hook_name('config-changed'):
-                serviceutils.service_stop(self.port, self.service_name)
+                serviceutils.service_stop(
+                    self.config, instanceutils.get_instances(self.port, 1),
+                    self.service_name)
         self.assertFalse(mock_service_stop.called)
         self.assertFalse(mock_log.called)
         self.assertFalse(mock_close_port.called)
@@ -160,23 +284,40 @@ def make_relation(data):
     return relation
 
 
-class TestWriteConfigFile(unittest.TestCase):
+class WriteConfigFileMixin(object):
 
     @contextlib.contextmanager
-    def patch_all(self, configuration_changed=False):
+    def patch_all(
+            self, configuration_changed=False, previous_options=None,
+            running=True, version='5:6.0.16-1ubuntu1', restarted=False):
         """Mock all the external functions used by write_config_file."""
         mocks = {
+            'client': mock.patch('redisclient.Client'),
+            'is_fresh': mock.patch(
+                'replicationutils.is_fresh', mock.Mock(return_value=True)),
+            'get_installed_version': mock.patch(
+                'charmhelpers.fetch.get_installed_version',
+                mock.Mock(return_value=mock.Mock(ver_str=version))),
             'log': mock.patch('hookutils.log'),
+            'read': mock.patch(
+                'configfile.read',
+                mock.Mock(return_value=previous_options or {})),
             'relation_ids': mock.patch(
                 'charmhelpers.core.hookenv.relation_ids',
                 mock.Mock(return_value=['rel-id'])),
-            'relation_set': mock.patch(
-                'charmhelpers.core.hookenv.relation_set'),
+            'relation_set_changed': mock.patch(
+                'charmhelpers.core.hookenv.relation_set_changed'),
+            'restart': mock.patch(
+                'restartutils.restart', mock.Mock(return_value=restarted)),
             'service_restart': mock.patch(
                 'charmhelpers.core.host.service_restart'),
+            'service_running': mock.patch(
+                'charmhelpers.core.host.service_running',
+                mock.Mock(return_value=running)),
             'unit_get': mock.patch(
                 'charmhelpers.core.hookenv.unit_get',
                 mock.Mock(return_value='1.2.3.4')),
+            'wait_until_ready': mock.patch('restartutils.wait_until_ready'),
             'write': mock.patch(
                 'configfile.write',
                 mock.Mock(return_value=configuration_changed))
@@ -188,30 +329,64 @@ class TestWriteConfigFile(unittest.TestCase):
             object_dict = dict(zip(mocks.keys(), context_managers))
             yield type('Mocks', (object,), object_dict)
 
+    def assert_restarted(self, mocks, *service_names):
+        """Check that the given services are restarted one unit at a time."""
+        self.assertFalse(mocks.service_restart.called)
+        mocks.restart.assert_called_once_with(
+            list(service_names), mock.ANY, mock.ANY)
+
+
+class TestWriteConfigFile(WriteConfigFileMixin, unittest.TestCase):
+
     def test_configuration_changed(self):
         config = {
+            'appendfsync': 'everysec',
+            'cluster-enabled': False,
             'databases': 16,
+            'instances': 1,
+            'io-threads': '1',
+            'io-threads-do-reads': False,
+            'kernel-tuning': False,
             'logfile': '/path/to/logfile',
             'loglevel': 'debug',
+            'maxmemory': '',
+            'maxmemory-policy': 'noeviction',
+            'no-appendfsync-on-rewrite': False,
             'password': '',
+            'peer-replication': False,
+            'persistence': 'none',
             'port': 4242,
+            'repl-backlog-seconds': 60,
+            'repl-backlog-size': '',
+            'repl-diskless-load': 'disabled',
+            'repl-diskless-sync': False,
+            'repl-diskless-sync-delay': 5,
+            'replica-lazy-flush': False,
+            'sentinel-enabled': False,
+            'sync-batch-size': 0,
+            'tcp-backlog': 511,
             'tcp-keepalive': 0,
             'timeout': 0,
+            'unixsocket': '',
         }
         callback = serviceutils.write_config_file(config)
         with self.patch_all(configuration_changed=True) as mocks:
             callback('foo')
         mocks.write.assert_called_once_with({
+            'appendonly': 'no',
             'bind': '1.2.3.4',
             'databases': 16,
             'logfile': '/path/to/logfile',
             'loglevel': 'debug',
             'port': 4242,
+            'repl-diskless-sync': 'no',
+            'repl-diskless-sync-delay': 5,
+            'save': ['""'],
             'tcp-keepalive': 0,
             'timeout': 0,
         }, settings.REDIS_CONF)
         mocks.unit_get.assert_called_once_with('private-address')
-        mocks.service_restart.assert_called_once_with(settings.SERVICE_NAME)
+        self.assert_restarted(mocks, settings.SERVICE_NAME)
         self.assertEqual(3, mocks.log.call_count)
         mocks.log.assert_has_calls([
             mock.call('Retrieving service options.'),
@@ -221,39 +396,85 @@ class TestWriteConfigFile(unittest.TestCase):
 
     def test_configuration_changed_password(self):
         config = {
+            'appendfsync': 'everysec',
+            'cluster-enabled': False,
             'databases': 3,
+            'instances': 1,
+            'io-threads': '1',
+            'io-threads-do-reads': False,
+            'kernel-tuning': False,
             'logfile': '/path/to/logfile',
             'loglevel': 'debug',
+            'maxmemory': '',
+            'maxmemory-policy': 'noeviction',
+            'no-appendfsync-on-rewrite': False,
             'password': 'secret!',
+            'peer-replication': False,
+            'persistence': 'none',
             'port': 4242,
+            'repl-backlog-seconds': 60,
+            'repl-backlog-size': '',
+            'repl-diskless-load': 'disabled',
+            'repl-diskless-sync': False,
+            'repl-diskless-sync-delay': 5,
+            'replica-lazy-flush': False,
+            'sentinel-enabled': False,
+            'sync-batch-size': 0,
+            'tcp-backlog': 511,
             'tcp-keepalive': 10,
             'timeout': 42,
+            'unixsocket': '',
         }
         callback = serviceutils.write_config_file(config)
         with self.patch_all(configuration_changed=True) as mocks:
             callback('foo')
         mocks.write.assert_called_once_with({
+            'appendonly': 'no',
             'bind': '1.2.3.4',
             'databases': 3,
             'logfile': '/path/to/logfile',
             'loglevel': 'debug',
             'port': 4242,
             'requirepass': 'secret!',
+            'repl-diskless-sync': 'no',
+            'repl-diskless-sync-delay': 5,
+            'save': ['""'],
             'tcp-keepalive': 10,
             'timeout': 42,
         }, settings.REDIS_CONF)
         mocks.unit_get.assert_called_once_with('private-address')
-        mocks.service_restart.assert_called_once_with(settings.SERVICE_NAME)
+        self.assert_restarted(mocks, settings.SERVICE_NAME)
 
     def test_configuration_changed_relations(self):
         config = {
+            'appendfsync': 'everysec',
+            'cluster-enabled': False,
             'databases': 16,
+            'instances': 1,
+            'io-threads': '1',
+            'io-threads-do-reads': False,
+            'kernel-tuning': False,
             'logfile': '/path/to/logfile',
             'loglevel': 'debug',
+            'maxmemory': '',
+            'maxmemory-policy': 'noeviction',
+            'no-appendfsync-on-rewrite': False,
             'password': 'secret!',
+            'peer-replication': False,
+            'persistence': 'none',
             'port': 4242,
+            'repl-backlog-seconds': 60,
+            'repl-backlog-size': '',
+            'repl-diskless-load': 'disabled',
+            'repl-diskless-sync': False,
+            'repl-diskless-sync-delay': 5,
+            'replica-lazy-flush': False,
+            'sentinel-enabled': False,
+            'sync-batch-size': 0,
+            'tcp-backlog': 511,
             'tcp-keepalive': 0,
             'timeout': 0,
+            'unixsocket': '',
         }
         data = {
             'hostname': '4.3.2.1',
@@ -265,39 +486,68 @@ class TestWriteConfigFile(unittest.TestCase):
         with self.patch_all(configuration_changed=True) as mocks:
             callback('foo')
         mocks.write.assert_called_once_with({
+            'appendonly': 'no',
             'bind': '1.2.3.4',
             'databases': 16,
             'logfile': '/path/to/logfile',
             'loglevel': 'debug',
             'port': 4242,
             'requirepass': 'secret!',
+            'repl-diskless-sync': 'no',
+            'repl-diskless-sync-delay': 5,
+            'save': ['""'],
             'tcp-keepalive': 0,
             'timeout': 0,
         }, settings.REDIS_CONF)
         mocks.unit_get.assert_called_once_with('private-address')
-        mocks.service_restart.assert_called_once_with(settings.SERVICE_NAME)
+        self.assert_restarted(mocks, settings.SERVICE_NAME)
         mocks.relation_ids.assert_called_once_with('testing')
-        mocks.relation_set.assert_called_once_with('rel-id', data)
+        mocks.relation_set_changed.assert_called_once_with('rel-id', data)
 
     def test_configuration_unchanged_master(self):
         config = {
+            'appendfsync': 'everysec',
+            'cluster-enabled': False,
             'databases': 3,
+            'instances': 1,
+            'io-threads': '1',
+            'io-threads-do-reads': False,
+            'kernel-tuning': False,
             'logfile': '/path/to/logfile',
             'loglevel': 'debug',
+            'maxmemory': '',
+            'maxmemory-policy': 'noeviction',
+            'no-appendfsync-on-rewrite': False,
             'password': '',
+            'peer-replication': False,
+            'persistence': 'none',
             'port': 4242,
+            'repl-backlog-seconds': 60,
+            'repl-backlog-size': '',
+            'repl-diskless-load': 'disabled',
+            'repl-diskless-sync': False,
+            'repl-diskless-sync-delay': 5,
+            'replica-lazy-flush': False,
+            'sentinel-enabled': False,
+            'sync-batch-size': 0,
+            'tcp-backlog': 511,
             'tcp-keepalive': 60,
             'timeout': 10,
+            'unixsocket': '',
         }
         callback = serviceutils.write_config_file(config)
         with self.patch_all() as mocks:
             callback('foo')
         mocks.write.assert_called_once_with({
+            'appendonly': 'no',
             'bind': '1.2.3.4',
             'databases': 3,
             'logfile': '/path/to/logfile',
             'loglevel': 'debug',
             'port': 4242,
+            'repl-diskless-sync': 'no',
+            'repl-diskless-sync-delay': 5,
+            'save': ['""'],
             'tcp-keepalive': 60,
             'timeout': 10,
         }, settings.REDIS_CONF)
@@ -310,15 +560,77 @@ class TestWriteConfigFile(unittest.TestCase):
             mock.call('No changes detected in the configuration file.')
         ])
 
+    def test_pending_restart_performed(self):
+        config = {
+            'appendfsync': 'everysec',
+            'cluster-enabled': False,
+            'databases': 3,
+            'instances': 1,
+            'io-threads': '1',
+            'io-threads-do-reads': False,
+            'kernel-tuning': False,
+            'logfile': '/path/to/logfile',
+            'loglevel': 'debug',
+            'maxmemory': '',
+            'maxmemory-policy': 'noeviction',
+            'no-appendfsync-on-rewrite': False,
+            'password': '',
+            'peer-replication': False,
+            'persistence': 'none',
+            'port': 4242,
+            'repl-backlog-seconds': 60,
+            'repl-backlog-size': '',
+            'repl-diskless-load': 'disabled',
+            'repl-diskless-sync': False,
+            'repl-diskless-sync-delay': 5,
+            'replica-lazy-flush': False,
+            'sentinel-enabled': False,
+            'sync-batch-size': 0,
+            'tcp-backlog': 511,
+            'tcp-keepalive': 60,
+            'timeout': 10,
+            'unixsocket': '',
+        }
+        data = {'hostname': '1.2.3.4', 'port': 4242}
+        callback = serviceutils.write_config_file(
+            config, db_relation=make_relation(data))
+        with self.patch_all(restarted=True) as mocks:
+            callback('foo')
+        # A restart requested in a previous hook has been performed, so the
+        # relation data is updated right away.
+        mocks.restart.assert_called_once_with([], mock.ANY, mock.ANY)
+        mocks.relation_set_changed.assert_called_once_with('rel-id', data)
+
     def test_configuration_unchanged_slave(self):
         config = {
+            'appendfsync': 'everysec',
+            'cluster-enabled': False,
             'databases': 10,
+            'instances': 1,
+            'io-threads': '1',
+            'io-threads-do-reads': False,
+            'kernel-tuning': False,
             'logfile': '/path/to/logs',
             'loglevel': 'info',
+            'maxmemory': '',
+            'maxmemory-policy': 'noeviction',
+            'no-appendfsync-on-rewrite': False,
             'password': '   ',
+            'peer-replication': False,
+            'persistence': 'none',
             'port': 4242,
+            'repl-backlog-seconds': 60,
+            'repl-backlog-size': '',
+            'repl-diskless-load': 'disabled',
+            'repl-diskless-sync': False,
+            'repl-diskless-sync-delay': 5,
+            'replica-lazy-flush': False,
+            'sentinel-enabled': False,
+            'sync-batch-size': 0,
+            'tcp-backlog': 511,
             'tcp-keepalive': 0,
             'timeout': 0,
+            'unixsocket': '',
         }
         slave_relation = make_relation({
             'hostname': '4.3.2.1',
@@ -329,11 +641,17 @@ class TestWriteConfigFile(unittest.TestCase):
         with self.patch_all() as mocks:
             callback('foo')
         mocks.write.assert_called_once_with({
+            'appendonly': 'no',
             'bind': '1.2.3.4',
             'databases': 10,
             'logfile': '/path/to/logs',
             'loglevel': 'info',
             'port': 4242,
+            'repl-diskless-load': 'disabled',
+            'repl-diskless-sync': 'no',
+            'repl-diskless-sync-delay': 5,
+            'replica-lazy-flush': 'no',
+            'save': ['""'],
             'slaveof': '4.3.2.1 4747',
             'tcp-keepalive': 0,
             'timeout': 0,
@@ -350,24 +668,49 @@ class TestWriteConfigFile(unittest.TestCase):
 
     def test_configuration_unchanged_master_password(self):
         config = {
+            'appendfsync': 'everysec',
+            'cluster-enabled': False,
             'databases': 16,
+            'instances': 1,
+            'io-threads': '1',
+            'io-threads-do-reads': False,
+            'kernel-tuning': False,
             'logfile': '/path/to/logfile',
             'loglevel': 'debug',
+            'maxmemory': '',
+            'maxmemory-policy': 'noeviction',
+            'no-appendfsync-on-rewrite': False,
             'password': 'secret!',
+            'peer-replication': False,
+            'persistence': 'none',
             'port': 42,
+            'repl-backlog-seconds': 60,
+            'repl-backlog-size': '',
+            'repl-diskless-load': 'disabled',
+            'repl-diskless-sync': False,
+            'repl-diskless-sync-delay': 5,
+            'replica-lazy-flush': False,
+            'sentinel-enabled': False,
+            'sync-batch-size': 0,
+            'tcp-backlog': 511,
             'tcp-keepalive': 0,
             'timeout': 0,
+            'unixsocket': '',
         }
         callback = serviceutils.write_config_file(config)
         with self.patch_all() as mocks:
             callback('foo')
         mocks.write.assert_called_once_with({
+            'appendonly': 'no',
             'bind': '1.2.3.4',
             'databases': 16,
             'logfile': '/path/to/logfile',
             'loglevel': 'debug',
             'port': 42,
             'requirepass': 'secret!',
+            'repl-diskless-sync': 'no',
+            'repl-diskless-sync-delay': 5,
+            'save': ['""'],
             'tcp-keepalive': 0,
             'timeout': 0,
         }, settings.REDIS_CONF)
@@ -376,13 +719,34 @@ class TestWriteConfigFile(unittest.TestCase):
 
     def test_configuration_unchanged_slave_password(self):
         config = {
+            'appendfsync': 'everysec',
+            'cluster-enabled': False,
             'databases': 15,
+            'instances': 1,
+            'io-threads': '1',
+            'io-threads-do-reads': False,
+            'kernel-tuning': False,
             'logfile': '/path/to/logs',
             'loglevel': 'info',
+            'maxmemory': '',
+            'maxmemory-policy': 'noeviction',
+            'no-appendfsync-on-rewrite': False,
             'password': '',
+            'peer-replication': False,
+            'persistence': 'none',
             'port': 4242,
+            'repl-backlog-seconds': 60,
+            'repl-backlog-size': '',
+            'repl-diskless-load': 'disabled',
+            'repl-diskless-sync': False,
+            'repl-diskless-sync-delay': 5,
+            'replica-lazy-flush': False,
+            'sentinel-enabled': False,
+            'sync-batch-size': 0,
+            'tcp-backlog': 511,
             'tcp-keepalive': 0,
             'timeout': 0,
+            'unixsocket': '',
         }
         slave_relation = make_relation({
             'hostname': '4.3.2.1',
@@ -394,15 +758,659 @@ class TestWriteConfigFile(unittest.TestCase):
         with self.patch_all() as mocks:
             callback('foo')
         mocks.write.assert_called_once_with({
+            'appendonly': 'no',
             'bind': '1.2.3.4',
             'databases': 15,
             'logfile': '/path/to/logs',
             'loglevel': 'info',
             'masterauth': 'sercret!',
             'port': 4242,
+            'repl-diskless-load': 'disabled',
+            'repl-diskless-sync': 'no',
+            'repl-diskless-sync-delay': 5,
+            'replica-lazy-flush': 'no',
+            'save': ['""'],
             'slaveof': '4.3.2.1 90',
             'tcp-keepalive': 0,
             'timeout': 0,
         }, settings.REDIS_CONF)
         mocks.unit_get.assert_called_once_with('private-address')
         self.assertFalse(mocks.service_restart.called)
+
+
+class TestWriteConfigFileRuntimeChanges(
+        WriteConfigFileMixin, unittest.TestCase):
+
+    config = {
+        'appendfsync': 'everysec',
+        'cluster-enabled': False,
+        'databases': 16,
+        'instances': 1,
+        'io-threads': '1',
+        'io-threads-do-reads': False,
+        'kernel-tuning': False,
+        'logfile': '/path/to/logfile',
+        'loglevel': 'notice',
+        'maxmemory': '',
+        'maxmemory-policy': 'noeviction',
+        'no-appendfsync-on-rewrite': False,
+        'password': '',
+        'peer-replication': False,
+        'persistence': 'none',
+        'port': 4242,
+        'repl-backlog-seconds': 60,
+        'repl-backlog-size': '',
+        'repl-diskless-load': 'disabled',
+        'repl-diskless-sync': False,
+        'repl-diskless-sync-delay': 5,
+        'replica-lazy-flush': False,
+        'sentinel-enabled': False,
+        'sync-batch-size': 0,
+        'tcp-backlog': 511,
+        'tcp-keepalive': 0,
+        'timeout': 0,
+        'unixsocket': '',
+    }
+    previous_options = {
+        'appendonly': 'no',
+        'bind': '1.2.3.4',
+        'databases': '16',
+        'logfile': '/path/to/logfile',
+        'loglevel': 'notice',
+        'port': '4242',
+        'repl-diskless-sync': 'no',
+        'repl-diskless-sync-delay': '5',
+        'requirepass': 'secret!',
+        'save': '""',
+        'tcp-keepalive': '0',
+        'timeout': '0',
+    }
+
+    def get_client(self, mocks):
+        """Return the mock redis client used in the callback."""
+        return mocks.client.return_value.__enter__.return_value
+
+    def test_runtime_changes(self):
+        config = dict(self.config, loglevel='debug', timeout=42)
+        callback = serviceutils.write_config_file(config)
+        with self.patch_all(
+                configuration_changed=True,
+                previous_options=self.previous_options) as mocks:
+            callback('foo')
+        self.assertFalse(mocks.service_restart.called)
+        mocks.client.assert_called_once_with(
+            '1.2.3.4', '4242', password='secret!')
+        self.get_client(mocks).execute.assert_has_calls([
+            mock.call('CONFIG', 'SET', 'loglevel', 'debug'),
+            mock.call('CONFIG', 'SET', 'requirepass', ''),
+            mock.call('CONFIG', 'SET', 'timeout', '42'),
+        ])
+        mocks.log.assert_has_calls([
+            mock.call('Applying configuration changes at runtime.'),
+        ])
+
+    def test_restart_required(self):
+        config = dict(self.config, databases=3, timeout=42)
+        callback = serviceutils.write_config_file(config)
+        with self.patch_all(
+                configuration_changed=True,
+                previous_options=self.previous_options) as mocks:
+            callback('foo')
+        self.assertFalse(mocks.client.called)
+        self.assert_restarted(mocks, settings.SERVICE_NAME)
+        endpoints, running_endpoints = mocks.restart.call_args[0][1:]
+        self.assertEqual(
+            {settings.SERVICE_NAME: ('1.2.3.4', 4242, None)}, endpoints)
+        # The running server is shut down using the previous password.
+        self.assertEqual(
+            {settings.SERVICE_NAME: ('1.2.3.4', 4242, 'secret!')},
+            running_endpoints)
+        mocks.log.assert_has_calls([
+            mock.call('Option databases cannot be changed at runtime.'),
+            mock.call('Restarting service due to configuration change.'),
+        ])
+
+    def test_service_not_running(self):
+        callback = serviceutils.write_config_file(self.config)
+        with self.patch_all(
+                configuration_changed=True,
+                previous_options=self.previous_options,
+                running=False) as mocks:
+            callback('foo')
+        self.assertFalse(mocks.client.called)
+        mocks.service_restart.assert_called_once_with(settings.SERVICE_NAME)
+
+    def test_runtime_error(self):
+        callback = serviceutils.write_config_file(self.config)
+        with self.patch_all(
+                configuration_changed=True,
+                previous_options=self.previous_options) as mocks:
+            self.get_client(mocks).execute.side_effect = (
+                redisclient.RedisError('bad wolf'))
+            callback('foo')
+        self.assert_restarted(mocks, settings.SERVICE_NAME)
+        mocks.log.assert_has_calls([
+            mock.call('Cannot apply changes at runtime: bad wolf.'),
+            mock.call('Restarting service due to configuration change.'),
+        ])
+
+    def test_runtime_repeated_options(self):
+        config = dict(self.config, password='secret!', persistence='rdb')
+        callback = serviceutils.write_config_file(config)
+        with self.patch_all(
+                configuration_changed=True,
+                previous_options=self.previous_options) as mocks:
+            callback('foo')
+        self.assertFalse(mocks.service_restart.called)
+        self.get_client(mocks).execute.assert_has_calls([
+            mock.call('CONFIG', 'SET', 'rdb-save-incremental-fsync', 'yes'),
+            mock.call('CONFIG', 'SET', 'save', '900 1 300 10 60 10000'),
+        ])
+
+    def test_slaveof_already_applied(self):
+        slave_relation = make_relation({'hostname': '4.3.2.1', 'port': 90})
+        callback = serviceutils.write_config_file(
+            self.config, slave_relation=slave_relation)
+        with self.patch_all(
+                configuration_changed=True,
+                previous_options=self.previous_options) as mocks:
+            self.get_client(mocks).execute.return_value = (
+                '# Replication\r\nrole:slave\r\nmaster_host:4.3.2.1\r\n'
+                'master_port:90\r\n')
+            callback('foo')
+        self.assertFalse(mocks.service_restart.called)
+        self.get_client(mocks).execute.assert_has_calls([
+            mock.call('INFO', 'replication'),
+        ])
+
+    def test_slaveof_changed(self):
+        slave_relation = make_relation({
+            'hostname': '4.3.2.1', 'password': 'secret!', 'port': 90})
+        previous_options = dict(self.previous_options, **{
+            'repl-diskless-load': 'disabled',
+            'replica-lazy-flush': 'no',
+            'slaveof': '4.3.2.2 90',
+        })
+        config = dict(self.config, password='secret!')
+        callback = serviceutils.write_config_file(
+            config, slave_relation=slave_relation)
+        with self.patch_all(
+                configuration_changed=True,
+                previous_options=previous_options) as mocks:
+            self.get_client(mocks).execute.return_value = (
+                '# Replication\r\nrole:slave\r\nmaster_host:4.3.2.2\r\n'
+                'master_port:90\r\n')
+            callback('foo')
+        self.assertFalse(mocks.service_restart.called)
+        mocks.restart.assert_called_once_with([], mock.ANY, mock.ANY)
+        # The authentication is set up before switching to the new master.
+        self.get_client(mocks).execute.assert_has_calls([
+            mock.call('CONFIG', 'SET', 'masterauth', 'secret!'),
+            mock.call('INFO', 'replication'),
+            mock.call('REPLICAOF', '4.3.2.1', '90'),
+        ])
+        # Switching master is not an initial sync.
+        self.assertFalse(mocks.wait_until_ready.called)
+        mocks.log.assert_has_calls([
+            mock.call('Replicating 4.3.2.1 90 at runtime.'),
+        ])
+
+    def test_slaveof_removed(self):
+        previous_options = dict(
+            self.previous_options, slaveof='4.3.2.1 90')
+        callback = serviceutils.write_config_file(self.config)
+        with self.patch_all(
+                configuration_changed=True,
+                previous_options=previous_options) as mocks:
+            self.get_client(mocks).execute.return_value = (
+                '# Replication\r\nrole:slave\r\n')
+            callback('foo')
+        self.assertFalse(mocks.service_restart.called)
+        self.get_client(mocks).execute.assert_called_with(
+            'REPLICAOF', 'NO', 'ONE')
+
+    def test_slaveof_old_redis_version(self):
+        slave_relation = make_relation({'hostname': '4.3.2.1', 'port': 90})
+        callback = serviceutils.write_config_file(
+            self.config, slave_relation=slave_relation)
+        with self.patch_all(
+                configuration_changed=True,
+                previous_options=self.previous_options,
+                version='5:4.0.9-1') as mocks:
+            self.get_client(mocks).execute.return_value = (
+                '# Replication\r\nrole:master\r\n')
+            callback('foo')
+        self.get_client(mocks).execute.assert_called_with(
+            'SLAVEOF', '4.3.2.1', '90')
+
+    def test_initial_sync_admitted(self):
+        slave_relation = make_relation({'hostname': '4.3.2.1', 'port': 90})
+        config = dict(self.config, **{'sync-batch-size': 3})
+        callback = serviceutils.write_config_file(
+            config, slave_relation=slave_relation)
+        with self.patch_all(
+                configuration_changed=True,
+                previous_options=self.previous_options) as mocks:
+            with mock.patch('replicationutils.admit_sync',
+                            mock.Mock(return_value=True)) as mock_admit:
+                callback('foo')
+        mock_admit.assert_called_once_with(config)
+        self.assertEqual('4.3.2.1 90', mocks.write.call_args[0][0]['slaveof'])
+        self.assertEqual(1, mocks.wait_until_ready.call_count)
+
+    def test_initial_sync_waiting(self):
+        slave_relation = make_relation({
+            'hostname': '4.3.2.1', 'password': 'secret!', 'port': 90})
+        config = dict(self.config, **{'sync-batch-size': 3})
+        callback = serviceutils.write_config_file(
+            config, slave_relation=slave_relation)
+        with self.patch_all(
+                configuration_changed=True,
+                previous_options=self.previous_options) as mocks:
+            with mock.patch('replicationutils.admit_sync',
+                            mock.Mock(return_value=False)):
+                callback('foo')
+        options = mocks.write.call_args[0][0]
+        self.assertNotIn('slaveof', options)
+        self.assertNotIn('masterauth', options)
+        self.assertFalse(mocks.service_restart.called)
+        self.assertFalse(mocks.wait_until_ready.called)
+
+    def test_repointed(self):
+        # Replicas changing master are not admitted again.
+        slave_relation = make_relation({'hostname': '4.3.2.1', 'port': 90})
+        previous_options = dict(
+            self.previous_options, slaveof='4.3.2.2 90')
+        config = dict(self.config, **{'sync-batch-size': 3})
+        callback = serviceutils.write_config_file(
+            config, slave_relation=slave_relation)
+        with self.patch_all(
+                configuration_changed=True,
+                previous_options=previous_options) as mocks:
+            with mock.patch('replicationutils.admit_sync') as mock_admit:
+                callback('foo')
+        self.assertFalse(mock_admit.called)
+        self.assertEqual('4.3.2.1 90', mocks.write.call_args[0][0]['slaveof'])
+        self.assertFalse(mocks.wait_until_ready.called)
+
+    def test_initial_sync_with_dataset(self):
+        slave_relation = make_relation({'hostname': '4.3.2.1', 'port': 90})
+        config = dict(self.config, **{'sync-batch-size': 3})
+        callback = serviceutils.write_config_file(
+            config, slave_relation=slave_relation)
+        with self.patch_all(
+                configuration_changed=True,
+                previous_options=self.previous_options) as mocks:
+            mocks.is_fresh.return_value = False
+            with mock.patch('replicationutils.admit_sync') as mock_admit:
+                callback('foo')
+        self.assertFalse(mock_admit.called)
+        self.assertEqual('4.3.2.1 90', mocks.write.call_args[0][0]['slaveof'])
+        # The running server is queried.
+        mocks.is_fresh.assert_called_once_with('1.2.3.4', 4242, 'secret!')
+
+    def test_initial_sync_empty_dump(self):
+        # A new unit writes an empty dump.rdb when it is first restarted, but
+        # it is still fresh: the live server is checked, not the disk.
+        slave_relation = make_relation({'hostname': '4.3.2.1', 'port': 90})
+        config = dict(self.config, **{'sync-batch-size': 3})
+        callback = serviceutils.write_config_file(
+            config, slave_relation=slave_relation)
+        is_fresh = replicationutils.is_fresh
+        with self.patch_all(
+                configuration_changed=True,
+                previous_options=self.previous_options) as mocks:
+            mocks.is_fresh.side_effect = is_fresh
+            self.get_client(mocks).execute.return_value = (
+                '# Replication\r\nrole:master\r\nmaster_repl_offset:0\r\n'
+                '# Keyspace\r\n')
+            with mock.patch('os.path.exists', mock.Mock(return_value=True)):
+                with mock.patch('replicationutils.admit_sync',
+                                mock.Mock(return_value=True)) as mock_admit:
+                    callback('foo')
+        mock_admit.assert_called_once_with(config)
+        self.assertEqual(1, mocks.wait_until_ready.call_count)
+
+    def test_initial_sync_already_replicating(self):
+        slave_relation = make_relation({'hostname': '4.3.2.1', 'port': 90})
+        previous_options = dict(
+            self.previous_options, slaveof='4.3.2.1 90')
+        callback = serviceutils.write_config_file(
+            self.config, slave_relation=slave_relation)
+        with self.patch_all(
+                configuration_changed=True,
+                previous_options=previous_options) as mocks:
+            with mock.patch('replicationutils.admit_sync') as mock_admit:
+                callback('foo')
+        self.assertFalse(mock_admit.called)
+        self.assertFalse(mocks.wait_until_ready.called)
+
+
+class TestGetServiceOptions(
+        WriteConfigFileMixin, unittest.TestCase):
+
+    config = TestWriteConfigFileRuntimeChanges.config
+
+    def get_options(self, version='5:6.0.16-1ubuntu1', **kwargs):
+        """Return the options written using the config updated with kwargs."""
+        callback = serviceutils.write_config_file(dict(self.config, **kwargs))
+        with self.patch_all(version=version) as mocks:
+            callback('foo')
+        return mocks.write.call_args[0][0]
+
+    def test_none(self):
+        options = self.get_options(persistence='none')
+        self.assertEqual('no', options['appendonly'])
+        self.assertEqual(['""'], options['save'])
+        self.assertNotIn('appendfsync', options)
+
+    def test_rdb(self):
+        options = self.get_options(persistence='rdb')
+        self.assertEqual('no', options['appendonly'])
+        self.assertEqual(
+            ['""', '900 1', '300 10', '60 10000'], options['save'])
+        self.assertEqual('yes', options['rdb-save-incremental-fsync'])
+        self.assertNotIn('appendfsync', options)
+
+    def test_aof(self):
+        options = self.get_options(
+            persistence='aof', appendfsync='always',
+            **{'no-appendfsync-on-rewrite': True})
+        self.assertEqual(['""'], options['save'])
+        self.assertNotIn('rdb-save-incremental-fsync', options)
+        expected_options = {
+            'aof-use-rdb-preamble': 'yes',
+            'appendfsync': 'always',
+            'appendonly': 'yes',
+            'auto-aof-rewrite-min-size': '64mb',
+            'auto-aof-rewrite-percentage': 100,
+            'no-appendfsync-on-rewrite': 'yes',
+        }
+        for key, value in expected_options.items():
+            self.assertEqual(value, options[key])
+
+    def test_rdb_and_aof(self):
+        options = self.get_options(persistence='rdb+aof')
+        self.assertEqual('yes', options['appendonly'])
+        self.assertEqual('everysec', options['appendfsync'])
+        self.assertEqual('no', options['no-appendfsync-on-rewrite'])
+        self.assertEqual(
+            ['""', '900 1', '300 10', '60 10000'], options['save'])
+
+    def test_old_redis_version(self):
+        options = self.get_options(
+            persistence='rdb+aof', version='3:3.0.6-1')
+        self.assertNotIn('aof-use-rdb-preamble', options)
+        self.assertNotIn('rdb-save-incremental-fsync', options)
+
+    def test_tcp_backlog(self):
+        options = self.get_options(**{'kernel-tuning': True})
+        self.assertEqual(511, options['tcp-backlog'])
+
+    def test_tcp_backlog_no_kernel_tuning(self):
+        options = self.get_options()
+        self.assertNotIn('tcp-backlog', options)
+
+    def test_io_threads(self):
+        options = self.get_options(
+            **{'io-threads': '4', 'io-threads-do-reads': True})
+        self.assertEqual(4, options['io-threads'])
+        self.assertEqual('yes', options['io-threads-do-reads'])
+
+    def test_io_threads_disabled(self):
+        options = self.get_options()
+        self.assertNotIn('io-threads', options)
+        self.assertNotIn('io-threads-do-reads', options)
+
+    def test_io_threads_old_redis_version(self):
+        options = self.get_options(
+            version='5:5.0.7-2', **{'io-threads': '4'})
+        self.assertNotIn('io-threads', options)
+        self.assertNotIn('io-threads-do-reads', options)
+
+    def test_slave_additional_instances(self):
+        config = dict(self.config, instances=3)
+        slave_relation = make_relation({
+            'endpoints': '4.3.2.1:90 4.3.2.1:91',
+            'hostname': '4.3.2.1',
+            'password': 'secret!',
+            'port': 90,
+        })
+        callback = serviceutils.write_config_file(
+            config, slave_relation=slave_relation)
+        with self.patch_all() as mocks:
+            with mock.patch('charmhelpers.core.host.mkdir'):
+                callback('foo')
+        calls = mocks.write.call_args_list
+        self.assertEqual(
+            [settings.REDIS_CONF, '/etc/redis/redis-1.conf',
+             '/etc/redis/redis-2.conf'],
+            [call[0][1] for call in calls])
+        options = [call[0][0] for call in calls]
+        self.assertEqual('4.3.2.1 90', options[0]['slaveof'])
+        self.assertEqual('secret!', options[0]['masterauth'])
+        self.assertEqual('4.3.2.1 91', options[1]['slaveof'])
+        self.assertEqual(4243, options[1]['port'])
+        self.assertEqual('/var/lib/redis/instance-1', options[1]['dir'])
+        self.assertNotIn('slaveof', options[2])
+        self.assertNotIn('masterauth', options[2])
+
+    def test_additional_instances_daemonize(self):
+        config = dict(self.config, instances=2)
+        callback = serviceutils.write_config_file(config)
+        with self.patch_all() as mocks:
+            with mock.patch('charmhelpers.core.host.mkdir'):
+                callback('foo')
+        calls = mocks.write.call_args_list
+        self.assertEqual('/etc/redis/redis-1.conf', calls[1][0][1])
+        options = calls[1][0][0]
+        self.assertEqual('yes', options['daemonize'])
+        self.assertEqual('no', options['supervised'])
+        self.assertEqual(
+            '/run/redis-1/redis-server.pid', options['pidfile'])
+        # The main instance uses the settings of the default configuration.
+        self.assertNotIn('daemonize', calls[0][0][0])
+
+    def test_cluster(self):
+        options = self.get_options(
+            **{'cluster-enabled': True, 'cluster-node-timeout': 5000})
+        self.assertEqual('yes', options['cluster-enabled'])
+        self.assertEqual('nodes.conf', options['cluster-config-file'])
+        self.assertEqual(5000, options['cluster-node-timeout'])
+
+    def test_cluster_old_redis_version(self):
+        options = self.get_options(
+            version='5:4.0.9-1',
+            **{'cluster-enabled': True, 'cluster-node-timeout': 5000})
+        self.assertNotIn('cluster-enabled', options)
+        self.assertNotIn('cluster-config-file', options)
+        self.assertNotIn('cluster-node-timeout', options)
+
+    def test_repl_backlog_size(self):
+        options = self.get_options(**{'repl-backlog-size': '64mb'})
+        self.assertEqual(64 * 1024 * 1024, options['repl-backlog-size'])
+
+    def test_diskless_sync(self):
+        options = self.get_options(**{
+            'repl-diskless-sync': True,
+            'repl-diskless-sync-delay': 10,
+        })
+        self.assertEqual('yes', options['repl-diskless-sync'])
+        self.assertEqual(10, options['repl-diskless-sync-delay'])
+        self.assertNotIn('repl-diskless-load', options)
+        self.assertNotIn('replica-lazy-flush', options)
+
+    def test_diskless_load(self):
+        slave_relation = make_relation({'hostname': '4.3.2.1', 'port': 90})
+        config = dict(self.config, **{
+            'repl-diskless-load': 'swapdb',
+            'replica-lazy-flush': True,
+        })
+        callback = serviceutils.write_config_file(
+            config, slave_relation=slave_relation)
+        with self.patch_all() as mocks:
+            callback('foo')
+        options = mocks.write.call_args[0][0]
+        self.assertEqual('swapdb', options['repl-diskless-load'])
+        self.assertEqual('yes', options['replica-lazy-flush'])
+
+    def test_diskless_load_old_redis_version(self):
+        slave_relation = make_relation({'hostname': '4.3.2.1', 'port': 90})
+        callback = serviceutils.write_config_file(
+            self.config, slave_relation=slave_relation)
+        with self.patch_all(version='5:5.0.7-2') as mocks:
+            callback('foo')
+        options = mocks.write.call_args[0][0]
+        self.assertNotIn('repl-diskless-load', options)
+        self.assertEqual('no', options['replica-lazy-flush'])
+
+    def test_invalid_diskless_load(self):
+        slave_relation = make_relation({'hostname': '4.3.2.1', 'port': 90})
+        config = dict(self.config, **{'repl-diskless-load': 'bad-wolf'})
+        callback = serviceutils.write_config_file(
+            config, slave_relation=slave_relation)
+        with self.patch_all():
+            with self.assertRaises(ValueError) as ctx:
+                callback('foo')
+        self.assertEqual(
+            "invalid diskless load mode: 'bad-wolf'", str(ctx.exception))
+
+    def test_unixsocket(self):
+        options = self.get_options(
+            unixsocket='/run/redis/redis.sock', unixsocketperm='700')
+        self.assertEqual('/run/redis/redis.sock', options['unixsocket'])
+        self.assertEqual('700', options['unixsocketperm'])
+
+    def test_unixsocket_disabled(self):
+        options = self.get_options()
+        self.assertNotIn('unixsocket', options)
+        self.assertNotIn('unixsocketperm', options)
+
+    def test_sentinel_failover(self):
+        with mock.patch('sentinelutils.get_current_master',
+                        mock.Mock(return_value=('4.3.2.1', 90))):
+            options = self.get_options(
+                password='secret!', **{'sentinel-enabled': True})
+        self.assertEqual('4.3.2.1 90', options['slaveof'])
+        self.assertEqual('secret!', options['masterauth'])
+
+    def test_sentinel_promoted(self):
+        slave_relation = make_relation({'hostname': '4.3.2.1', 'port': 90})
+        config = dict(self.config, **{'sentinel-enabled': True})
+        callback = serviceutils.write_config_file(
+            config, slave_relation=slave_relation)
+        with mock.patch('sentinelutils.get_current_master',
+                        mock.Mock(return_value=('1.2.3.4', 4242))):
+            with self.patch_all() as mocks:
+                callback('foo')
+        options = mocks.write.call_args[0][0]
+        self.assertNotIn('slaveof', options)
+        self.assertNotIn('masterauth', options)
+
+    def test_sentinel_not_monitoring(self):
+        slave_relation = make_relation({'hostname': '4.3.2.1', 'port': 90})
+        config = dict(self.config, **{'sentinel-enabled': True})
+        callback = serviceutils.write_config_file(
+            config, slave_relation=slave_relation)
+        with mock.patch('sentinelutils.get_current_master',
+                        mock.Mock(return_value=None)):
+            with self.patch_all() as mocks:
+                callback('foo')
+        self.assertEqual('4.3.2.1 90', mocks.write.call_args[0][0]['slaveof'])
+
+    def test_peer_replication(self):
+        with mock.patch('electionutils.get_master_endpoint',
+                        mock.Mock(return_value=('1.2.3.5', 4242))):
+            options = self.get_options(
+                password='secret!', **{'peer-replication': True})
+        self.assertEqual('1.2.3.5 4242', options['slaveof'])
+        self.assertEqual('secret!', options['masterauth'])
+
+    def test_peer_replication_master(self):
+        with mock.patch('electionutils.get_master_endpoint',
+                        mock.Mock(return_value=None)):
+            options = self.get_options(**{'peer-replication': True})
+        self.assertNotIn('slaveof', options)
+
+    def test_invalid_profile(self):
+        with self.assertRaises(ValueError) as ctx:
+            self.get_options(persistence='bad-wolf')
+        self.assertEqual(
+            "invalid persistence profile: 'bad-wolf'", str(ctx.exception))
+
+
+@mock.patch('resources.get_memory_limit', mock.Mock(return_value=8 * 1024))
+class TestGetMaxmemory(unittest.TestCase):
+
+    def test_auto(self):
+        maxmemory = serviceutils._get_maxmemory('auto')
+        self.assertEqual(4 * 1024, maxmemory)
+
+    def test_multiple_instances(self):
+        self.assertEqual(1024, serviceutils._get_maxmemory('auto', 4))
+        self.assertEqual(1024, serviceutils._get_maxmemory('25%', 2))
+        self.assertEqual(2048, serviceutils._get_maxmemory('2kb', 2))
+
+    def test_percentage(self):
+        maxmemory = serviceutils._get_maxmemory('75%')
+        self.assertEqual(6 * 1024, maxmemory)
+
+    def test_absolute(self):
+        maxmemory = serviceutils._get_maxmemory('2kb')
+        self.assertEqual(2048, maxmemory)
+
+    def test_invalid_percentage(self):
+        for value in ('bad%', '0%', '101%'):
+            with self.assertRaises(ValueError) as ctx:
+                serviceutils._get_maxmemory(value)
+            expected_error = 'invalid memory percentage: {!r}'.format(value)
+            self.assertEqual(expected_error, str(ctx.exception))
+
+    def test_invalid_size(self):
+        with self.assertRaises(ValueError) as ctx:
+            serviceutils._get_maxmemory('lots')
+        self.assertEqual("invalid memory size: 'lots'", str(ctx.exception))
+
+
+@mock.patch('kerneltuning.remove')
+@mock.patch('kerneltuning.apply')
+class TestConfigureKernel(unittest.TestCase):
+
+    def test_enabled(self, mock_apply, mock_remove):
+        config = {'kernel-tuning': True, 'tcp-backlog': 2048}
+        serviceutils.configure_kernel(config)('foo')
+        mock_apply.assert_called_once_with(2048)
+        self.assertFalse(mock_remove.called)
+
+    def test_disabled(self, mock_apply, mock_remove):
+        config = {'kernel-tuning': False, 'tcp-backlog': 2048}
+        serviceutils.configure_kernel(config)('foo')
+        self.assertFalse(mock_apply.called)
+        mock_remove.assert_called_once_with()
+
+
+class TestGetIoThreads(unittest.TestCase):
+
+    def test_auto(self):
+        expected_threads = {1: 1, 2: 1, 3: 1, 4: 3, 8: 6, 10: 7, 64: 8}
+        for cpus, threads in expected_threads.items():
+            with mock.patch(
+                    'resources.get_cpu_count', mock.Mock(return_value=cpus)):
+                self.assertEqual(threads, serviceutils._get_io_threads('auto'))
+
+    def test_auto_multiple_instances(self):
+        with mock.patch(
+                'resources.get_cpu_count', mock.Mock(return_value=16)):
+            self.assertEqual(3, serviceutils._get_io_threads('auto', 4))
+
+    def test_number(self):
+        self.assertEqual(1, serviceutils._get_io_threads('1'))
+        self.assertEqual(6, serviceutils._get_io_threads(' 6 '))
+
+    def test_invalid(self):
+        for value in ('0', 'many', '-2'):
+            with self.assertRaises(ValueError) as ctx:
+                serviceutils._get_io_threads(value)
+            expected_error = 'invalid number of I/O threads: {!r}'.format(
+                value)
+            self.assertEqual(expected_error, str(ctx.exception))
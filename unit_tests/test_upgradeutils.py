@@ -0,0 +1,224 @@
+# Copyright 2015 Canonical Ltd.
+# Licensed under the GPLv3, see copyright file for details.
+
+import contextlib
+import os
+from pkg_resources import resource_filename
+import shutil
+import sys
+import tempfile
+import unittest
+
+import mock
+
+# Allow importing modules and packages from the hooks directory.
+sys.path.append(resource_filename(__name__, '../hooks'))
+
+import settings
+import upgradeutils
+
+
+def patch_kv(data):
+    """Patch the unit key/value store, backing it with the given dict."""
+    kv = mock.Mock()
+    kv.get.side_effect = lambda key, default=None: data.get(key, default)
+    kv.set.side_effect = data.__setitem__
+    return mock.patch(
+        'charmhelpers.core.unitdata.kv', mock.Mock(return_value=kv))
+
+
+def patch_leader_get(values):
+    """Patch the "charmhelpers.core.hookenv.leader_get" function.
+
+    The mocked function returns the values from the given dict.
+    """
+    return mock.patch(
+        'charmhelpers.core.hookenv.leader_get', values.get)
+
+
+@mock.patch('charmhelpers.core.hookenv.unit_private_ip',
+            mock.Mock(return_value='1.2.3.4'))
+@mock.patch('hookutils.log', mock.Mock())
+class TestUpgrade(unittest.TestCase):
+
+    config = {
+        'cluster-enabled': False,
+        'instances': 2,
+        'password': 'secret!',
+        'port': 4242,
+        'sentinel-enabled': False,
+    }
+
+    def setUp(self):
+        # Set up a playground for the policy script written by the charm.
+        playground = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, playground)
+        self.policy = os.path.join(playground, 'policy-rc.d')
+        patch = mock.patch('settings.POLICY_RC_D', self.policy)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    @contextlib.contextmanager
+    def patch_all(self, data, token='2015-10-21', granted=True):
+        """Patch the functions used to upgrade redis."""
+        mocks = {
+            'apt_install': mock.patch('charmhelpers.fetch.apt_install'),
+            'apt_update': mock.patch('charmhelpers.fetch.apt_update'),
+            'coordinator': mock.patch('upgradeutils.UpgradeCoordinator'),
+            'kv': patch_kv(data),
+            'leader_get': patch_leader_get(
+                {settings.UPGRADE_LEADER_KEY: token}),
+            'update_relations': mock.patch('serviceutils.update_relations'),
+            'warm_restart': mock.patch('restartutils.warm_restart'),
+        }
+        with contextlib.nested(*mocks.values()) as context_managers:
+            patched = dict(zip(mocks.keys(), context_managers))
+            patched['coordinator'].return_value.acquire.return_value = granted
+            yield type('Mocks', (), patched)
+
+    def test_upgrade(self):
+        data = {}
+        relations = [mock.Mock()]
+        with self.patch_all(data) as mocks:
+            upgradeutils.upgrade(self.config, relations)('foo')
+        mocks.coordinator.return_value.acquire.assert_called_once_with(
+            settings.UPGRADE_LOCK)
+        mocks.apt_update.assert_called_once_with(fatal=True)
+        mocks.apt_install.assert_called_once_with(
+            ['redis-server'], fatal=True)
+        mocks.warm_restart.assert_has_calls([
+            mock.call('redis-server', '1.2.3.4', 4242, 'secret!',
+                      timeout=settings.SYNC_TIMEOUT),
+            mock.call('redis-server@1', '1.2.3.4', 4243, 'secret!',
+                      timeout=settings.SYNC_TIMEOUT),
+        ])
+        self.assertEqual('2015-10-21', data['upgradeutils.completed'])
+        mocks.update_relations.assert_called_once_with(relations)
+        self.assertFalse(os.path.exists(self.policy))
+
+    def test_no_package_restarts(self):
+        policies = []
+
+        def apt_install(packages, fatal):
+            with open(self.policy) as policy_file:
+                policies.append(policy_file.read())
+            self.assertFalse(mocks.warm_restart.called)
+
+        with self.patch_all({}) as mocks:
+            mocks.apt_install.side_effect = apt_install
+            upgradeutils.upgrade(self.config)('foo')
+        # The package scripts were prevented from restarting the servers.
+        self.assertEqual(['#!/bin/sh\nexit 101\n'], policies)
+        self.assertFalse(os.path.exists(self.policy))
+        self.assertTrue(mocks.warm_restart.called)
+
+    def test_existing_policy(self):
+        with open(self.policy, 'w') as policy_file:
+            policy_file.write('exit 0\n')
+        with self.patch_all({}) as mocks:
+            upgradeutils.upgrade(self.config)('foo')
+        self.assertTrue(mocks.apt_install.called)
+        with open(self.policy) as policy_file:
+            self.assertEqual('exit 0\n', policy_file.read())
+
+    def test_upgrade_sentinel(self):
+        config = dict(self.config, **{'sentinel-enabled': True})
+        with self.patch_all({}) as mocks:
+            upgradeutils.upgrade(config)('foo')
+        mocks.apt_install.assert_called_once_with(
+            ['redis-server', 'redis-sentinel'], fatal=True)
+
+    def test_waiting(self):
+        data = {}
+        with self.patch_all(data, granted=False) as mocks:
+            upgradeutils.upgrade(self.config)('foo')
+        self.assertFalse(mocks.apt_install.called)
+        self.assertFalse(mocks.warm_restart.called)
+        self.assertFalse(mocks.update_relations.called)
+        self.assertEqual({}, data)
+
+    def test_already_upgraded(self):
+        data = {'upgradeutils.completed': '2015-10-21'}
+        with self.patch_all(data) as mocks:
+            upgradeutils.upgrade(self.config)('foo')
+        self.assertFalse(mocks.coordinator.called)
+        self.assertFalse(mocks.apt_install.called)
+
+    def test_not_requested(self):
+        with self.patch_all({}, token=None) as mocks:
+            upgradeutils.upgrade(self.config)('foo')
+        self.assertFalse(mocks.coordinator.called)
+
+
+@mock.patch('hookutils.log', mock.Mock())
+class TestUpgradeCoordinator(unittest.TestCase):
+
+    units = {
+        'redis/0': {'endpoints': '1.2.3.4:4242', 'upgraded': '2015-10-21'},
+        'redis/1': {'endpoints': '1.2.3.5:4242', 'upgraded': ''},
+        'redis/2': {'endpoints': '1.2.3.6:4242', 'upgraded': ''},
+    }
+
+    def grant(self, unit, granted, queue, units=None, peer_replication=True):
+        """Return whether the upgrade lock is granted to the given unit.
+
+        Also return the mock failover function.
+        """
+        config = {
+            'cluster-enabled': False,
+            'peer-replication': peer_replication,
+        }
+        # Avoid instantiating the singleton, which requires a hook context.
+        coordinator = upgradeutils.UpgradeCoordinator.__new__(
+            upgradeutils.UpgradeCoordinator)
+        leader_settings = {
+            settings.MASTER_LEADER_KEY: '1.2.3.4:4242',
+            settings.UPGRADE_LEADER_KEY: '2015-10-21',
+        }
+        with contextlib.nested(
+            mock.patch('upgradeutils._get_units',
+                       mock.Mock(return_value=units or self.units)),
+            mock.patch('charmhelpers.core.hookenv.config',
+                       mock.Mock(return_value=config)),
+            patch_leader_get(leader_settings),
+            mock.patch('electionutils.failover'),
+        ) as (_, _, _, mock_failover):
+            granted = coordinator.grant_upgrade(
+                'upgrade', unit, granted, queue)
+        return granted, mock_failover
+
+    def test_replicas_first(self):
+        queue = ['redis/0', 'redis/1', 'redis/2']
+        self.assertFalse(self.grant('redis/0', set(), queue)[0])
+        self.assertTrue(self.grant('redis/1', set(), queue)[0])
+        self.assertFalse(self.grant('redis/2', set(), queue)[0])
+
+    def test_one_at_a_time(self):
+        granted = set(['redis/1'])
+        self.assertFalse(self.grant('redis/2', granted, ['redis/2'])[0])
+
+    def test_master_waiting(self):
+        # The other units have not requested the lock yet.
+        granted, mock_failover = self.grant('redis/0', set(), ['redis/0'])
+        self.assertFalse(granted)
+        self.assertFalse(mock_failover.called)
+
+    def test_master_failover(self):
+        units = dict(self.units)
+        units['redis/1'] = dict(units['redis/1'], upgraded='2015-10-21')
+        units['redis/2'] = dict(units['redis/2'], upgraded='2015-10-21')
+        granted, mock_failover = self.grant(
+            'redis/0', set(), ['redis/0'], units=units)
+        self.assertTrue(granted)
+        mock_failover.assert_called_once_with(
+            {'cluster-enabled': False, 'peer-replication': True}, mock.ANY)
+        self.assertEqual(
+            ['1.2.3.4:4242', '1.2.3.5:4242', '1.2.3.6:4242'],
+            sorted(mock_failover.call_args[0][1]))
+
+    def test_no_peer_replication(self):
+        queue = ['redis/0', 'redis/1']
+        granted, mock_failover = self.grant(
+            'redis/0', set(), queue, peer_replication=False)
+        self.assertTrue(granted)
+        self.assertFalse(mock_failover.called)